@@ -18,6 +18,7 @@ from scanpy import settings
 from scanpy.plotting._utils import ticks_formatter
 
 from ..util.graph import _distance_to_connectivity
+from ..ir_dist import CellIndices
 from .styling import _get_colors, _init_ax
 from .._tools._clonotypes import _graph_from_coordinates, _doc_clonotype_network
 from ..util import _doc_params
@@ -226,7 +227,7 @@ def clonotype_network(
         color=color,
         coords=coords,
         use_raw=use_raw,
-        cell_indices=clonotype_res["cell_indices"],
+        cell_indices=CellIndices.from_uns(clonotype_res["cell_indices"]),
         nx_graph=nx_graph,
         show_legend=show_legend,
         show_size_legend=show_size_legend,
@@ -339,12 +340,20 @@ def _plot_clonotype_network_panel(
     if isinstance(color, str) and is_color_like(color):
         color = [color for c in range(coords.shape[0])]
 
+    # clonotype (=row in the distance matrix) of each cell
+    cell_clonotypes = cell_indices.cell_clonotypes(adata.obs_names)
+    has_clonotype = cell_clonotypes >= 0
+    dist_idx = coords["dist_idx"].values.astype(int)
+
     def _aggregate_per_dot_continuous(values):
-        x_color = []
-        for dist_idx in coords["dist_idx"]:
-            cell_ids = cell_indices[dist_idx]
-            x_color.append(np.mean(values[adata.obs_names.isin(cell_ids)]))
-        return x_color
+        # missing values are ignored, consistent with `pd.Series.mean`
+        values = np.asarray(values, dtype=float)
+        keep = has_clonotype & ~np.isnan(values)
+        values, clonotypes = values[keep], cell_clonotypes[keep]
+        sums = np.bincount(clonotypes, weights=values, minlength=len(cell_indices))
+        counts = np.bincount(clonotypes, minlength=len(cell_indices))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return list(sums[dist_idx] / counts[dist_idx])
 
     # plot gene expression
     var_names = adata.raw.var_names if use_raw else adata.var_names
@@ -385,19 +394,33 @@ def _plot_clonotype_network_panel(
     ):
         pie_colors = []
         values = adata.obs[color].values
+        categories = np.asarray(values.categories)
         # cycle colors for categories with many values instead of
         # coloring them in grey
         if palette is None:
             if adata.obs[color].nunique() > len(sc.pl.palettes.default_102):
                 palette = cycler(color=sc.pl.palettes.default_102)
         cat_colors = _get_colors(adata, obs_key=color, palette=palette)
-        for dist_idx in coords["dist_idx"]:
-            cell_ids = cell_indices[dist_idx]
-            unique, counts = np.unique(
-                values[adata.obs_names.isin(cell_ids)], return_counts=True
+        # count the cells of each category per dot. Categories are sorted
+        # by value to obtain a consistent order of the pie segments.
+        dot_idx = np.full(len(cell_indices), -1)
+        dot_idx[dist_idx] = np.arange(len(dist_idx))
+        cell_dots = np.where(has_clonotype, dot_idx[cell_clonotypes], -1)
+        keep = (cell_dots >= 0) & (values.codes >= 0)
+        counts = np.bincount(
+            cell_dots[keep] * len(categories) + values.codes[keep],
+            minlength=len(dist_idx) * len(categories),
+        ).reshape(len(dist_idx), len(categories))
+        cat_order = np.argsort(categories, kind="stable")
+        for row in counts[:, cat_order]:
+            nonzero = row > 0
+            fracs = row[nonzero] / np.sum(row)
+            pie_colors.append(
+                {
+                    cat_colors[c]: f
+                    for c, f in zip(categories[cat_order][nonzero], fracs)
+                }
             )
-            fracs = counts / np.sum(counts)
-            pie_colors.append({cat_colors[c]: f for c, f in zip(unique, fracs)})
 
     # create panel for legend(s)
     legend_ax = None
@@ -8,6 +8,8 @@ from ._clonotype_imbalance import clonotype_imbalance
 from ._clonotypes import (
     define_clonotypes,
     define_clonotype_clusters,
+    assign_clonotypes,
+    clonotype_cluster_hierarchy,
     clonotype_network,
     clonotype_network_igraph,
 )
@@ -1,4 +1,3 @@
-import itertools
 import random
 from typing import List, Optional, Sequence, Tuple, Union
 
@@ -6,15 +5,32 @@ import igraph as ig
 import numpy as np
 import pandas as pd
 from anndata import AnnData
+from pandas.api.types import is_categorical_dtype
 from scanpy import logging
 import scipy.sparse as sp
 
 from .._compat import Literal
 from .._preprocessing import ir_dist
-from ..ir_dist import MetricType, _get_metric_key
-from ..ir_dist._clonotype_neighbors import ClonotypeNeighbors
+from ..ir_dist import (
+    MetricType,
+    CellIndices,
+    _get_metric_key,
+    _get_distance_calculator,
+    _get_unique_seqs,
+)
+from ..ir_dist._clonotype_neighbors import (
+    ClonotypeNeighbors,
+    ClonotypeNeighborContext,
+    _factorize,
+)
 from ..util import _doc_params
-from ..util.graph import igraph_from_sparse_matrix, layout_components
+from ..util.graph import (
+    igraph_from_sparse_matrix,
+    layout_components,
+    connected_components,
+    leiden_components,
+    UnionFind,
+)
 from ..io._util import _check_upgrade_schema
 
 _common_doc = """\
@@ -74,6 +90,17 @@ chunksize
     but more overhead.
 """
 
+_doc_context = """\
+context
+    A :class:`~scirpy.ir_dist.ClonotypeNeighborContext` built with
+    :meth:`~scirpy.ir_dist.ClonotypeNeighborContext.from_adata` for the same
+    `adata`, `sequence` and `metric`. The clonotype table is then built only once
+    for repeated calls with different `receptor_arms`, `dual_ir` and
+    `same_v_gene`. Build a new context after modifying `adata.obs` or
+    running :func:`~scirpy.pp.ir_dist`. If `None`, a context is built for this
+    call only.
+"""
+
 _common_doc_return_values = """\
 Returns
 -------
@@ -88,8 +115,17 @@ distance_result
     A dictionary containing
      * `distances`: A sparse, pairwise distance matrix between unique
        receptor configurations
-     * `cell_indices`: A dict of arrays, containing the adata.obs_names
-       (cell indices) for each row in the distance matrix.
+     * `cell_indices`: The cells of each row in the distance matrix in
+       compressed sparse row format. Use :meth:`scirpy.ir_dist.CellIndices.from_uns`
+       to access the obs names of each row.
+     * `components`: The connected component of each row in the distance matrix
+       (`membership`) and the number of rows (`n_nodes`) and cells (`n_cells`)
+       of each component.
+     * `params`: The parameters used for defining the clonotypes, see
+       :func:`~scirpy.tl.assign_clonotypes`.
+
+    Use :meth:`scirpy.ir_dist.ClonotypeCellOperator.from_adata` for a cell x cell
+    view on the distance matrix.
 
     If `inplace` is `True`, this is added to `adata.uns[key_added]`.
 """
@@ -164,12 +200,59 @@ def _validate_parameters(
     return within_group, distance_key, key_added
 
 
+def _membership_by_cell(
+    membership: Sequence[int], cell_indices: CellIndices, obs_names: pd.Index
+) -> pd.Series:
+    """Expand the cluster of each clonotype to the cells of the clonotype.
+    Cells without clonotype are `nan`."""
+    cell_clonotypes = cell_indices.cell_clonotypes(obs_names)
+    clusters = np.asarray(membership).astype(str).astype(object)[cell_clonotypes]
+    clusters[cell_clonotypes < 0] = np.nan
+    return pd.Series(clusters, index=obs_names)
+
+
+def _cluster_size_by_cell(
+    membership: Sequence[int], cell_indices: CellIndices, obs_names: pd.Index
+) -> pd.Series:
+    """The number of cells in the cluster of each cell, counted from the cluster
+    sizes instead of grouping the cluster labels. Cells without clonotype are `nan`."""
+    membership = np.asarray(membership, dtype=np.int64)
+    cluster_sizes = np.bincount(membership, weights=cell_indices.sizes).astype(np.int64)
+    cell_clonotypes = cell_indices.cell_clonotypes(obs_names)
+    sizes = cluster_sizes[membership[cell_clonotypes]]
+    if np.any(cell_clonotypes < 0):
+        # same dtype as counting with `groupby`
+        sizes = np.where(cell_clonotypes >= 0, sizes, np.nan)
+    return pd.Series(sizes, index=obs_names)
+
+
+def _clonotype_components(
+    distances: sp.spmatrix,
+    cell_indices: CellIndices,
+    membership: Optional[np.ndarray] = None,
+) -> dict:
+    """The connected components of the clonotype graph with the number of nodes
+    (clonotypes) and cells of each component, as stored in `adata.uns` for
+    filtering components in :func:`clonotype_network`.
+
+    `membership` can be passed if the components are already known."""
+    if membership is None:
+        membership = connected_components(distances)
+    membership = np.asarray(membership, dtype=np.int64)
+    return {
+        "membership": membership,
+        "n_nodes": np.bincount(membership),
+        "n_cells": np.bincount(membership, weights=cell_indices.sizes).astype(np.int64),
+    }
+
+
 @_check_upgrade_schema()
 @_doc_params(
     common_doc=_common_doc,
     clonotype_definition=_doc_clonotype_definition,
     return_values=_common_doc_return_values,
     paralellism=_common_doc_parallelism,
+    context=_doc_context,
 )
 def define_clonotype_clusters(
     adata: AnnData,
@@ -182,13 +265,17 @@ def define_clonotype_clusters(
     within_group: Union[Sequence[str], str, None] = "receptor_type",
     key_added: str = None,
     partitions: Literal["connected", "leiden"] = "connected",
-    resolution: float = 1,
+    resolution: Union[float, Sequence[float]] = 1,
     n_iterations: int = 5,
+    random_state: Optional[int] = 0,
     distance_key: Union[str, None] = None,
     inplace: bool = True,
     n_jobs: Union[int, None] = None,
     chunksize: int = 2000,
-) -> Optional[Tuple[pd.Series, pd.Series, dict]]:
+    context: Optional[ClonotypeNeighborContext] = None,
+) -> Optional[
+    Union[Tuple[pd.Series, pd.Series, dict], Tuple[pd.DataFrame, pd.DataFrame, dict]]
+]:
     """
     Define :term:`clonotype clusters<Clonotype cluster>`.
 
@@ -231,18 +318,26 @@ def define_clonotype_clusters(
         `connected` to find fully connected sub-graphs.
 
         The difference is that the Leiden algorithm further divides
-        fully connected subgraphs into highly-connected modules.
+        fully connected subgraphs into highly-connected modules. The Leiden
+        algorithm is run separately (and in parallel) for each connected subgraph.
 
     resolution
-        `resolution` parameter for the leiden algorithm.
+        `resolution` parameter for the leiden algorithm. If multiple values are
+        specified, the clonotype clusters for resolution `r` are stored in
+        `{{key_added}}_r{{r}}` and `{{key_added}}_r{{r}}_size`, e.g.
+        `cc_aa_levenshtein_r0.5`, and data frames with one column per resolution
+        are returned instead of series.
     n_iterations
         `n_iterations` parameter for the leiden algorithm.
+    random_state
+        Random seed for the leiden algorithm.
     distance_key
         Key in `adata.uns` where the sequence distances are stored. This defaults
         to `ir_dist_{{sequence}}_{{metric}}`.
     inplace
         If `True`, adds the results to anndata, otherwise returns them.
     {paralellism}
+    {context}
 
     {return_values}
     """
@@ -257,6 +352,7 @@ def define_clonotype_clusters(
         key_added,
     )
 
+    sequence_key = "junction_aa" if sequence == "aa" else "junction"
     ctn = ClonotypeNeighbors(
         adata,
         receptor_arms=receptor_arms,
@@ -264,53 +360,83 @@ def define_clonotype_clusters(
         same_v_gene=same_v_gene,
         within_group=within_group,
         distance_key=distance_key,
-        sequence_key="junction_aa" if sequence == "aa" else "junction",
+        sequence_key=sequence_key,
         n_jobs=n_jobs,
         chunksize=chunksize,
+        context=context,
     )
     clonotype_dist = ctn.compute_distances()
-    g = igraph_from_sparse_matrix(clonotype_dist, matrix_type="distance")
 
+    multiple_resolutions = partitions == "leiden" and not np.isscalar(resolution)
     if partitions == "leiden":
-        part = g.community_leiden(
-            objective_function="modularity",
-            resolution_parameter=resolution,
+        resolutions = np.atleast_1d(resolution)
+        memberships = leiden_components(
+            clonotype_dist,
+            resolution=resolutions,
             n_iterations=n_iterations,
+            random_state=random_state,
+            n_jobs=n_jobs,
         )
     else:
-        part = g.clusters(mode="weak")
-
-    clonotype_cluster_series = pd.Series(data=None, index=adata.obs_names, dtype=str)
-    clonotype_cluster_size_series = pd.Series(
-        data=None, index=adata.obs_names, dtype=int
+        # no need to build the graph for finding connected components
+        memberships = connected_components(clonotype_dist)[np.newaxis, :]
+    keys = (
+        [f"{key_added}_r{r:g}" for r in resolutions]
+        if multiple_resolutions
+        else [key_added]
     )
 
     # clonotype cluster = graph partition
-    idx, values = zip(
-        *itertools.chain.from_iterable(
-            zip(ctn.cell_indices[str(ct_id)], itertools.repeat(str(clonotype_cluster)))
-            for ct_id, clonotype_cluster in enumerate(part.membership)
+    clonotype_clusters, clonotype_cluster_sizes = dict(), dict()
+    for key, membership in zip(keys, memberships):
+        clonotype_cluster_series = _membership_by_cell(
+            membership, ctn.cell_indices, adata.obs_names
+        )
+        clonotype_clusters[key] = clonotype_cluster_series
+        clonotype_cluster_sizes[f"{key}_size"] = _cluster_size_by_cell(
+            membership, ctn.cell_indices, adata.obs_names
         )
-    )
-    clonotype_cluster_series = pd.Series(values, index=idx).reindex(adata.obs_names)
-    clonotype_cluster_size_series = clonotype_cluster_series.groupby(
-        clonotype_cluster_series
-    ).transform("count")
 
     # Return or store results
     clonotype_distance_res = {
         "distances": clonotype_dist,
-        "cell_indices": ctn.cell_indices,
+        "cell_indices": ctn.cell_indices.to_uns(),
+        # required for filtering components in `clonotype_network`
+        "components": _clonotype_components(
+            clonotype_dist,
+            ctn.cell_indices,
+            memberships[0] if partitions == "connected" else None,
+        ),
+        # required for assigning new cells with `assign_clonotypes`
+        "params": {
+            "receptor_arms": receptor_arms,
+            "dual_ir": dual_ir,
+            "same_v_gene": same_v_gene,
+            "within_group": within_group if within_group is not None else [],
+            "distance_key": distance_key,
+            "partitions": partitions,
+        },
     }
     if inplace:
-        adata.obs[key_added] = clonotype_cluster_series
-        adata.obs[key_added + "_size"] = clonotype_cluster_size_series
+        for key in keys:
+            adata.obs[key] = clonotype_clusters[key]
+            adata.obs[f"{key}_size"] = clonotype_cluster_sizes[f"{key}_size"]
         adata.uns[key_added] = clonotype_distance_res
-        logging.info(f'Stored clonal assignments in `adata.obs["{key_added}"]`.')
+        logging.info(
+            f"Stored clonal assignments in `adata.obs` "
+            f"{'columns' if multiple_resolutions else 'column'} "
+            f"{', '.join(f'`{key}`' for key in keys)}."
+        )
+    elif multiple_resolutions:
+        return (
+            pd.DataFrame(clonotype_clusters, index=adata.obs_names),
+            pd.DataFrame(clonotype_cluster_sizes, index=adata.obs_names),
+            clonotype_distance_res,
+        )
     else:
         return (
-            clonotype_cluster_series,
-            clonotype_cluster_size_series,
+            clonotype_clusters[key_added],
+            clonotype_cluster_sizes[f"{key_added}_size"],
             clonotype_distance_res,
         )
 
@@ -377,6 +503,441 @@ def define_clonotypes(
     )
 
 
+@_check_upgrade_schema(check_args=(0, 1))
+@_doc_params(paralellism=_common_doc_parallelism)
+def assign_clonotypes(
+    adata: AnnData,
+    adata_ref: AnnData,
+    *,
+    key: str = "clone_id",
+    inplace: bool = True,
+    n_jobs: Union[int, None] = None,
+    chunksize: int = 2000,
+) -> Optional[Tuple[pd.Series, pd.Series]]:
+    """
+    Assign the cells of a new batch to the :term:`clonotypes <Clonotype>` or
+    :term:`clonotype clusters <Clonotype cluster>` of a reference.
+
+    Requires running :func:`~scirpy.tl.define_clonotypes` or
+    :func:`~scirpy.tl.define_clonotype_clusters` (with `partitions="connected"`)
+    on `adata_ref` first. The same parameters are used for assigning the new cells.
+
+    The result is the same as defining clonotype clusters on the concatenation
+    of both objects, without recomputing the distances of the reference:
+      1. Sequence distances are computed between the new sequences and the
+         sequences of the reference.
+      2. Distances between receptor configurations are computed for the new cells
+         and the reference cells that have a sequence within the distance cutoff
+         of a new sequence.
+      3. New cells join the clusters of the reference cells they are connected to.
+         If a new cell connects multiple reference clusters, they are merged.
+         New cells that are not connected to the reference define new clusters.
+
+    The cost scales with the number of new sequences times the number of reference
+    sequences, and with the number of cells that share sequences with the new cells.
+
+    Parameters
+    ----------
+    adata
+        Annotated data matrix with the new cells
+    adata_ref
+        Annotated data matrix with the reference cells
+    key
+        Key under which the clonotypes are stored in `adata_ref.obs` and
+        `adata_ref.uns`, i.e. the `key_added` parameter of
+        :func:`~scirpy.tl.define_clonotype_clusters`. Defaults to `clone_id`,
+        as used by :func:`~scirpy.tl.define_clonotypes`.
+    inplace
+        If `True`, stores the clonotypes of the new cells in `adata.obs[key]` and
+        the cluster sizes in `adata.obs[f"{{key}}_size"]`, and updates the merged
+        clusters and cluster sizes in `adata_ref.obs`. The clonotype network in
+        `adata_ref.uns[key]` is not updated. Otherwise, returns the clonotypes of
+        the new cells and does not modify `adata_ref`.
+    {paralellism}
+
+    Returns
+    -------
+    clonotype
+        A Series containing the clonotype id for each new cell.
+    clonotype_size
+        A Series containing the number of cells of both objects in the respective
+        clonotype for each new cell.
+    """
+    if key not in adata_ref.uns or "params" not in adata_ref.uns[key]:
+        raise ValueError(
+            f"Clonotype parameters not found in `adata_ref.uns['{key}']`. "
+            "Did you run `tl.define_clonotype_clusters`?"
+        )
+    params = adata_ref.uns[key]["params"]
+    if params["partitions"] != "connected":
+        raise ValueError(
+            "Only clonotypes defined with `partitions='connected'` can be assigned."
+        )
+    receptor_arms, dual_ir = params["receptor_arms"], params["dual_ir"]
+    within_group = list(params["within_group"])
+    within_group = within_group if len(within_group) else None
+    distance_key = params["distance_key"]
+    distance_params = adata_ref.uns[distance_key]["params"]
+    if distance_params["metric"] not in [
+        "alignment",
+        "identity",
+        "levenshtein",
+        "hamming",
+    ]:
+        raise ValueError("Custom metrics are not supported by `assign_clonotypes`.")
+    dist_calc = _get_distance_calculator(
+        distance_params["metric"], distance_params["cutoff"], n_jobs=n_jobs
+    )
+    sequence = distance_params["sequence"]
+    sequence_key = "junction_aa" if sequence == "aa" else "junction"
+
+    arms = ["VJ", "VDJ"] if receptor_arms in ["all", "any"] else [receptor_arms]
+    chains = ["1"] if dual_ir == "primary_only" else ["1", "2"]
+    columns = [f"IR_{arm}_{c}_{sequence_key}" for arm in arms for c in ["1", "2"]]
+    if params["same_v_gene"]:
+        columns += [f"IR_{arm}_{c}_v_call" for arm in arms for c in chains]
+    columns += ["has_ir"] + (within_group if within_group is not None else [])
+    missing = [col for col in columns if col not in adata.obs.columns]
+    if len(missing):
+        raise ValueError(f"Columns {missing} not found in `adata.obs`.")
+
+    # Reference cells with a sequence within the cutoff of a new sequence.
+    # Cells without an arm (or any sequence) are candidates if there are such
+    # new cells, as identical receptor configurations belong to the same clonotype.
+    # With `receptor_arms="all"`, this must hold for both arms.
+    ref_clonotypes = adata_ref.obs[key]
+    is_candidate = np.full(adata_ref.n_obs, receptor_arms == "all")
+    ref_no_seq = np.ones(adata_ref.n_obs, dtype=bool)
+    new_no_seq = np.ones(adata.n_obs, dtype=bool)
+    seq_dists = dict()
+    for arm in arms:
+        new_seqs = np.array(_get_unique_seqs(adata, arm, sequence), dtype=object)
+        ref_seqs = np.array(adata_ref.uns[distance_key][arm]["seqs"], dtype=object)
+        candidate_seqs = []
+        if len(new_seqs):
+            new_ref = dist_calc.calc_dist_mat(new_seqs, ref_seqs).tocoo()
+            new_ref.eliminate_zeros()
+            new_new = dist_calc.calc_dist_mat(new_seqs).tocoo()
+            seq_dists[arm] = new_seqs, ref_seqs, new_new, new_ref
+            candidate_seqs = ref_seqs[np.unique(new_ref.col)]
+        arm_candidate = np.zeros(adata_ref.n_obs, dtype=bool)
+        for c in chains:
+            col = f"IR_{arm}_{c}_{sequence_key}"
+            codes, uniques = _factorize(adata_ref.obs[col])
+            arm_candidate |= (
+                pd.Series(uniques).str.upper().isin(candidate_seqs).values
+                & (uniques != "nan")
+            )[codes]
+        # there is no secondary chain without a primary one
+        col = f"IR_{arm}_1_{sequence_key}"
+        codes, uniques = _factorize(adata_ref.obs[col])
+        ref_no_arm = (uniques == "nan")[codes]
+        codes, uniques = _factorize(adata.obs[col])
+        new_no_arm = (uniques == "nan")[codes]
+        ref_no_seq &= ref_no_arm
+        new_no_seq &= new_no_arm
+        if receptor_arms == "all":
+            is_candidate &= arm_candidate | (ref_no_arm & np.any(new_no_arm))
+        else:
+            is_candidate |= arm_candidate
+    if np.any(new_no_seq):
+        is_candidate |= ref_no_seq
+    is_candidate &= ~pd.isnull(ref_clonotypes.values)
+    # Cells with identical receptor configurations have the same clonotype
+    candidates = np.flatnonzero(is_candidate)
+    candidates = candidates[
+        ~adata_ref.obs.iloc[candidates, :].loc[:, columns].duplicated().values
+    ]
+
+    # Define clonotype clusters on the new cells and the candidate reference cells.
+    # Obs names are replaced, as they may be shared between the objects.
+    obs = pd.concat(
+        [adata.obs.loc[:, columns], adata_ref.obs.iloc[candidates, :].loc[:, columns]],
+        ignore_index=True,
+    )
+    obs.index = obs.index.astype(str)
+    tmp_adata = AnnData(obs=obs)
+    distance_dict = {"params": distance_params}
+    for arm in arms:
+        # distances between all sequences of the new cells and candidate cells.
+        # Distances between reference sequences, including identical ones, are
+        # not required, as the reference cells are already clustered.
+        seqs = np.array(_get_unique_seqs(tmp_adata, arm, sequence), dtype=object)
+        distances = sp.csr_matrix((len(seqs), len(seqs)), dtype=dist_calc.DTYPE)
+        if arm in seq_dists:
+            new_seqs, ref_seqs, new_new, new_ref = seq_dists[arm]
+            new_idx = pd.Index(seqs).get_indexer(new_seqs)
+            ref_idx = pd.Index(seqs).get_indexer(ref_seqs)
+            keep = ref_idx[new_ref.col] >= 0
+            tmp_distances = sp.coo_matrix(
+                (
+                    np.concatenate([new_ref.data[keep], new_new.data]),
+                    (
+                        np.concatenate(
+                            [new_idx[new_ref.row[keep]], new_idx[new_new.row]]
+                        ),
+                        np.concatenate(
+                            [ref_idx[new_ref.col[keep]], new_idx[new_new.col]]
+                        ),
+                    ),
+                ),
+                shape=distances.shape,
+            ).tocsr()
+            distances = distances.maximum(tmp_distances).maximum(tmp_distances.T)
+        distance_dict[arm] = {"seqs": list(seqs), "distances": distances.tocsr()}
+    tmp_adata.uns[distance_key] = distance_dict
+    ctn = ClonotypeNeighbors(
+        tmp_adata,
+        receptor_arms=receptor_arms,
+        dual_ir=dual_ir,
+        same_v_gene=params["same_v_gene"],
+        within_group=within_group,
+        distance_key=distance_key,
+        sequence_key=sequence_key,
+        n_jobs=n_jobs,
+        chunksize=chunksize,
+    )
+    # component of each cell, -1 = no IR.
+    component = ctn.compute_connected_components()
+    cell_clonotypes = ctn.cell_indices.cell_clonotypes(tmp_adata.obs_names)
+    cell_component = np.where(cell_clonotypes >= 0, component[cell_clonotypes], -1)
+    new_component = cell_component[: adata.n_obs]
+    candidate_component = cell_component[adata.n_obs :]
+
+    # Merge the reference clusters connected by the new cells. Clusters are
+    # numbered in the order of first appearance in the reference, i.e. the
+    # surviving cluster of merged clusters is the one that appears first.
+    ref_codes, ref_uniques = pd.factorize(ref_clonotypes)
+    ref_uniques = np.asarray(ref_uniques, dtype=object)
+    candidate_codes = ref_codes[candidates][candidate_component >= 0]
+    candidate_component = candidate_component[candidate_component >= 0]
+    _, first = np.unique(candidate_component, return_index=True)
+    component_code = np.full(len(component), -1)
+    component_code[candidate_component[first]] = candidate_codes[first]
+    uf = UnionFind(len(ref_uniques))
+    uf.union(component_code[candidate_component], candidate_codes)
+    merged_code = uf.find(np.arange(len(ref_uniques)))
+    component_code[candidate_component] = merged_code[candidate_codes]
+    # the (merged) reference clusters that new cells join
+    has_new_cells = np.zeros(len(component), dtype=bool)
+    has_new_cells[new_component[new_component >= 0]] = True
+    updated_codes = np.unique(
+        merged_code[candidate_codes[has_new_cells[candidate_component]]]
+    )
+
+    # Clonotypes of the new cells. Components without reference cells are new
+    # clusters, numbered after the largest cluster id of the reference.
+    new_code = np.where(new_component >= 0, component_code[new_component], -1)
+    is_new_cluster = (new_component >= 0) & (new_code < 0)
+    new_cluster_idx = pd.factorize(new_component[is_new_cluster])[0]
+    ref_ids = pd.to_numeric(pd.Series(ref_uniques), errors="coerce").values
+    next_id = int(np.max(ref_ids[~np.isnan(ref_ids)], initial=-1)) + 1
+    clonotypes = np.full(adata.n_obs, np.nan, dtype=object)
+    clonotypes[new_code >= 0] = ref_uniques[new_code[new_code >= 0]]
+    clonotypes[is_new_cluster] = (next_id + new_cluster_idx).astype(str)
+    clonotype_series = pd.Series(clonotypes, index=adata.obs_names)
+
+    # cluster sizes across both objects
+    merged_ref_clonotypes = np.full(adata_ref.n_obs, np.nan, dtype=object)
+    merged_ref_clonotypes[ref_codes >= 0] = ref_uniques[
+        merged_code[ref_codes[ref_codes >= 0]]
+    ]
+    sizes = pd.concat(
+        [pd.Series(merged_ref_clonotypes), clonotype_series], ignore_index=True
+    ).value_counts()
+    clonotype_size_series = clonotype_series.map(sizes)
+
+    if inplace:
+        adata.obs[key] = clonotype_series
+        adata.obs[key + "_size"] = clonotype_size_series
+        # only update reference cells of merged clusters or clusters with new cells
+        is_updated = np.zeros(len(ref_uniques), dtype=bool)
+        is_updated[updated_codes] = True
+        updated = ref_codes >= 0
+        updated[updated] = is_updated[merged_code[ref_codes[updated]]]
+        ref_obs = adata_ref.obs
+        if is_categorical_dtype(ref_obs[key]):
+            ref_obs[key] = ref_obs[key].astype(object)
+        ref_obs.loc[updated, key] = merged_ref_clonotypes[updated]
+        ref_obs.loc[updated, key + "_size"] = sizes[
+            merged_ref_clonotypes[updated]
+        ].values
+        logging.info(
+            f'Stored clonal assignments in `adata.obs["{key}"]` and updated '
+            f"{len(updated_codes)} clusters in `adata_ref`."
+        )
+    else:
+        return clonotype_series, clonotype_size_series
+
+
+@_check_upgrade_schema()
+@_doc_params(
+    common_doc=_common_doc, paralellism=_common_doc_parallelism, context=_doc_context
+)
+def clonotype_cluster_hierarchy(
+    adata: AnnData,
+    *,
+    sequence: Literal["aa", "nt"] = "aa",
+    metric: MetricType = "levenshtein",
+    cutoffs: Optional[Sequence[int]] = None,
+    receptor_arms: Literal["VJ", "VDJ", "all", "any"] = "all",
+    dual_ir: Literal["primary_only", "all", "any"] = "any",
+    same_v_gene: bool = False,
+    within_group: Union[Sequence[str], str, None] = "receptor_type",
+    key_added: str = None,
+    distance_key: Union[str, None] = None,
+    inplace: bool = True,
+    n_jobs: Union[int, None] = None,
+    chunksize: int = 2000,
+    context: Optional[ClonotypeNeighborContext] = None,
+) -> Optional[pd.DataFrame]:
+    """
+    Define :term:`clonotype clusters<Clonotype cluster>` at multiple distance
+    cutoffs at once.
+
+    The clusters at a given cutoff are the same as running
+    :func:`~scirpy.pp.ir_dist` with that cutoff followed by
+    :func:`~scirpy.tl.define_clonotype_clusters` with `partitions="connected"`.
+    However, the clonotype distances are computed only once at the cutoff that
+    was used for :func:`~scirpy.pp.ir_dist`. The clusters at all cutoffs are then
+    obtained in a single pass over the edges of the clonotype network in
+    ascending order of their distance (single-linkage clustering). The clusters
+    at a cutoff are nested within the clusters at all higher cutoffs.
+
+    Requires running :func:`~scirpy.pp.ir_dist` with the same `sequence` and
+    `metric` values and the largest cutoff of interest first.
+
+    Parameters
+    ----------
+    adata
+        Annotated data matrix
+    sequence
+        The sequence parameter used when running :func:scirpy.pp.ir_dist`
+    metric
+        The metric parameter used when running :func:`scirpy.pp.ir_dist`
+    cutoffs
+        Distance cutoffs at which to define clonotype clusters. Defaults to all
+        cutoffs from `0` to the cutoff used for :func:`~scirpy.pp.ir_dist`.
+        Cutoffs must not exceed the cutoff used for :func:`~scirpy.pp.ir_dist`.
+
+    {common_doc}
+
+    key_added
+        Prefix of the column names under which the clonotype clusters will be
+        stored in `adata.obs`. The clusters for cutoff `d` are stored in
+        `{{key_added}}_d{{d}}`, e.g. `cc_aa_levenshtein_d1`. Defaults to
+        `cc_{{sequence}}_{{metric}}`. The clonotype x clonotype network at the
+        largest cutoff will be stored in `adata.uns[key_added]`.
+    distance_key
+        Key in `adata.uns` where the sequence distances are stored. This defaults
+        to `ir_dist_{{sequence}}_{{metric}}`.
+    inplace
+        If `True`, adds the results to anndata, otherwise returns them.
+    {paralellism}
+    {context}
+
+    Returns
+    -------
+    A data frame with the clonotype cluster of each cell (rows) at each cutoff
+    (columns). Will be stored in `adata.obs` if `inplace` is `True`.
+    """
+    within_group, distance_key, key_added = _validate_parameters(
+        adata,
+        receptor_arms,
+        dual_ir,
+        within_group,
+        distance_key,
+        sequence,
+        metric,
+        key_added,
+    )
+
+    max_cutoff = _get_cutoff(adata.uns[distance_key])
+    if cutoffs is None:
+        cutoffs = range(max_cutoff + 1)
+    cutoffs = np.unique(cutoffs)
+    if np.any(cutoffs < 0) or np.any(cutoffs > max_cutoff):
+        raise ValueError(
+            f"Cutoffs must be between 0 and the cutoff used for `pp.ir_dist` "
+            f"({max_cutoff})."
+        )
+
+    sequence_key = "junction_aa" if sequence == "aa" else "junction"
+    ctn = ClonotypeNeighbors(
+        adata,
+        receptor_arms=receptor_arms,
+        dual_ir=dual_ir,
+        same_v_gene=same_v_gene,
+        within_group=within_group,
+        distance_key=distance_key,
+        sequence_key=sequence_key,
+        n_jobs=n_jobs,
+        chunksize=chunksize,
+        context=context,
+    )
+    clonotype_dist = ctn.compute_distances()
+
+    # Single-linkage clustering: add the edges in ascending order of their
+    # distance and record the connected components after each cutoff.
+    # Distances are stored with an offset of 1.
+    edges = clonotype_dist.tocoo()
+    order = np.argsort(edges.data, kind="stable")
+    edge_dist = edges.data[order].astype(int) - 1
+    rows, cols = edges.row[order], edges.col[order]
+    uf = UnionFind(clonotype_dist.shape[0])
+    clusters = dict()
+    start = 0
+    for cutoff in cutoffs:
+        end = np.searchsorted(edge_dist, cutoff, side="right")
+        uf.union(rows[start:end], cols[start:end])
+        start = end
+        clusters[f"{key_added}_d{cutoff}"] = _membership_by_cell(
+            uf.membership, ctn.cell_indices, adata.obs_names
+        )
+    clusters = pd.DataFrame(clusters, index=adata.obs_names)
+
+    if inplace:
+        for col in clusters.columns:
+            adata.obs[col] = clusters[col]
+        adata.uns[key_added] = {
+            "distances": clonotype_dist,
+            "cell_indices": ctn.cell_indices.to_uns(),
+            "components": _clonotype_components(clonotype_dist, ctn.cell_indices),
+        }
+        logging.info(
+            f"Stored clonal assignments in `adata.obs` columns "
+            f"`{clusters.columns[0]}` to `{clusters.columns[-1]}`."
+        )
+    else:
+        return clusters
+
+
+def _get_cutoff(distance_dict: dict) -> int:
+    """Get the cutoff used for computing sequence distances with `pp.ir_dist`.
+
+    For custom metrics without recorded cutoff, the largest distance in the
+    distance matrices is used.
+    """
+    params = distance_dict.get("params", dict())
+    cutoff = params.get("cutoff", None)
+    if params.get("metric", None) in [
+        "alignment",
+        "identity",
+        "levenshtein",
+        "hamming",
+    ]:
+        # resolves the default cutoffs and the implied cutoff of `identity`
+        return int(_get_distance_calculator(params["metric"], cutoff).cutoff)
+    if cutoff is not None:
+        return int(cutoff)
+    max_dist = [
+        np.max(distance_dict[chain_type]["distances"].data, initial=0)
+        for chain_type in ["VJ", "VDJ"]
+    ]
+    # distances are stored with an offset of 1
+    return max(int(max(max_dist)) - 1, 0)
+
+
 @_check_upgrade_schema()
 @_doc_params(clonotype_network=_doc_clonotype_network)
 def clonotype_network(
@@ -397,6 +958,7 @@ def clonotype_network(
     key_added: str = "clonotype_network",
     inplace: bool = True,
     random_state=42,
+    n_jobs: Optional[int] = 1,
 ) -> Union[None, pd.DataFrame]:
     """
     Computes the layout of the clonotype network.
@@ -457,6 +1019,11 @@ def clonotype_network(
         If `True`, store the coordinates in `adata.obsm`, otherwise return them.
     random_state
         Random seed set before computing the layout.
+    n_jobs
+        Number of CPUs used for layouting the components in parallel with the
+        `components` layout. If `None`, use all cores. If not `1`, each component
+        is layouted with its own seed derived from `random_state`, see
+        :func:`scirpy.util.graph.layout_components`.
 
     Returns
     -------
@@ -485,37 +1052,35 @@ def clonotype_network(
             "or `tl.define_clonotype_clusters`, respectively?"
         )
 
-    graph = igraph_from_sparse_matrix(
-        clonotype_res["distances"], matrix_type="distance"
-    )
+    distances = sp.csr_matrix(clonotype_res["distances"])
+    cell_indices = CellIndices.from_uns(clonotype_res["cell_indices"])
+    # the components are stored by `define_clonotype_clusters`, but not by
+    # older versions.
+    components = clonotype_res.get("components", None)
+    if components is None:
+        components = _clonotype_components(distances, cell_indices)
 
     if base_size is None:
-        base_size = 240000 / len(graph.vs)
-
-    # explicitly annotate node ids to keep them after subsetting
-    graph.vs["node_id"] = np.arange(0, len(graph.vs))
-
-    # store size in graph to be accessed by layout algorithms
-    clonotype_size = np.array(
-        [idx.size for idx in clonotype_res["cell_indices"].values()]
-    )
-    graph.vs["size"] = clonotype_size
-    components = np.array(graph.decompose("weak"))
-    component_node_count = np.array([len(component.vs) for component in components])
-    component_sizes = np.array([sum(component.vs["size"]) for component in components])
+        base_size = 240000 / distances.shape[0]
 
     # Filter subgraph by `min_cells` and `min_nodes`
-    subgraph_idx = list(
-        itertools.chain.from_iterable(
-            comp.vs["node_id"]
-            for comp in components[
-                (component_node_count >= min_nodes) & (component_sizes >= min_cells)
-            ]
-        )
+    subgraph_idx = np.flatnonzero(
+        ((components["n_nodes"] >= min_nodes) & (components["n_cells"] >= min_cells))[
+            components["membership"]
+        ]
     )
     if len(subgraph_idx) == 0:
         raise ValueError("No subgraphs with size >= {} found.".format(min_cells))
-    graph = graph.subgraph(subgraph_idx)
+    # the connectivities are normalized by the maximum distance of the entire graph
+    graph = igraph_from_sparse_matrix(
+        distances[subgraph_idx, :][:, subgraph_idx],
+        matrix_type="distance",
+        max_value=np.max(distances.data, initial=0),
+    )
+    # explicitly annotate node ids to keep them after subsetting
+    graph.vs["node_id"] = subgraph_idx
+    # store size in graph to be accessed by layout algorithms
+    graph.vs["size"] = cell_indices.sizes[subgraph_idx]
 
     # Compute layout
     if layout_kwargs is None:
@@ -523,6 +1088,9 @@ def clonotype_network(
     if layout == "components":
         tmp_layout_kwargs = dict()
         tmp_layout_kwargs["component_layout"] = "fr_size_aware" if size_aware else "fr"
+        tmp_layout_kwargs["n_jobs"] = n_jobs
+        if n_jobs != 1:
+            tmp_layout_kwargs["random_state"] = random_state
         if size_aware:
             # layout kwargs for the fr_size_aware layout used for each component
             tmp_layout_kwargs["layout_kwargs"] = {
@@ -541,15 +1109,12 @@ def clonotype_network(
         coords = graph.layout(layout, **tmp_layout_kwargs).coords
 
     # Expand to cell coordinates to store in adata.obsm
-    idx, coords = zip(
-        *itertools.chain.from_iterable(
-            zip(clonotype_res["cell_indices"][str(node_id)], itertools.repeat(coord))
-            for node_id, coord in zip(graph.vs["node_id"], coords)  # type: ignore
-        )
-    )
-    coord_df = pd.DataFrame(data=coords, index=idx, columns=["x", "y"]).reindex(
-        adata.obs_names
-    )
+    node_coords = np.full((len(cell_indices), 2), np.nan)
+    node_coords[graph.vs["node_id"], :] = coords
+    cell_clonotypes = cell_indices.cell_clonotypes(adata.obs_names)
+    cell_coords = node_coords[cell_clonotypes, :]
+    cell_coords[cell_clonotypes < 0, :] = np.nan
+    coord_df = pd.DataFrame(data=cell_coords, index=adata.obs_names, columns=["x", "y"])
 
     # Store results or return
     if inplace:
@@ -574,13 +1139,14 @@ def _graph_from_coordinates(
     """
     clonotype_res = adata.uns[clonotype_key]
     # map the cell-id to the corresponding row/col in the clonotype distance matrix
-    dist_idx, obs_names = zip(
-        *itertools.chain.from_iterable(
-            zip(itertools.repeat(i), obs_names)
-            for i, obs_names in clonotype_res["cell_indices"].items()
-        )
+    dist_idx = CellIndices.from_uns(clonotype_res["cell_indices"]).cell_clonotypes(
+        adata.obs_names
+    )
+    dist_idx_lookup = pd.DataFrame(
+        index=adata.obs_names[dist_idx >= 0],
+        data=dist_idx[dist_idx >= 0],
+        columns=["dist_idx"],
     )
-    dist_idx_lookup = pd.DataFrame(index=obs_names, data=dist_idx, columns=["dist_idx"])
     clonotype_label_lookup = adata.obs.loc[:, [clonotype_key]].rename(
         columns={clonotype_key: "label"}
     )
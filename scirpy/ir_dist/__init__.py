@@ -1,14 +1,19 @@
 """Compute distances between immune receptor sequences"""
 from anndata import AnnData
+import copy
 from typing import Optional, Sequence, Union
 from .._compat import Literal
 import numpy as np
+import pandas as pd
 from scanpy import logging
 from ..util import _is_na, deprecated
 from scipy.sparse import csr_matrix
 from ..util import _doc_params
 from . import metrics
 from ..io._util import _check_upgrade_schema
+from ._util import SymmetricDistanceMatrix, CellIndices, ClonotypeCellOperator
+from ._clonotype_neighbors import ClonotypeNeighborContext
+from . import _engines
 
 
 @deprecated(
@@ -66,12 +71,19 @@ def _get_metric_key(metric: MetricType) -> str:
 
 
 def _get_distance_calculator(
-    metric: MetricType, cutoff: Union[int, None], *, n_jobs=None, **kwargs
+    metric: MetricType,
+    cutoff: Union[int, None],
+    *,
+    n_jobs=None,
+    engine: Union[_engines.EngineType, Literal["auto"]] = "auto",
+    **kwargs,
 ):
     """Returns an instance of :class:`~scirpy.ir_dist.metrics.DistanceCalculator`
     given a metric.
 
-    A cutoff of 0 will always use the identity metric.
+    A cutoff of 0 will always use the identity metric. For the `levenshtein`
+    and `hamming` metrics, `engine` is passed on to the DistanceCalculator. With
+    `engine="auto"`, the fastest engine is chosen when the distance matrix is computed.
     """
 
     if cutoff == 0 or metric == "identity":
@@ -88,11 +100,11 @@ def _get_distance_calculator(
         dist_calc = metrics.IdentityDistanceCalculator(cutoff=cutoff, **kwargs)
     elif metric == "levenshtein":
         dist_calc = metrics.LevenshteinDistanceCalculator(
-            cutoff=cutoff, n_jobs=n_jobs, **kwargs
+            cutoff=cutoff, n_jobs=n_jobs, engine=engine, **kwargs
         )
     elif metric == "hamming":
         dist_calc = metrics.HammingDistanceCalculator(
-            cutoff=cutoff, n_jobs=n_jobs, **kwargs
+            cutoff=cutoff, n_jobs=n_jobs, engine=engine, **kwargs
         )
     else:
         raise ValueError("Invalid distance metric.")
@@ -111,6 +123,8 @@ def _ir_dist(
     key_added: Union[str, None] = None,
     inplace: bool = True,
     n_jobs: Union[int, None] = None,
+    half_storage: bool = False,
+    max_memory: Union[int, None] = None,
 ) -> Union[dict, None]:
     """
     Computes a sequence-distance metric between all unique :term:`VJ <Chain locus>`
@@ -141,35 +155,54 @@ def _ir_dist(
     n_jobs
         Number of cores to use for distance calculation. Passed on to
         :class:`scirpy.ir_dist.metrics.DistanceCalculator`.
+    half_storage
+        If true, only store the upper triangle (including the diagonal) of the
+        symmetrical distance matrices. This roughly halves the memory footprint.
+        Downstream functions transparently expand the matrices via
+        :class:`~scirpy.ir_dist.SymmetricDistanceMatrix`.
+    max_memory
+        Memory budget in bytes. If the peak memory usage estimated by
+        :func:`~scirpy.ir_dist.estimate_cost` exceeds the budget, a `MemoryError` is
+        raised before computing any distances.
 
     Returns
     -------
     Depending on the value of `inplace` either returns nothing or a dictionary
     with symmetrical, sparse, pairwise distance matrices for all `VJ` and `VDJ`
-    sequences.
+    sequences. With `half_storage=True`, only the upper triangles are stored.
     """
-    obs_col = "IR_{chain_type}_{chain_id}_{key}"
-    key = "junction_aa" if sequence == "aa" else "junction"
     result = {
         "VJ": dict(),
         "VDJ": dict(),
         "params": {"metric": str(metric), "sequence": sequence, "cutoff": cutoff},
     }
+    if half_storage:
+        result["params"]["half_storage"] = True
     dist_calc = _get_distance_calculator(metric, cutoff, n_jobs=n_jobs)
 
     # get all unique seqs for VJ and VDJ
     for chain_type in ["VJ", "VDJ"]:
-        tmp_seqs = np.concatenate(
-            [
-                adata.obs[
-                    obs_col.format(chain_type=chain_type, chain_id=chain_id, key=key)
-                ]
-                for chain_id in ["1", "2"]
-            ]
-        )
-        result[chain_type]["seqs"] = [
-            x.upper() for x in np.unique(tmp_seqs[~_is_na(tmp_seqs)])  # type: ignore
-        ]
+        result[chain_type]["seqs"] = _get_unique_seqs(adata, chain_type, sequence)
+
+    dist_calcs = {chain_type: dist_calc for chain_type in ["VJ", "VDJ"]}
+    if max_memory is not None:
+        for chain_type in ["VJ", "VDJ"]:
+            cost = _engines.estimate_cost(dist_calc, result[chain_type]["seqs"])
+            engine = getattr(dist_calc, "engine", "auto")
+            if engine == "auto":
+                engine = _engines.select_engine(cost, max_memory)
+                if hasattr(dist_calc, "engine"):
+                    # use the fastest engine that stays within the budget
+                    dist_calcs[chain_type] = copy.copy(dist_calc)
+                    dist_calcs[chain_type].engine = engine
+            memory = cost.loc[cost["engine"] == engine, "memory"].values[0]
+            if memory > max_memory:
+                raise MemoryError(
+                    f"Computing the {chain_type} distance matrix is estimated to "
+                    f"require {memory / 1e9:.2f} GB of memory which exceeds "
+                    f"`max_memory` ({max_memory / 1e9:.2f} GB). Consider using a "
+                    "lower cutoff or a different metric. "
+                )
 
     # compute distance matrices
     for chain_type in ["VJ", "VDJ"]:
@@ -177,7 +210,10 @@ def _ir_dist(
             f"Computing sequence x sequence distance matrix for {chain_type} sequences."
         )  # type: ignore
         tmp_seqs = result[chain_type]["seqs"]
-        result[chain_type]["distances"] = dist_calc.calc_dist_mat(tmp_seqs).tocsr()
+        distances = dist_calcs[chain_type].calc_dist_mat(tmp_seqs).tocsr()
+        if half_storage:
+            distances = SymmetricDistanceMatrix(distances).upper
+        result[chain_type]["distances"] = distances
 
     # return or store results
     if inplace:
@@ -188,6 +224,85 @@ def _ir_dist(
         return result
 
 
+def _get_unique_seqs(
+    adata: AnnData, chain_type: Literal["VJ", "VDJ"], sequence: Literal["aa", "nt"]
+) -> list:
+    """Get all unique (upper case) sequences of primary and secondary chains
+    of a receptor arm."""
+    key = "junction_aa" if sequence == "aa" else "junction"
+    tmp_seqs = np.concatenate(
+        [adata.obs[f"IR_{chain_type}_{chain_id}_{key}"] for chain_id in ["1", "2"]]
+    )
+    return [x.upper() for x in np.unique(tmp_seqs[~_is_na(tmp_seqs)])]  # type: ignore
+
+
+@_check_upgrade_schema()
+@_doc_params(metric=_doc_metrics, cutoff=_doc_cutoff)
+def estimate_cost(
+    adata: AnnData,
+    *,
+    metric: MetricType = "identity",
+    cutoff: Union[int, None] = None,
+    sequence: Literal["aa", "nt"] = "nt",
+    n_jobs: Union[int, None] = None,
+    n_sample: int = 300,
+    random_state: int = 0,
+) -> pd.DataFrame:
+    """
+    Estimate runtime and memory usage of :func:`scirpy.pp.ir_dist`.
+
+    Distances are computed for a random sample of sequences. The density of the
+    sample distance matrix and the time per pair are extrapolated to the full
+    set of sequences. For metrics that support candidate filters (`levenshtein`,
+    `hamming`), the cost of each engine is reported separately.
+
+    All estimates are rough and meant to detect jobs that are infeasible on
+    the current machine.
+
+    Parameters
+    ----------
+    adata
+        annotated data matrix
+    {metric}
+    {cutoff}
+    sequence
+        Compute distances based on amino acid (`aa`) or nucleotide (`nt`) sequences.
+    n_jobs
+        Number of cores that will be used for the distance calculation.
+    n_sample
+        Number of sequences to sample for each receptor arm.
+    random_state
+        Random seed for sampling sequences.
+
+    Returns
+    -------
+    Data frame with one row per receptor arm (`chain_type`) and `engine` and the
+    following columns:
+
+      * `n_seqs` -- number of unique sequences
+      * `n_pairs` -- number of pairs in the upper triangle of the distance matrix
+      * `n_candidates` -- estimated number of pairs that pass the candidate filter
+      * `density` -- estimated fraction of pairs with a distance `<= cutoff`
+      * `nnz` -- estimated number of non-zero elements of the distance matrix
+      * `memory` -- estimated peak memory usage in bytes
+      * `time` -- estimated wall time in seconds
+      * `selected` -- the engine chosen by `engine="auto"`
+    """
+    dist_calc = _get_distance_calculator(metric, cutoff, n_jobs=n_jobs)
+    res = []
+    for chain_type in ["VJ", "VDJ"]:
+        cost = _engines.estimate_cost(
+            dist_calc,
+            _get_unique_seqs(adata, chain_type, sequence),
+            n_sample=n_sample,
+            random_state=random_state,
+        )
+        cost["selected"] = cost["engine"] == _engines.select_engine(cost)
+        cost.insert(0, "chain_type", chain_type)
+        res.append(cost)
+    return pd.concat(res, ignore_index=True)
+
+
 @_doc_params(metric=_doc_metrics, cutoff=_doc_cutoff, dist_mat=metrics._doc_dist_mat)
 def sequence_dist(
     seqs: Sequence[str],
@@ -1,15 +1,311 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import copy
+import multiprocessing as mp
 from multiprocessing import cpu_count
-from typing import Union, Sequence
+from typing import Iterator, List, Optional, Tuple, Union, Sequence
 from anndata import AnnData
 from scanpy import logging
 from .._compat import Literal
 import numpy as np
 import scipy.sparse as sp
 import itertools
-from ._util import DoubleLookupNeighborFinder, reduce_and, reduce_or, merge_coo_matrices
-from ..util import _is_na, _is_true, tqdm
+from ._util import (
+    DoubleLookupNeighborFinder,
+    reduce_and,
+    reduce_or,
+    reduce_and_int,
+    reduce_or_int,
+    merge_coo_matrices,
+    paired_chain_distances,
+    get_distance_matrix,
+    distance_submatrix,
+    SymmetricDistanceMatrix,
+    CellIndices,
+)
+from ..util import _is_true, tqdm
+from ..util.graph import UnionFind, connected_components
 import pandas as pd
-from tqdm.contrib.concurrent import process_map
+
+
+# The `ClonotypeNeighbors` instance in a worker process, see `_worker_pool`.
+_worker_neighbors = None
+
+
+def _init_worker(neighbors) -> None:
+    global _worker_neighbors
+    _worker_neighbors = neighbors
+
+
+def _worker_dist_for_task(task):
+    """Compute the distances for a task in a worker process"""
+    return _worker_neighbors._dist_for_task(task)
+
+
+def _factorize(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode a column of IR features as integer codes of its distinct values.
+
+    All representations of missing values (see `_is_na`) are encoded as `"nan"`
+    and all other values are converted to `str`. The conversion is only
+    applied to the distinct values, not to every cell.
+
+    Returns
+    -------
+    codes
+        The code of each value
+    uniques
+        The distinct values as object array of strings.
+    """
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    if np.any(codes < 0):
+        # missing values are encoded as -1, i.e. the last element of `uniques`
+        uniques = np.append(uniques, np.nan)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+    # same as `_is_na`, but vectorized, as all values are strings now.
+    uniques = uniques.where(~uniques.isin(["NaN", "nan", "None", "N/A", ""]), "nan")
+    # different values can have the same string representation.
+    unique_codes, uniques = pd.factorize(uniques.values)
+    return unique_codes[codes], np.asarray(uniques, dtype=object)
+
+
+def _unique_rows(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Find identical rows in a matrix of non-negative integer codes.
+
+    The codes of all columns are combined into a single integer key per row.
+
+    Returns
+    -------
+    inverse
+        The index of the unique row of each row. Unique rows are numbered in the
+        order of their first appearance.
+    first
+        The index of the first appearance of each unique row.
+    """
+    key = np.zeros(codes.shape[0], dtype=np.int64)
+    n_keys = 1
+    for col in codes.T:
+        n_codes = int(np.max(col, initial=-1)) + 1
+        if n_keys * n_codes > np.iinfo(np.int64).max:
+            # compress the key to consecutive integers to avoid an overflow
+            _, key = np.unique(key, return_inverse=True)
+            n_keys = int(np.max(key, initial=-1)) + 1
+        key = key * n_codes + col
+        n_keys *= n_codes
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    # renumber the unique rows from sorted order to the order of appearance
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse], first[order]
+
+
+class ClonotypeNeighborContext:
+    def __init__(
+        self,
+        adata: AnnData,
+        *,
+        distance_key: str,
+        sequence_key: str,
+        within_group: Union[None, Sequence[str]] = None,
+        columns: Union[None, Sequence[str]] = None,
+    ):
+        """Clonotype table and lookup tables that can be shared between
+        :class:`ClonotypeNeighbors` objects with different parameters.
+
+        Cells are grouped into the "finest" clonotypes, i.e. by identical values
+        in all `columns` and `within_group` columns. Each column is stored as
+        integer codes of its distinct values. A :class:`ClonotypeNeighbors` object
+        derives its clonotypes by merging these clonotypes on a subset of the
+        columns, and its forward lookup tables by indexing lookup tables of the
+        distinct values. Only the distance computation depends on the parameters.
+
+        Use :meth:`from_adata` to build a context that can be passed to
+        :func:`scirpy.tl.define_clonotype_clusters` and
+        :func:`scirpy.tl.clonotype_cluster_hierarchy`. The context is a snapshot
+        of `adata.obs` and the sequence distances, build a new context after
+        modifying either of them.
+
+        Parameters
+        ----------
+        adata
+            annotated data matrix
+        distance_key
+            Key in `adata.uns` where the sequence distances are stored.
+        sequence_key
+            Key of the sequences in `adata.obs`, e.g. `junction_aa`.
+        within_group
+            Columns in `adata.obs` that can be used as `within_group`.
+        columns
+            Sequence and V gene columns in `adata.obs`. Defaults to all
+            sequence and V gene columns that are present in `adata.obs`.
+        """
+        self.distance_key = distance_key
+        self.sequence_key = sequence_key
+        self.distance_dict = adata.uns[distance_key]
+        self.within_group = list(within_group) if within_group is not None else []
+        self.columns = (
+            self._default_columns(adata, sequence_key)
+            if columns is None
+            else list(columns)
+        )
+        self._neighbor_finder = None
+        # forward lookup tables of the distinct values of each column
+        self._forward = dict()
+        self._make_clonotype_table(adata)
+
+    @staticmethod
+    def _default_columns(adata: AnnData, sequence_key: str) -> List[str]:
+        columns = [
+            f"IR_{arm}_{i}_{key}"
+            for key, arm, i in itertools.product(
+                [sequence_key, "v_call"], ["VJ", "VDJ"], ["1", "2"]
+            )
+        ]
+        return [c for c in columns if c in adata.obs.columns]
+
+    @classmethod
+    def from_adata(
+        cls,
+        adata: AnnData,
+        *,
+        sequence: Literal["aa", "nt"] = "aa",
+        metric: str = "identity",
+        within_group: Union[Sequence[str], str, None] = "receptor_type",
+        distance_key: Union[str, None] = None,
+    ) -> "ClonotypeNeighborContext":
+        """Build a context for repeated calls of
+        :func:`scirpy.tl.define_clonotype_clusters` or
+        :func:`scirpy.tl.clonotype_cluster_hierarchy` on the same data, e.g. to
+        compare different values of `receptor_arms`, `dual_ir` and `same_v_gene`.
+
+        The context contains all sequence and V gene columns of `adata.obs`.
+
+        Parameters
+        ----------
+        adata
+            Annotated data matrix
+        sequence
+            The sequence parameter used when running :func:`scirpy.pp.ir_dist`
+        metric
+            The metric parameter used when running :func:`scirpy.pp.ir_dist`
+        within_group
+            Columns in `adata.obs` that can be used as `within_group`.
+        distance_key
+            Key in `adata.uns` where the sequence distances are stored. This
+            defaults to `ir_dist_{sequence}_{metric}`.
+        """
+        from . import _get_metric_key
+
+        if distance_key is None:
+            distance_key = f"ir_dist_{sequence}_{_get_metric_key(metric)}"
+        if isinstance(within_group, str):
+            within_group = [within_group]
+        return cls(
+            adata,
+            distance_key=distance_key,
+            sequence_key="junction_aa" if sequence == "aa" else "junction",
+            within_group=within_group,
+        )
+
+    def _make_clonotype_table(self, adata: AnnData) -> None:
+        """Define the finest clonotypes based on identical IR features."""
+        if not adata.obs_names.is_unique:
+            raise ValueError("Obs names need to be unique!")
+
+        # evaluate `_is_true` only once per distinct value
+        codes, uniques = pd.factorize(adata.obs["has_ir"])
+        has_ir = np.append(
+            _is_true(np.asarray(uniques, dtype=object)) if len(uniques) else [],
+            False,
+        ).astype(bool)[codes]
+        if not np.any(has_ir):
+            raise ValueError(
+                "Error computing clonotypes. "
+                "No cells with IR information found (`adata.obs['has_ir'] == True`)"
+            )
+
+        # the distinct values of each column and the code of each cell.
+        columns = self.columns + self.within_group
+        self._uniques = dict()
+        cell_codes = np.empty((np.sum(has_ir), len(columns)), dtype=np.int64)
+        for i, col in enumerate(columns):
+            # make sure all nans are consistent "nan"
+            # This workaround will be made obsolete by #190.
+            codes, self._uniques[col] = _factorize(adata.obs[col])
+            cell_codes[:, i] = codes[has_ir]
+
+        # The clonotype of each cell
+        self.cell_clonotype, first = _unique_rows(cell_codes)
+        # positions of the cells in `obs_names`
+        self.cells = np.flatnonzero(has_ir)
+        self.obs_names = adata.obs_names.values
+        self._codes = cell_codes[first, :]
+        self._col_idx = {col: i for i, col in enumerate(columns)}
+
+    @property
+    def n_clonotypes(self) -> int:
+        return self._codes.shape[0]
+
+    def codes(self, columns: Sequence[str]) -> np.ndarray:
+        """The codes of the values in `columns` for all clonotypes"""
+        missing = [c for c in columns if c not in self._col_idx]
+        if len(missing):
+            raise ValueError(f"Columns {missing} are not part of the context.")
+        return self._codes[:, [self._col_idx[c] for c in columns]]
+
+    def values(self, column: str, rows: np.ndarray) -> np.ndarray:
+        """The values in `column` of the clonotypes in `rows`"""
+        return self._uniques[column][self._codes[rows, self._col_idx[column]]]
+
+    def is_nan(self, column: str, rows: np.ndarray) -> np.ndarray:
+        """Whether the values in `column` of the clonotypes in `rows` are missing"""
+        return (self._uniques[column] == "nan")[
+            self._codes[rows, self._col_idx[column]]
+        ]
+
+    @property
+    def neighbor_finder(self) -> DoubleLookupNeighborFinder:
+        """A DoubleLookupNeighborFinder with the sequence distance matrices of
+        all receptor arms and the V gene distance matrix. It only holds the distance
+        matrices, as lookup tables are specific to each set of clonotypes.
+        Built on first use, as it is not needed with identity distances."""
+        if self._neighbor_finder is None:
+            nf = DoubleLookupNeighborFinder(pd.DataFrame())
+            for arm in ["VJ", "VDJ"]:
+                if any(
+                    c.startswith(f"IR_{arm}_") and not c.endswith("_v_call")
+                    for c in self.columns
+                ):
+                    nf.add_distance_matrix(
+                        name=arm,
+                        distance_matrix=get_distance_matrix(self.distance_dict, arm),
+                        labels=self.distance_dict[arm]["seqs"],
+                    )
+            v_gene_cols = [c for c in self.columns if c.endswith("_v_call")]
+            if len(v_gene_cols):
+                # V gene distance matrix (identity mat)
+                v_genes = np.unique(
+                    np.concatenate([self._uniques[c] for c in v_gene_cols])
+                )
+                nf.add_distance_matrix(
+                    "v_gene", sp.identity(len(v_genes), dtype=bool, format="csr"), v_genes  # type: ignore
+                )
+            self._neighbor_finder = nf
+        return self._neighbor_finder
+
+    def forward_lookup_table(
+        self, column: str, distance_matrix: str, rows: np.ndarray
+    ) -> np.ndarray:
+        """The forward lookup table of `column` for the clonotypes in `rows`,
+        see :meth:`DoubleLookupNeighborFinder.add_lookup_table`."""
+        if (column, distance_matrix) not in self._forward:
+            labels = self.neighbor_finder.distance_matrix_labels[distance_matrix]
+            self._forward[(column, distance_matrix)] = np.array(
+                [labels[x] for x in self._uniques[column]], dtype=float
+            )
+        forward = self._forward[(column, distance_matrix)]
+        return forward[self._codes[rows, self._col_idx[column]]]
 
 
 class ClonotypeNeighbors:
@@ -25,9 +321,32 @@ class ClonotypeNeighbors:
         sequence_key: str,
         n_jobs: Union[int, None] = None,
         chunksize: int = 2000,
+        engine: Literal["auto", "sparse", "rowwise", "hash"] = "auto",
+        decompose: bool = True,
+        context: Optional[ClonotypeNeighborContext] = None,
     ):
         """Computes pairwise distances between cells with identical
-        receptor configuration and calls clonotypes from this distance matrix"""
+        receptor configuration and calls clonotypes from this distance matrix.
+
+        With `engine="sparse"`, distances are computed for blocks of `chunksize`
+        clonotypes at once using sparse matrix products. `engine="rowwise"`
+        computes distances one clonotype at a time using the
+        :class:`DoubleLookupNeighborFinder`. `engine="hash"` only works if the
+        sequence distances are an identity matrix. Clonotypes are then
+        neighbors if they share a key derived from their chains, which is
+        found by hashing instead of looking up distances. `engine="auto"`
+        uses `hash` if possible and `sparse` otherwise.
+        All engines yield identical results.
+
+        With `decompose=True`, the `sparse` and `rowwise` engines split the
+        clonotypes into independent subproblems based on the connected components
+        of the sequence distance graphs (see `_component_groups`).
+
+        A :class:`ClonotypeNeighborContext` built for the same data can be passed
+        as `context` to skip building the clonotype table from `adata.obs`.
+        """
+        if engine not in ["auto", "sparse", "rowwise", "hash"]:
+            raise ValueError("Invalid engine. ")
         self.same_v_gene = same_v_gene
         self.within_group = within_group
         self.receptor_arms = receptor_arms
@@ -36,11 +355,12 @@ class ClonotypeNeighbors:
         self.sequence_key = sequence_key
         self.n_jobs = n_jobs
         self.chunksize = chunksize
+        self.decompose = decompose
 
         # will be filled in self._prepare
         self.neighbor_finder = None  # instance of DoubleLookupNeighborFinder
         self.clonotypes = None  # pandas data frame with unique receptor configurations
-        self.cell_indices = None  # a mapping row index from self.clonotypes -> obs name
+        self.cell_indices = None  # CellIndices: row index from self.clonotypes -> cells
 
         self._receptor_arm_cols = (
             ["VJ", "VDJ"]
@@ -49,113 +369,132 @@ class ClonotypeNeighbors:
         )
         self._dual_ir_cols = ["1"] if self.dual_ir == "primary_only" else ["1", "2"]
 
+        has_identity_distances = all(
+            self._is_identity(get_distance_matrix(self.distance_dict, chain_type))
+            for chain_type in self._receptor_arm_cols
+        )
+        if engine == "auto":
+            engine = "hash" if has_identity_distances else "sparse"
+        elif engine == "hash" and not has_identity_distances:
+            raise ValueError(
+                "The `hash` engine requires sequence distances computed with "
+                "the `identity` metric."
+            )
+        self.engine = engine
+
         self._cdr3_cols, self._v_gene_cols = list(), list()
         for arm, i in itertools.product(self._receptor_arm_cols, self._dual_ir_cols):
             self._cdr3_cols.append(f"IR_{arm}_{i}_{self.sequence_key}")
             if same_v_gene:
                 self._v_gene_cols.append(f"IR_{arm}_{i}_v_call")
 
-        self._prepare(adata)
+        if context is None:
+            context = ClonotypeNeighborContext(
+                adata,
+                distance_key=distance_key,
+                sequence_key=sequence_key,
+                within_group=within_group,
+                columns=self._cdr3_cols + self._v_gene_cols,
+            )
+        elif (context.distance_key, context.sequence_key) != (
+            distance_key,
+            sequence_key,
+        ):
+            raise ValueError(
+                "The context was built for a different `distance_key` or `sequence_key`."
+            )
+        elif (
+            len(context.obs_names) != adata.n_obs
+            or context.distance_dict is not self.distance_dict
+        ):
+            raise ValueError(
+                "The context was built for different cells or sequence distances. "
+                "Build a new context after modifying `adata` or running `pp.ir_dist`."
+            )
+
+        self._prepare(context)
 
-    def _prepare(self, adata: AnnData):
+    def _prepare(self, context: ClonotypeNeighborContext):
         """Initalize the DoubleLookupNeighborFinder and all required lookup tables"""
         start = logging.info("Initializing lookup tables. ")
-        self._make_clonotype_table(adata)
+        context_rows = self._make_clonotype_table(context)
         self._make_chain_count()
+        if self.engine == "hash":
+            # neighbors are found from the clonotype table alone
+            logging.hint("Done initializing lookup tables.", time=start)
+            return
         self.neighbor_finder = DoubleLookupNeighborFinder(self.clonotypes)
-        self._add_distance_matrices(adata)
-        self._add_lookup_tables()
+        self._add_distance_matrices(context)
+        self._add_lookup_tables(context, context_rows)
+        self._int_dtype = self._get_int_dtype()
         logging.hint("Done initializing lookup tables.", time=start)
 
-    def _make_clonotype_table(self, adata):
-        """Define 'preliminary' clonotypes based identical IR features."""
-        if not adata.obs_names.is_unique:
-            raise ValueError("Obs names need to be unique!")
+    def _make_clonotype_table(self, context: ClonotypeNeighborContext) -> np.ndarray:
+        """Define 'preliminary' clonotypes based identical IR features.
 
+        The clonotypes of the context with identical values in all relevant
+        columns are merged.
+
+        Returns
+        -------
+        The row in the context of the first clonotype merged into each clonotype.
+        """
         clonotype_cols = self._cdr3_cols + self._v_gene_cols
         if self.within_group is not None:
             clonotype_cols += list(self.within_group)
 
-        obs_filtered = adata.obs.loc[lambda df: _is_true(df["has_ir"]), clonotype_cols]
-        # make sure all nans are consistent "nan"
-        # This workaround will be made obsolete by #190.
-        for col in obs_filtered.columns:
-            obs_filtered[col] = obs_filtered[col].astype(str)
-            obs_filtered.loc[_is_na(obs_filtered[col]), col] = "nan"
-
-        clonotype_groupby = obs_filtered.groupby(
-            clonotype_cols, sort=False, observed=True
+        # Both the clonotypes of the context and the merged clonotypes are in
+        # the order of the first appearance of their cells.
+        context_group, context_rows = _unique_rows(context.codes(clonotype_cols))
+        clonotypes = pd.DataFrame(
+            {col: context.values(col, context_rows) for col in clonotype_cols}
         )
-        # This only gets the unique_values (the groupby index)
-        clonotypes = clonotype_groupby.size().index.to_frame(index=False)
-
-        if clonotypes.shape[0] == 0:
-            raise ValueError(
-                "Error computing clonotypes. "
-                "No cells with IR information found (`adata.obs['has_ir'] == True`)"
-            )
 
-        # groupby.indices gets us a (index -> array of row indices) mapping.
-        # It doesn't necessarily have the same order as `clonotypes`.
-        # This needs to be a dict of arrays, otherwiswe anndata
-        # can't save it to h5ad.
-        # Also the dict keys need to be of type `str`, or they'll get converted
-        # implicitly.
-        self.cell_indices = {
-            str(i): obs_filtered.index[
-                clonotype_groupby.indices.get(
-                    # indices is not a tuple if it's just a single column.
-                    ct_tuple[0] if len(ct_tuple) == 1 else ct_tuple,
-                    [],
-                )
-            ].values
-            for i, ct_tuple in enumerate(clonotypes.itertuples(index=False, name=None))
-        }
+        # The group number of each cell corresponds to the row in `clonotypes`,
+        # as both are in the order of first appearance.
+        group = context_group[context.cell_clonotype]
+        cells = context.cells[np.argsort(group, kind="stable")]
+        indptr = np.zeros(clonotypes.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(group, minlength=clonotypes.shape[0]), out=indptr[1:])
+        self.cell_indices = CellIndices(indptr, cells, context.obs_names)
 
         # make 'within group' a single column of tuples (-> only one distance
-        # matrix instead of one per column.)
+        # matrix instead of one per column.) Tuples are only built for the
+        # distinct combinations of groups.
         if self.within_group is not None:
-            within_group_col = list(
-                clonotypes.loc[:, self.within_group].itertuples(index=False, name=None)
+            group, first = _unique_rows(context.codes(self.within_group)[context_rows])
+            group_tuples = np.empty(len(first), dtype=object)
+            group_tuples[:] = list(
+                clonotypes.loc[first, self.within_group].itertuples(
+                    index=False, name=None
+                )
             )
             for tmp_col in self.within_group:
                 del clonotypes[tmp_col]
-            clonotypes["within_group"] = within_group_col
+            clonotypes["within_group"] = group_tuples[group]
 
         # consistency check: there must not be a secondary chain if there is no
         # primary one:
         if "2" in self._dual_ir_cols:
             for tmp_arm in self._receptor_arm_cols:
-                primary_is_nan = (
-                    clonotypes[f"IR_{tmp_arm}_1_{self.sequence_key}"] == "nan"
-                )
-                secondary_is_nan = (
-                    clonotypes[f"IR_{tmp_arm}_2_{self.sequence_key}"] == "nan"
+                primary_is_nan, secondary_is_nan = (
+                    context.is_nan(
+                        f"IR_{tmp_arm}_{c}_{self.sequence_key}", context_rows
+                    )
+                    for c in ["1", "2"]
                 )
                 assert not np.sum(
                     ~secondary_is_nan[primary_is_nan]
                 ), "There must not be a secondary chain if there is no primary one"
 
         self.clonotypes = clonotypes
+        return context_rows
 
-    def _add_distance_matrices(self, adata):
+    def _add_distance_matrices(self, context: ClonotypeNeighborContext):
         """Add all required distance matrices to the DoubleLookupNeighborFinder"""
-        # sequence distance matrices
-        for chain_type in self._receptor_arm_cols:
-            self.neighbor_finder.add_distance_matrix(
-                name=chain_type,
-                distance_matrix=self.distance_dict[chain_type]["distances"],
-                labels=self.distance_dict[chain_type]["seqs"],
-            )
-
-        if self.same_v_gene:
-            # V gene distance matrix (identity mat)
-            v_genes = self._unique_values_in_multiple_columns(
-                adata.obs, self._v_gene_cols
-            )
-            self.neighbor_finder.add_distance_matrix(
-                "v_gene", sp.identity(len(v_genes), dtype=bool, format="csr"), v_genes  # type: ignore
-            )
+        # sequence and V gene distance matrices are shared with the context
+        for name in self._receptor_arm_cols + (["v_gene"] if self.same_v_gene else []):
+            self.neighbor_finder.share_distance_matrix(name, context.neighbor_finder)
 
         if self.within_group is not None:
             within_group_values = np.unique(self.clonotypes["within_group"].values)
@@ -165,25 +504,57 @@ class ClonotypeNeighbors:
                 within_group_values,
             )
 
+    def _get_int_dtype(self) -> np.dtype:
+        """The smallest dtype that can hold all sequence distances and a
+        sentinel value for missing chains, see `reduce_or_int`."""
+        max_dist = 0
+        for chain_type in self._receptor_arm_cols:
+            distance_matrix = self.neighbor_finder.distance_matrices[chain_type]
+            if isinstance(distance_matrix, SymmetricDistanceMatrix):
+                distance_matrix = distance_matrix.upper
+            max_dist = max(max_dist, np.max(distance_matrix.data, initial=0))
+        return np.uint8 if max_dist < np.iinfo(np.uint8).max else np.uint16
+
     @staticmethod
-    def _unique_values_in_multiple_columns(
-        df: pd.DataFrame, columns: Sequence[str]
-    ) -> np.ndarray:
-        """Return the Union of unique values of multiple columns of a dataframe"""
-        return np.unique(np.concatenate([df[c].values for c in columns]))  # type: ignore
+    def _is_identity(distance_matrix) -> bool:
+        """Check if a sequence distance matrix is an identity matrix, i.e. each
+        sequence only has a distance of 0 (stored as 1) to itself."""
+        distance_matrix = distance_matrix.tocsr()
+        return distance_matrix.nnz == distance_matrix.shape[0] and bool(
+            np.all(distance_matrix.diagonal() == 1)
+        )
+
+    def _add_lookup_tables(
+        self,
+        context: Optional[ClonotypeNeighborContext] = None,
+        context_rows: Optional[np.ndarray] = None,
+    ):
+        """Add all required lookup tables to the DoubleLookupNeighborFinder.
+
+        If a context is given, the forward lookup tables are derived from the
+        context. `context_rows` are the rows in the context corresponding to the
+        clonotypes."""
+
+        def _forward(feature_col, distance_matrix):
+            if context is None:
+                return None
+            return context.forward_lookup_table(
+                feature_col, distance_matrix, context_rows
+            )
 
-    def _add_lookup_tables(self):
-        """Add all required lookup tables to the DoubleLookupNeighborFinder"""
         for arm, i in itertools.product(self._receptor_arm_cols, self._dual_ir_cols):
+            seq_col = f"IR_{arm}_{i}_{self.sequence_key}"
             self.neighbor_finder.add_lookup_table(
-                f"{arm}_{i}", f"IR_{arm}_{i}_{self.sequence_key}", arm
+                f"{arm}_{i}", seq_col, arm, forward=_forward(seq_col, arm)
             )
             if self.same_v_gene:
+                v_col = f"IR_{arm}_{i}_v_call"
                 self.neighbor_finder.add_lookup_table(
                     f"{arm}_{i}_v_call",
-                    f"IR_{arm}_{i}_v_call",
+                    v_col,
                     "v_gene",
                     dist_type="boolean",
+                    forward=_forward(v_col, "v_gene"),
                 )
 
         if self.within_group is not None:
@@ -191,6 +562,12 @@ class ClonotypeNeighbors:
                 "within_group", "within_group", "within_group", dist_type="boolean"
             )
 
+        # forward lookup tables as integer arrays for indexing. Missing values are `-1`.
+        self._forward_int = {
+            name: np.where(np.isnan(forward), -1, forward).astype(int)
+            for name, (_, forward, _) in self.neighbor_finder.lookups.items()
+        }
+
     def _make_chain_count(self) -> None:
         """Compute how many chains there are of each type."""
         cols = {
@@ -212,33 +589,536 @@ class ClonotypeNeighbors:
         start = logging.info(
             "Computing clonotype x clonotype distances."
         )  # type: ignore
+        ct_idx, rows = zip(*self.iter_distances())
+        dist = sp.vstack(rows, format="csr")
+        ct_idx = np.concatenate(ct_idx)
+        if not np.array_equal(ct_idx, np.arange(len(ct_idx))):
+            # restore the order of rows
+            dist = dist[np.argsort(ct_idx), :]
+        dist.eliminate_zeros()
+        logging.hint("Done computing clonotype x clonotype distances. ", time=start)
+        return dist  # type: ignore
+
+    def compute_connected_components(self) -> np.ndarray:
+        """Compute the connected components of the clonotype network, i.e.
+        clonotypes that are connected by a path of neighbors share the same label.
+
+        Rows of the distance matrix are consumed as they are produced, the
+        clonotype x clonotype matrix is never materialized.
+
+        Returns
+        -------
+        The component of each clonotype. Components are numbered in the order of
+        their first clonotype.
+        """
+        start = logging.info(
+            "Computing connected components of clonotypes."
+        )  # type: ignore
         n_clonotypes = self.clonotypes.shape[0]
+        if self.engine == "hash":
+            # clonotypes and their keys form a bipartite graph
+            ct_idx, key_idx = self._hash_keys()
+            uf = UnionFind(n_clonotypes + np.max(key_idx, initial=-1) + 1)
+            uf.union(ct_idx, key_idx + n_clonotypes)
+            # components are labelled by their smallest node, which is a clonotype
+            uf.parent = uf.parent[:n_clonotypes]
+        else:
+            uf = UnionFind.from_row_blocks(self.iter_distances(), n_clonotypes)
+        logging.hint("Done computing connected components. ", time=start)
+        return uf.membership
+
+    def iter_distances(self) -> Iterator[Tuple[np.ndarray, sp.csr_matrix]]:
+        """Lazily compute the distances between clonotypes.
+
+        Yields
+        ------
+        Tuples `(ct_idx, rows)` where `rows` is a sparse matrix with the
+        distances of the clonotypes `ct_idx` to all clonotypes. Every clonotype
+        is contained in exactly one tuple.
+        """
+        n_clonotypes = self.clonotypes.shape[0]
+
+        if self.engine == "hash":
+            yield np.arange(n_clonotypes), self._hash_distances()
+            return
+
+        # Paired chains are scored for all clonotypes at once, there is no
+        # need to split them, unless by group.
+        decompose = self.decompose and (
+            not self._is_paired or self.within_group is not None
+        )
+        groups = self._component_groups() if decompose else []
+        if len(groups) > 1:
+            # the subproblems are created by the workers
+            tasks = groups
+        elif self._is_paired:
+            # paired chains can be scored directly without merging rows
+            yield np.arange(n_clonotypes), self._paired_chain_distances()
+            return
+        else:
+            tasks = self._row_ranges()
 
         # only use multiprocessing for sufficiently large datasets
         # for small datasets the overhead is too large for a benefit
         if self.n_jobs == 1 or n_clonotypes <= 2 * self.chunksize:
-            dist_rows = tqdm(
-                (self._dist_for_clonotype(i) for i in range(n_clonotypes)),
-                total=n_clonotypes,
-            )
+            results = tqdm((self._dist_for_task(t) for t in tasks), total=len(tasks))
+            yield from zip(map(np.asarray, tasks), results)
         else:
             logging.info(
                 "NB: Computation happens in chunks. The progressbar only advances "
                 "when a chunk has finished. "
             )  # type: ignore
 
-            dist_rows = process_map(
-                self._dist_for_clonotype,
-                range(n_clonotypes),
-                max_workers=self.n_jobs if self.n_jobs is not None else cpu_count(),
-                chunksize=2000,
-                tqdm_class=tqdm,
+            # like `process_map`, but yields the results as they come in.
+            # Only the tasks are sent to the workers.
+            with self._worker_pool() as executor:
+                results = tqdm(
+                    executor.map(_worker_dist_for_task, tasks), total=len(tasks)
+                )
+                yield from zip(map(np.asarray, tasks), results)
+
+    @contextmanager
+    def _worker_pool(self) -> Iterator[ProcessPoolExecutor]:
+        """A process pool whose workers have access to this instance
+        via `_worker_neighbors`.
+
+        With the `fork` start method, workers inherit the instance copy-on-write.
+        Otherwise, it is pickled once per worker.
+        """
+        max_workers = self.n_jobs if self.n_jobs is not None else cpu_count()
+        if mp.get_start_method() == "fork":
+            _init_worker(self)
+            try:
+                with ProcessPoolExecutor(
+                    max_workers, mp_context=mp.get_context("fork")
+                ) as executor:
+                    yield executor
+            finally:
+                _init_worker(None)
+        else:
+            with ProcessPoolExecutor(
+                max_workers, initializer=_init_worker, initargs=(self,)
+            ) as executor:
+                yield executor
+
+    def _dist_for_task(self, task: Union[range, np.ndarray]) -> sp.csr_matrix:
+        """Compute the distances of the clonotypes in `task` to all clonotypes.
+
+        Parameters
+        ----------
+        task
+            Either a range of clonotypes or the clonotypes of a subproblem
+            (see `_component_groups`).
+
+        Returns
+        -------
+        A CSR matrix with one row per clonotype in `task`.
+        """
+        if isinstance(task, range):
+            return self._dist_for_rows(task)
+        res = self._dist_for_subproblem(self._make_subproblem(task))
+        # map the columns back to all clonotypes
+        return sp.csr_matrix(
+            (res.data, task[res.indices], res.indptr),
+            shape=(res.shape[0], self.clonotypes.shape[0]),
+        )
+
+    def _row_ranges(self) -> List[range]:
+        """Split the clonotypes into ranges of `chunksize` clonotypes."""
+        n_clonotypes = self.clonotypes.shape[0]
+        return [
+            range(i, min(i + self.chunksize, n_clonotypes))
+            for i in range(0, n_clonotypes, self.chunksize)
+        ]
+
+    def _dist_for_rows(self, rows: range) -> sp.csr_matrix:
+        """Compute the distances of a range of at most `chunksize` clonotypes
+        with the `sparse` or `rowwise` engine."""
+        if self.engine == "sparse":
+            return self._dist_for_block(rows.start)
+        else:
+            return sp.vstack([self._dist_for_clonotype(i) for i in rows], format="csr")
+
+    @property
+    def _is_paired(self) -> bool:
+        """Whether distances of the `sparse` engine can be computed with
+        `_paired_chain_distances`."""
+        return (
+            self.engine == "sparse"
+            and self.receptor_arms == "all"
+            and self.dual_ir == "primary_only"
+        )
+
+    def _component_groups(self) -> Sequence[np.ndarray]:
+        """Split the clonotypes into groups that can't be neighbors of each other.
+
+        Clonotypes can only be neighbors if they have chains that are
+        connected in the sequence distance graph of a receptor arm and, if
+        `within_group` is specified, belong to the same group. Connected
+        components of the sequence graphs are merged via the clonotypes that
+        contain them. The resulting components are packed into groups of
+        approximately `chunksize` clonotypes. A group never contains
+        clonotypes of different `within_group` values.
+
+        Returns
+        -------
+        List of sorted arrays of clonotype indices.
+        """
+        n_clonotypes = self.clonotypes.shape[0]
+        within_group = (
+            self._forward_int["within_group"]
+            if self.within_group is not None
+            else np.zeros(n_clonotypes, dtype=int)
+        )
+        uf = UnionFind(n_clonotypes)
+        for arm in self._receptor_arm_cols:
+            distance_matrix = self.neighbor_finder.distance_matrices[arm]
+            if isinstance(distance_matrix, SymmetricDistanceMatrix):
+                # the upper triangle has the same (weakly) connected components
+                distance_matrix = distance_matrix.upper
+            seq_component = connected_components(distance_matrix)
+            # clonotypes are connected by a common sequence component;
+            # missing chains don't connect anything.
+            ct_idx, component = [], []
+            for c in self._dual_ir_cols:
+                forward = self._forward_int[f"{arm}_{c}"]
+                tmp_ct_idx = np.flatnonzero(forward >= 0)
+                ct_idx.append(tmp_ct_idx)
+                # sequence components are split by group
+                component.append(
+                    seq_component[forward[tmp_ct_idx]].astype(np.int64)
+                    * (np.max(within_group, initial=0) + 1)
+                    + within_group[tmp_ct_idx]
+                )
+            ct_idx, component = np.concatenate(ct_idx), np.concatenate(component)
+            # the first clonotype of each component represents the component
+            order = np.lexsort((ct_idx, component))
+            ct_idx, component = ct_idx[order], component[order]
+            is_first = np.r_[True, component[1:] != component[:-1]]
+            first = ct_idx[is_first][np.cumsum(is_first) - 1]
+            uf.union(ct_idx, first)
+
+        # Clonotypes in order of their within_group value and their component.
+        # Components in order of their first clonotype.
+        membership = uf.membership
+        order = np.lexsort((membership, within_group))
+        is_last = np.r_[membership[order][1:] != membership[order][:-1], True]
+        component_end = np.flatnonzero(is_last) + 1
+        is_last_in_group = np.r_[
+            within_group[order][1:] != within_group[order][:-1], True
+        ][is_last]
+
+        # greedily pack consecutive components of the same group
+        groups, start = [], 0
+        for end, last_in_group in zip(component_end, is_last_in_group):
+            if end - start >= self.chunksize or last_in_group:
+                groups.append(np.sort(order[start:end]))
+                start = end
+        return groups
+
+    def _make_subproblem(self, ct_idx: np.ndarray) -> "ClonotypeNeighbors":
+        """Create a ClonotypeNeighbors object for a subset of clonotypes that only
+        holds the lookup tables and sequence distances of these clonotypes."""
+        sub = copy.copy(self)
+        sub.clonotypes = self.clonotypes.iloc[ct_idx, :].reset_index(drop=True)
+        sub.cell_indices = None
+        sub.distance_dict = None
+        sub._chain_count = {k: v[ct_idx] for k, v in self._chain_count.items()}
+        sub.decompose = False
+        # all clonotypes of a subproblem belong to the same group
+        sub.within_group = None
+
+        nf = self.neighbor_finder
+        sub.neighbor_finder = DoubleLookupNeighborFinder(sub.clonotypes)
+        for name, distance_matrix in nf.distance_matrices.items():
+            if name == "within_group":
+                continue
+            # labels can be tuples (`within_group`), therefore use a list.
+            labels = list(nf.distance_matrix_labels[name])
+            if name in self._receptor_arm_cols:
+                # only the sequences of the subset
+                seq_idx = np.concatenate(
+                    [nf.lookups[f"{name}_{c}"][1][ct_idx] for c in self._dual_ir_cols]
+                )
+                seq_idx = np.unique(seq_idx[~np.isnan(seq_idx)].astype(int))
+                distance_matrix = distance_submatrix(distance_matrix, seq_idx)
+                labels = [labels[i] for i in seq_idx]
+            else:
+                labels = labels[: distance_matrix.shape[0]]
+            sub.neighbor_finder.add_distance_matrix(name, distance_matrix, labels)
+        sub._add_lookup_tables()
+        return sub
+
+    @staticmethod
+    def _dist_for_subproblem(sub: "ClonotypeNeighbors") -> sp.csr_matrix:
+        """Compute the distances between the clonotypes of a subproblem."""
+        if sub._is_paired:
+            return sub._paired_chain_distances()
+        return sp.vstack(
+            [sub._dist_for_rows(rows) for rows in sub._row_ranges()], format="csr"
+        )
+
+    def _hash_keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Assign keys to clonotypes such that, with identity distances,
+        two clonotypes are neighbors if and only if they share a key.
+
+        This is equivalent to merging the rows in `_dist_for_clonotype`:
+          * `primary_only`: the key is the primary chain
+          * `all`: the key is the (unordered) set of chains
+          * `any`: each chain is a key
+        For multiple receptor arms, `any` uses the keys of all arms and `all` uses
+        all combinations of one key per arm for clonotypes with the same arms.
+        With `same_v_gene`, chains are compared including their V gene.
+        Chains without V gene never match. With `within_group`, keys are
+        additionally specific to the group.
+
+        Returns
+        -------
+        ct_idx
+            Clonotype index
+        key_idx
+            Key index, consecutive integers starting from 0.
+        """
+        n_clonotypes = self.clonotypes.shape[0]
+        # for each arm, a (clonotype, key) pair per key.
+        arm_keys = dict()
+        for arm in self._receptor_arm_cols:
+            seq_cols = [f"IR_{arm}_{c}_{self.sequence_key}" for c in self._dual_ir_cols]
+            seqs = self.clonotypes.loc[:, seq_cols].values
+            # codes are shared between the first and second chain
+            codes = pd.factorize(seqs.ravel())[0].reshape(seqs.shape)
+            valid = seqs != "nan"
+            # chains without V gene can't match anything
+            invalid_v = np.zeros_like(valid)
+            if self.same_v_gene:
+                v_genes = self.clonotypes.loc[
+                    :, [f"IR_{arm}_{c}_v_call" for c in self._dual_ir_cols]
+                ].values
+                v_codes = pd.factorize(v_genes.ravel())[0].reshape(v_genes.shape)
+                codes = pd.factorize(
+                    (codes * (np.max(v_codes, initial=0) + 1) + v_codes).ravel()
+                )[0].reshape(codes.shape)
+                invalid_v = valid & (v_genes == "nan")
+                valid &= ~invalid_v
+            codes = np.where(valid, codes, -1)
+
+            if self.dual_ir == "primary_only":
+                ct_idx = np.flatnonzero(valid[:, 0])
+                keys = codes[ct_idx, 0]
+            elif self.dual_ir == "all":
+                # the sorted pair of chains, -1 = no secondary chain.
+                # Only if all chains can match.
+                ct_idx = np.flatnonzero(valid[:, 0] & ~np.any(invalid_v, axis=1))
+                pair = np.sort(codes[ct_idx, :], axis=1) + 1
+                keys = pd.factorize(
+                    pair[:, 0] * (np.max(pair, initial=0) + 1) + pair[:, 1]
+                )[0]
+            else:  # "any"
+                ct_idx, chain = np.nonzero(valid)
+                keys = codes[ct_idx, chain]
+            arm_keys[arm] = ct_idx, keys
+
+        if len(self._receptor_arm_cols) == 1:
+            ct_idx, keys = arm_keys[self._receptor_arm_cols[0]]
+        elif self.receptor_arms == "any":
+            (ct_vj, keys_vj), (ct_vdj, keys_vdj) = arm_keys["VJ"], arm_keys["VDJ"]
+            ct_idx = np.concatenate([ct_vj, ct_vdj])
+            keys = np.concatenate([keys_vj, keys_vdj + np.max(keys_vj, initial=-1) + 1])
+        else:  # "all"
+            # the arms of a clonotype, 1 = VJ, 2 = VDJ, 3 = both
+            has_arm = {
+                arm: self.clonotypes[f"IR_{arm}_1_{self.sequence_key}"].values != "nan"
+                for arm in ["VJ", "VDJ"]
+            }
+            arms = has_arm["VJ"] + 2 * has_arm["VDJ"]
+            df_keys = {
+                arm: pd.DataFrame({"ct_idx": ct, arm: k + 1})
+                for arm, (ct, k) in arm_keys.items()
+            }
+            # every combination of one VJ and one VDJ key; 0 = arm not present
+            df = (
+                pd.DataFrame({"ct_idx": np.arange(n_clonotypes), "arms": arms})
+                .merge(df_keys["VJ"], how="left")
+                .merge(df_keys["VDJ"], how="left")
+                .fillna(0)
+                .astype(np.int64)
+            )
+            # the clonotype must have a key for every arm it has
+            has_keys = ((df["VJ"] > 0) == ((df["arms"] & 1) > 0)) & (
+                (df["VDJ"] > 0) == ((df["arms"] & 2) > 0)
             )
+            df = df.loc[has_keys & (df["arms"] > 0)]
+            ct_idx = df["ct_idx"].values
+            keys = pd.factorize(
+                (df["arms"].values * (df["VJ"].max() + 1) + df["VJ"].values)
+                * (df["VDJ"].max() + 1)
+                + df["VDJ"].values
+            )[0]
 
-        dist = sp.vstack(dist_rows)
+        if self.within_group is not None:
+            group = pd.factorize(self.clonotypes["within_group"].values)[0]
+            keys = pd.factorize(
+                keys.astype(np.int64) * (np.max(group, initial=0) + 1) + group[ct_idx]
+            )[0]
+
+        return ct_idx.astype(np.int64), keys.astype(np.int64)
+
+    def _hash_distances(self) -> sp.csr_matrix:
+        """Compute the distances between clonotypes with the `hash` engine.
+        All neighbors have a distance of 0 (stored as 1)."""
+        n_clonotypes = self.clonotypes.shape[0]
+        ct_idx, key_idx = self._hash_keys()
+        incidence = sp.csr_matrix(
+            (np.ones(len(ct_idx), dtype=np.int32), (ct_idx, key_idx)),
+            shape=(n_clonotypes, np.max(key_idx, initial=-1) + 1),
+        )
+        dist = (incidence @ incidence.T).tocsr()
+        dist.data = np.ones(len(dist.data), dtype=np.uint8)
+        return dist.astype(np.uint8)
+
+    def _paired_chain_distances(self) -> sp.csr_matrix:
+        """Compute the distances between clonotypes for `receptor_arms="all"`
+        and `dual_ir="primary_only"` in a single vectorized step.
+
+        This is equivalent to merging the rows in `_dist_for_clonotype`.
+        """
+        dist = paired_chain_distances(
+            (self._forward_int["VJ_1"], self._forward_int["VDJ_1"]),
+            (
+                self.neighbor_finder.distance_matrices["VJ"],
+                self.neighbor_finder.distance_matrices["VDJ"],
+            ),
+            # don't apply an additional cutoff, the max. value representable by uint8
+            cutoff=np.iinfo(np.uint8).max - 1,
+            combine="max",
+            v_gene_idx=(
+                self._forward_int["VJ_1_v_call"],
+                self._forward_int["VDJ_1_v_call"],
+            )
+            if self.same_v_gene
+            else None,
+        )
+        if self.within_group is not None:
+            group = self._forward_int["within_group"]
+            dist = dist.tocoo()
+            same_group = group[dist.row] == group[dist.col]
+            dist = sp.csr_matrix(
+                (dist.data[same_group], (dist.row[same_group], dist.col[same_group])),
+                shape=dist.shape,
+                dtype=np.uint8,
+            )
+        return dist
+
+    def _dist_for_block(self, block_start: int) -> sp.csr_matrix:
+        """Compute neighboring clonotypes for a block of `chunksize` clonotypes
+        starting at `block_start`.
+
+        The distances between two chain slots are retrieved for the entire block
+        at once via :meth:`DoubleLookupNeighborFinder.lookup_many`. The merging of
+        chains and receptor arms is equivalent to `_dist_for_clonotype`, but is
+        applied elementwise to all pairs of clonotypes with at least one distance
+        in the block. Distances are kept as integers and missing chains are
+        encoded with a sentinel value, see :func:`reduce_or_int`.
+        """
+        n_clonotypes = self.clonotypes.shape[0]
+        block_end = min(block_start + self.chunksize, n_clonotypes)
+        chain_ids = (
+            [(1, 1)]
+            if self.dual_ir == "primary_only"
+            else [(1, 1), (2, 2), (1, 2), (2, 1)]
+        )
+
+        # linear indices (row * n_clonotypes + col) and values of all chain pairs
+        lookup = dict()
+        for tmp_arm, (c1, c2) in itertools.product(self._receptor_arm_cols, chain_ids):
+            tmp_dist = self.neighbor_finder.lookup_many(
+                range(block_start, block_end), f"{tmp_arm}_{c1}", f"{tmp_arm}_{c2}"
+            ).tocoo()
+            linear = tmp_dist.row.astype(np.int64) * n_clonotypes + tmp_dist.col
+            order = np.argsort(linear)
+            lookup[(tmp_arm, c1, c2)] = linear[order], tmp_dist.data[order]
+
+        # all pairs of clonotypes that have at least one distance
+        has_distance = np.unique(np.concatenate([x[0] for x in lookup.values()]))
+        rows, cols = np.divmod(has_distance, n_clonotypes)
+        ct_ids = rows + block_start
+
+        # sentinel for missing chains
+        dtype, missing = self._int_dtype, np.iinfo(self._int_dtype).max
+
+        def _lookup_dist_for_chains(
+            tmp_arm: Literal["VJ", "VDJ"], c1: Literal[1, 2], c2: Literal[1, 2]
+        ):
+            """Lookup the distance between two chains of a given receptor
+            arm for all pairs in `has_distance`. Missing chains are `missing`."""
+            linear, data = lookup[(tmp_arm, c1, c2)]
+            tmp_array = np.zeros(len(has_distance), dtype=dtype)
+            if len(linear):
+                idx = np.minimum(np.searchsorted(linear, has_distance), len(linear) - 1)
+                found = linear[idx] == has_distance
+                tmp_array[found] = data[idx[found]]
+            tmp_array[self._forward_int[f"{tmp_arm}_{c2}"][cols] < 0] = missing
+            if self.same_v_gene:
+                v_gene1 = self._forward_int[f"{tmp_arm}_{c1}_v_call"][ct_ids]
+                v_gene2 = self._forward_int[f"{tmp_arm}_{c2}_v_call"][cols]
+                tmp_array[
+                    ((v_gene1 < 0) | (v_gene1 != v_gene2)) & (tmp_array != missing)
+                ] = 0
+            return tmp_array
+
+        # Merge the distances of chains
+        res = []
+        for tmp_arm in self._receptor_arm_cols:
+            chain_count = self._chain_count[tmp_arm][ct_ids]
+            if self.dual_ir == "primary_only":
+                tmp_res = _lookup_dist_for_chains(tmp_arm, 1, 1)
+            elif self.dual_ir == "all":
+                tmp_res = reduce_or_int(
+                    reduce_and_int(
+                        _lookup_dist_for_chains(tmp_arm, 1, 1),
+                        _lookup_dist_for_chains(tmp_arm, 2, 2),
+                        chain_count=chain_count,
+                        missing=missing,
+                    ),
+                    reduce_and_int(
+                        _lookup_dist_for_chains(tmp_arm, 1, 2),
+                        _lookup_dist_for_chains(tmp_arm, 2, 1),
+                        chain_count=chain_count,
+                        missing=missing,
+                    ),
+                    missing=missing,
+                )
+            else:  # "any"
+                tmp_res = reduce_or_int(
+                    _lookup_dist_for_chains(tmp_arm, 1, 1),
+                    _lookup_dist_for_chains(tmp_arm, 1, 2),
+                    _lookup_dist_for_chains(tmp_arm, 2, 2),
+                    _lookup_dist_for_chains(tmp_arm, 2, 1),
+                    missing=missing,
+                )
+
+            res.append(tmp_res)
+
+        # Merge the distances of arms.
+        if self.receptor_arms == "all":
+            res = reduce_and_int(
+                *res, chain_count=self._chain_count["arms"][ct_ids], missing=missing
+            )
+        else:
+            res = reduce_or_int(*res, missing=missing)
+
+        if self.within_group is not None:
+            group = self._forward_int["within_group"]
+            res[group[ct_ids] != group[cols]] = 0
+
+        # missing chains don't have a distance
+        res[res == missing] = 0
+        dist = sp.csr_matrix(
+            (res.astype(np.uint8), (rows, cols)),
+            shape=(block_end - block_start, n_clonotypes),
+        )
         dist.eliminate_zeros()
-        logging.hint("Done computing clonotype x clonotype distances. ", time=start)
-        return dist  # type: ignore
+        return dist
 
     def _dist_for_clonotype(self, ct_id: int) -> sp.csr_matrix:
         """Compute neighboring clonotypes for a given clonotype.
@@ -0,0 +1,421 @@
+"""Candidate filters ("engines") that restrict the pairs of sequences for which
+a distance needs to be computed, and a cost model to choose between them."""
+import abc
+from multiprocessing import cpu_count
+import time
+from typing import Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from .._compat import Literal
+
+EngineType = Literal["brute_force", "length_bucketed", "deletion_index", "qgram"]
+
+#: Approximate memory required per match while collecting the (distance, row, col)
+#: tuples returned by the workers.
+_BYTES_PER_MATCH = 150
+#: Approximate memory required per intermediate candidate pair, including
+#: temporary copies made while deduplicating candidates.
+_BYTES_PER_CANDIDATE = 48
+#: Approximate memory required per entry of an index (deletion variants, q-grams)
+_BYTES_PER_INDEX_ENTRY = 100
+#: Approximate time required to generate and deduplicate an intermediate
+#: candidate pair.
+_SECONDS_PER_CANDIDATE = 1e-7
+
+
+class _CandidateFilterMixin(abc.ABC):
+    """Mixin for a :class:`~scirpy.ir_dist.metrics.ParallelDistanceCalculator`
+    that supports candidate filters.
+
+    The candidate filters are guaranteed to return all pairs of sequences within a
+    Levenshtein distance of `cutoff` and a length difference of `_max_len_diff`.
+    Only metrics that are bounded from below by the Levenshtein distance
+    can use them.
+    """
+
+    #: Engines supported by this DistanceCalculator.
+    ENGINES = ("brute_force", "length_bucketed", "deletion_index", "qgram")
+
+    @property
+    @abc.abstractmethod
+    def _max_len_diff(self) -> int:
+        """The max. length difference of two sequences within the cutoff."""
+
+    @abc.abstractmethod
+    def _compute_pairs(
+        self,
+        seqs1: Sequence[str],
+        seqs2: Sequence[str],
+        rows: Sequence[int],
+        cols: Sequence[int],
+    ) -> Sequence[Tuple[int, int, int]]:
+        """Compute the distances for a list of candidate pairs.
+
+        Parameters
+        ----------
+        seqs1, seqs2
+            The sequences of each pair.
+        rows, cols
+            The coordinates of each pair in the final matrix.
+
+        Returns
+        ------
+        List of (distance, row, col) tuples for all pairs with distance != 0.
+        """
+
+
+def _seq_lengths(seqs: Sequence[str]) -> np.ndarray:
+    return np.fromiter((len(s) for s in seqs), dtype=int, count=len(seqs))
+
+
+def _unique_pairs(
+    rows: np.ndarray, cols: np.ndarray, n_cols: int, square: bool
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Deduplicate candidate pairs. For square matrices, only pairs
+    in the upper triangle (including the diagonal) are retained."""
+    rows, cols = rows.astype(np.int64), cols.astype(np.int64)
+    if not len(rows):
+        return rows, cols
+    if square:
+        rows, cols = np.minimum(rows, cols), np.maximum(rows, cols)
+    linear = np.unique(rows.astype(np.int64) * n_cols + cols)
+    return linear // n_cols, linear % n_cols
+
+
+def _length_bucketed_pairs(
+    seqs1: Sequence[str],
+    seqs2: Optional[Sequence[str]],
+    max_len_diff: int,
+    stats: Optional[dict] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """All pairs of sequences with a length difference `<= max_len_diff`."""
+    square = seqs2 is None
+    lengths1 = _seq_lengths(seqs1)
+    lengths2 = lengths1 if square else _seq_lengths(seqs2)
+    order2 = np.argsort(lengths2, kind="stable")
+    sorted_lengths2 = lengths2[order2]
+    start = np.searchsorted(sorted_lengths2, lengths1 - max_len_diff, side="left")
+    end = np.searchsorted(sorted_lengths2, lengths1 + max_len_diff, side="right")
+    counts = end - start
+    _record(stats, n_intermediate=np.sum(counts))
+    rows = np.repeat(np.arange(len(lengths1)), counts)
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    cols = order2[np.repeat(start, counts) + offsets]
+    if square:
+        mask = rows <= cols
+        rows, cols = rows[mask], cols[mask]
+    return rows, cols
+
+
+def _deletion_variants(seq: str, max_deletions: int) -> set:
+    """All strings that can be obtained by deleting up to `max_deletions`
+    characters from `seq`."""
+    variants = {seq}
+    frontier = {seq}
+    for _ in range(max_deletions):
+        frontier = {s[:i] + s[i + 1 :] for s in frontier for i in range(len(s))}
+        variants |= frontier
+    return variants
+
+
+def _deletion_index_pairs(
+    seqs1: Sequence[str],
+    seqs2: Optional[Sequence[str]],
+    max_dist: int,
+    max_len_diff: int,
+    stats: Optional[dict] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairs of sequences that share a deletion variant.
+
+    If the Levenshtein distance of two sequences is `<= max_dist`, there is a
+    common string that can be obtained from either sequence with at most
+    `max_dist` deletions (symmetric deletion index).
+    """
+    square = seqs2 is None
+
+    def _variant_table(seqs):
+        return pd.DataFrame.from_records(
+            (
+                (variant, i)
+                for i, s in enumerate(seqs)
+                for variant in _deletion_variants(s, max_dist)
+            ),
+            columns=["variant", "idx"],
+        )
+
+    variants1 = _variant_table(seqs1)
+    variants2 = variants1 if square else _variant_table(seqs2)
+    pairs = variants1.merge(variants2, on="variant", suffixes=("1", "2"))
+    _record(
+        stats,
+        n_index=variants1.shape[0] + (0 if square else variants2.shape[0]),
+        n_intermediate=pairs.shape[0],
+    )
+    rows, cols = pairs["idx1"].values, pairs["idx2"].values
+    n_cols = len(seqs1) if square else len(seqs2)
+    rows, cols = _unique_pairs(rows, cols, n_cols, square)
+    return _filter_length_diff(seqs1, seqs2, rows, cols, max_len_diff)
+
+
+def _qgram_pairs(
+    seqs1: Sequence[str],
+    seqs2: Optional[Sequence[str]],
+    max_dist: int,
+    max_len_diff: int,
+    q: int = 2,
+    stats: Optional[dict] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairs of sequences that pass the q-gram count filter.
+
+    If the Levenshtein distance of two sequences `s1`, `s2` is `<= max_dist`, they
+    share at least `max(|s1|, |s2|) - q + 1 - max_dist * q` q-grams. Pairs for
+    which this bound is not positive are always candidates.
+    """
+    square = seqs2 is None
+    seqs2_ = seqs1 if square else seqs2
+    lengths1 = _seq_lengths(seqs1)
+    lengths2 = lengths1 if square else _seq_lengths(seqs2_)
+
+    def _qgrams(seqs):
+        return [s[i : i + q] for s in seqs for i in range(len(s) - q + 1)]
+
+    qgram_codes, _ = pd.factorize(
+        np.array(_qgrams(seqs1) + ([] if square else _qgrams(seqs2_)), dtype=object)
+    )
+    n_qgrams = np.max(qgram_codes, initial=-1) + 1
+
+    def _count_matrix(lengths, codes):
+        counts = np.maximum(lengths - q + 1, 0)
+        return sp.csr_matrix(
+            (
+                np.ones(len(codes), dtype=np.int32),
+                (np.repeat(np.arange(len(lengths)), counts), codes),
+            ),
+            shape=(len(lengths), n_qgrams),
+        )
+
+    n_qgrams1 = np.sum(np.maximum(lengths1 - q + 1, 0))
+    counts1 = _count_matrix(lengths1, qgram_codes[:n_qgrams1])
+    counts2 = counts1 if square else _count_matrix(lengths2, qgram_codes[n_qgrams1:])
+    # the product of q-gram counts is >= the size of the multiset intersection,
+    # i.e. this is a (slightly weaker) valid filter.
+    shared = (counts1 @ counts2.T).tocoo()
+    min_shared = np.maximum(lengths1[shared.row], lengths2[shared.col]) - (
+        q - 1 + max_dist * q
+    )
+    mask = shared.data >= min_shared
+    rows, cols = shared.row[mask], shared.col[mask]
+
+    # the filter doesn't apply for pairs of short sequences
+    max_short_len = q - 1 + max_dist * q
+    short1 = np.flatnonzero(lengths1 <= max_short_len)
+    short2 = short1 if square else np.flatnonzero(lengths2 <= max_short_len)
+    short_rows, short_cols = _length_bucketed_pairs(
+        [seqs1[i] for i in short1],
+        None if square else [seqs2_[i] for i in short2],
+        max_len_diff,
+    )
+    _record(
+        stats,
+        n_index=len(qgram_codes),
+        n_intermediate=shared.nnz + len(short_rows),
+    )
+    rows = np.concatenate([rows, short1[short_rows]])
+    cols = np.concatenate([cols, short2[short_cols]])
+
+    rows, cols = _unique_pairs(rows, cols, len(seqs2_), square)
+    return _filter_length_diff(seqs1, seqs2, rows, cols, max_len_diff)
+
+
+def _record(stats: Optional[dict], **kwargs) -> None:
+    """Record statistics about the size of intermediate results, used to estimate
+    the cost of an engine."""
+    if stats is not None:
+        stats.update({k: int(v) for k, v in kwargs.items()})
+
+
+def _filter_length_diff(
+    seqs1: Sequence[str],
+    seqs2: Optional[Sequence[str]],
+    rows: np.ndarray,
+    cols: np.ndarray,
+    max_len_diff: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    lengths1 = _seq_lengths(seqs1)
+    lengths2 = lengths1 if seqs2 is None else _seq_lengths(seqs2)
+    mask = np.abs(lengths1[rows] - lengths2[cols]) <= max_len_diff
+    return rows[mask], cols[mask]
+
+
+def candidate_pairs(
+    engine: EngineType,
+    seqs1: Sequence[str],
+    seqs2: Optional[Sequence[str]],
+    *,
+    max_dist: int,
+    max_len_diff: int,
+    stats: Optional[dict] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the pairs of sequences for which distances need to be computed.
+
+    Parameters
+    ----------
+    engine
+        The candidate filter to use. `brute_force` returns all pairs.
+    seqs1, seqs2
+        Sequences. If `seqs2` is `None`, only pairs of the upper triangle
+        (including the diagonal) of the square matrix of `seqs1` are returned.
+    max_dist
+        The cutoff of the distance metric. The candidate filters are guaranteed
+        to return all pairs with a Levenshtein distance `<= max_dist`.
+    max_len_diff
+        The maximum length difference of two sequences within the cutoff.
+    stats
+        If a dictionary is passed, the number of index entries (`n_index`) and
+        intermediate candidate pairs (`n_intermediate`) are stored in it.
+
+    Returns
+    -------
+    Row and column indices of the candidate pairs.
+    """
+    if stats is not None:
+        stats.update(n_index=0, n_intermediate=0)
+    if engine == "brute_force":
+        return _length_bucketed_pairs(seqs1, seqs2, np.iinfo(np.int32).max, stats)
+    elif engine == "length_bucketed":
+        return _length_bucketed_pairs(seqs1, seqs2, max_len_diff, stats)
+    elif engine == "deletion_index":
+        return _deletion_index_pairs(seqs1, seqs2, max_dist, max_len_diff, stats)
+    elif engine == "qgram":
+        return _qgram_pairs(seqs1, seqs2, max_dist, max_len_diff, stats=stats)
+    else:
+        raise ValueError(f"Invalid engine: {engine}")
+
+
+def estimate_cost(
+    dist_calc,
+    seqs: Sequence[str],
+    seqs2: Optional[Sequence[str]] = None,
+    *,
+    n_sample: int = 300,
+    random_state: int = 0,
+) -> pd.DataFrame:
+    """Estimate the cost of computing a distance matrix with a
+    :class:`~scirpy.ir_dist.metrics.DistanceCalculator` based on a random sample
+    of sequences.
+
+    Returns
+    -------
+    Data frame with one row for each engine supported by the distance calculator.
+    See :func:`scirpy.ir_dist.estimate_cost` for a description of the columns.
+    """
+    square = seqs2 is None
+    n1 = len(seqs)
+    n2 = n1 if square else len(seqs2)
+    n_pairs = n1 * (n1 + 1) // 2 if square else n1 * n2
+
+    rng = np.random.default_rng(random_state)
+    sample1 = [seqs[i] for i in np.sort(rng.choice(n1, min(n_sample, n1), False))]
+    m1 = len(sample1)
+    if square:
+        sample2, m2 = None, m1
+        n_sample_pairs = m1 * (m1 + 1) // 2
+    else:
+        sample2 = [seqs2[i] for i in np.sort(rng.choice(n2, min(n_sample, n2), False))]
+        m2 = len(sample2)
+        n_sample_pairs = m1 * m2
+
+    # compute distances of the sample in the current process to measure the time
+    # per pair without the overhead of spawning workers.
+    start = time.perf_counter()
+    if hasattr(dist_calc, "_compute_block"):
+        n_sample_matches = len(dist_calc._compute_block(sample1, sample2, (0, 0)))
+    else:
+        sample_dist = dist_calc.calc_dist_mat(sample1, sample2)
+        n_sample_matches = sp.triu(sample_dist).nnz if square else sample_dist.nnz
+    time_per_pair = (time.perf_counter() - start) / max(n_sample_pairs, 1)
+
+    if square:
+        # the diagonal is always within the cutoff
+        n_off_diagonal = m1 * (m1 - 1) // 2
+        density = (n_sample_matches - m1) / n_off_diagonal if n_off_diagonal else 0.0
+        nnz_upper = n1 + density * n1 * (n1 - 1) / 2
+        nnz = n1 + density * n1 * (n1 - 1)
+    else:
+        density = n_sample_matches / max(n_sample_pairs, 1)
+        nnz_upper = nnz = density * n_pairs
+
+    n_jobs = getattr(dist_calc, "n_jobs", None)
+    n_workers = 1 if not hasattr(dist_calc, "n_jobs") else (n_jobs or cpu_count())
+    # data (uint8) + indices (int32) + indptr (int32); squaring the triangular
+    # matrix temporarily requires about three copies.
+    result_bytes = nnz * 5 + (n1 + 1) * 4
+    base_memory = nnz_upper * _BYTES_PER_MATCH + 3 * result_bytes
+
+    records = []
+    engines = (
+        dist_calc.ENGINES
+        if isinstance(dist_calc, _CandidateFilterMixin)
+        else ("brute_force",)
+    )
+    for engine in engines:
+        if engine == "brute_force":
+            n_candidates = n_pairs
+            index_time = 0.0
+            # blocks of sequences are precomputed and sent to the workers
+            block_size = getattr(dist_calc, "block_size", None) or 50
+            memory = base_memory + n_pairs / block_size ** 2 * (16 * block_size + 200)
+        else:
+            stats = dict()
+            start = time.perf_counter()
+            sample_rows, _ = candidate_pairs(
+                engine,
+                sample1,
+                sample2,
+                max_dist=dist_calc.cutoff,
+                max_len_diff=dist_calc._max_len_diff,
+                stats=stats,
+            )
+            sample_index_time = time.perf_counter() - start
+            # the size of the index scales linearly with the number of sequences,
+            # the number of (intermediate) candidates with the number of pairs.
+            seq_scale = (n1 + n2) / max(m1 + m2, 1)
+            pair_scale = n_pairs / max(n_sample_pairs, 1)
+            n_candidates = len(sample_rows) * pair_scale
+            n_intermediate = stats["n_intermediate"] * pair_scale
+            # the time measured on the sample is dominated by building the index.
+            index_time = (
+                sample_index_time * seq_scale + n_intermediate * _SECONDS_PER_CANDIDATE
+            )
+            memory = (
+                base_memory
+                + stats["n_index"] * seq_scale * _BYTES_PER_INDEX_ENTRY
+                + n_intermediate * _BYTES_PER_CANDIDATE
+            )
+        records.append(
+            {
+                "engine": engine,
+                "n_seqs": n1 if square else n1 + n2,
+                "n_pairs": n_pairs,
+                "n_candidates": int(n_candidates),
+                "density": density,
+                "nnz": int(nnz),
+                "memory": int(memory),
+                "time": index_time + n_candidates * time_per_pair / n_workers,
+            }
+        )
+
+    return pd.DataFrame.from_records(records)
+
+
+def select_engine(cost: pd.DataFrame, max_memory: Optional[int] = None) -> str:
+    """Select the fastest engine from the result of :func:`estimate_cost`
+    that stays within the memory budget. Falls back to the engine with the lowest
+    memory footprint, if no engine stays within the budget."""
+    if max_memory is not None:
+        within_budget = cost.loc[cost["memory"] <= max_memory]
+        if not within_budget.shape[0]:
+            return cost["engine"].values[np.argmin(cost["memory"].values)]
+        cost = within_budget
+    return cost["engine"].values[np.argmin(cost["time"].values)]
@@ -1,10 +1,12 @@
 import numpy as np
 import pandas as pd
-from typing import Dict, Hashable, Sequence, Tuple, Union, Mapping
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union, Mapping
 import scipy.sparse as sp
 from scipy.sparse.coo import coo_matrix
 from scipy.sparse.csr import csr_matrix
+from scipy.sparse.linalg import LinearOperator
 from .._compat import Literal
+from ..util.graph import _distance_to_connectivity
 import warnings
 from functools import reduce
 from operator import mul
@@ -76,6 +78,654 @@ def reduce_and(*args, chain_count):
         return tmp_array
 
 
+def reduce_or_int(*args: np.ndarray, missing: int) -> np.ndarray:
+    """Integer version of :func:`reduce_or`.
+
+    Reduce two or more masks by OR: Take the minimum, ignore 0s and
+    missing values. Works on arrays of any shape, reducing elementwise.
+
+    Parameters
+    ----------
+    args
+        Integer arrays of distances. `0` means "no distance", `missing`
+        means "chain is missing" (`nan` in :func:`reduce_or`).
+    missing
+        Sentinel value for missing chains. Must be larger than all distances.
+    """
+    tmp_array = np.stack(args)
+    is_missing = tmp_array == missing
+    # ignore 0s and missing chains by setting them to the largest value
+    min_dist = np.min(
+        np.where((tmp_array == 0) | is_missing, missing, tmp_array), axis=0
+    )
+    res = np.where(min_dist == missing, 0, min_dist)
+    return np.where(np.all(is_missing, axis=0), missing, res).astype(tmp_array.dtype)
+
+
+def reduce_and_int(
+    *args: np.ndarray, chain_count: Union[int, np.ndarray], missing: int
+) -> np.ndarray:
+    """Integer version of :func:`reduce_and`.
+
+    Reduce two or more masks by AND: Take the maximum, ignore missing values.
+    Only entries where the number of non-missing values equals `chain_count`
+    are comparable. Works on arrays of any shape, reducing elementwise.
+
+    Parameters
+    ----------
+    args
+        Integer arrays of distances. `0` means "no distance", `missing`
+        means "chain is missing" (`nan` in :func:`reduce_and`).
+    chain_count
+        Scalar or array that is broadcast against the elements of `args`.
+    missing
+        Sentinel value for missing chains. Must be larger than all distances.
+    """
+    tmp_array = np.stack(args)
+    is_missing = tmp_array == missing
+    n_present = np.sum(~is_missing, axis=0)
+    has_zero = np.any(tmp_array == 0, axis=0)
+    max_dist = np.max(np.where(is_missing, 0, tmp_array), axis=0)
+    res = np.where(has_zero | (n_present != chain_count), 0, max_dist)
+    return np.where(n_present == 0, missing, res).astype(tmp_array.dtype)
+
+
+def _csr_gather(indptr: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized gather of multiple rows of a CSR structure.
+
+    Returns
+    -------
+    owner
+        For each gathered entry, the position in `rows` it belongs to.
+    pos
+        For each gathered entry, the position in the `indices`/`data` arrays.
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), counts)
+    pos = np.arange(np.sum(counts)) + np.repeat(
+        starts - np.cumsum(counts) + counts, counts
+    )
+    return owner, pos
+
+
+def _gather_distance_rows(
+    distance_matrix: Union[sp.csr_matrix, "SymmetricDistanceMatrix"], rows: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get all non-zero entries of multiple rows of a distance matrix.
+
+    Returns
+    -------
+    Arrays with the position in `rows`, the column index and the value
+    of each entry.
+    """
+    if isinstance(distance_matrix, SymmetricDistanceMatrix):
+        return distance_matrix.gather_rows(rows)
+    owner, pos = _csr_gather(distance_matrix.indptr, rows)
+    return owner, distance_matrix.indices[pos], distance_matrix.data[pos]
+
+
+def distance_submatrix(
+    distance_matrix: Union[sp.csr_matrix, "SymmetricDistanceMatrix"], idx: np.ndarray
+) -> sp.csr_matrix:
+    """Get the square submatrix `D[idx, :][:, idx]` of a distance matrix.
+
+    Parameters
+    ----------
+    distance_matrix
+        Sparse distance matrix in CSR format or as :class:`SymmetricDistanceMatrix`
+    idx
+        Sorted array of unique row/column indices.
+    """
+    owner, cols, data = _gather_distance_rows(distance_matrix, idx)
+    pos = np.minimum(np.searchsorted(idx, cols), len(idx) - 1)
+    keep = idx[pos] == cols
+    return sp.csr_matrix(
+        (data[keep], (owner[keep], pos[keep])),
+        shape=(len(idx), len(idx)),
+        dtype=distance_matrix.dtype,
+    )
+
+
+class SymmetricDistanceMatrix:
+    """A symmetric, sparse distance matrix of which only the upper triangle
+    (including the diagonal) is stored.
+
+    Compared to the full matrix, this halves the memory footprint.
+    Row `i` is obtained by combining row `i` of the upper triangle (CSR) with
+    column `i` of the upper triangle (CSC). The CSC representation is
+    only built on the first access of a row, the strictly lower triangle
+    (see :attr:`strict_lower`) on its first access.
+
+    Parameters
+    ----------
+    upper_triangle
+        A sparse matrix. Only the upper triangle including the diagonal is used,
+        i.e. this can be either a full, symmetric matrix or a triangular matrix.
+    """
+
+    def __init__(self, upper_triangle: sp.spmatrix):
+        upper = sp.triu(upper_triangle, format="csr")
+        upper.eliminate_zeros()
+        if upper.nnz < np.iinfo(np.int32).max:
+            upper.indices = upper.indices.astype(np.int32)
+            upper.indptr = upper.indptr.astype(np.int32)
+        self.upper = upper
+        self._csc = None
+        self._strict_lower = None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.upper.shape
+
+    @property
+    def dtype(self):
+        return self.upper.dtype
+
+    @property
+    def nnz(self) -> int:
+        """Number of stored entries (upper triangle only)"""
+        return self.upper.nnz
+
+    def eliminate_zeros(self):
+        self.upper.eliminate_zeros()
+        self._csc = None
+        self._strict_lower = None
+
+    @property
+    def strict_lower(self) -> sp.csr_matrix:
+        """The lower triangle without the diagonal (CSR)."""
+        if self._strict_lower is None:
+            self._strict_lower = sp.triu(self.upper, k=1, format="csr").T.tocsr()
+        return self._strict_lower
+
+    def row(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the column indices and values of all non-zero entries in row `i`."""
+        if self._csc is None:
+            self._csc = self.upper.tocsc()
+        upper, csc = self.upper, self._csc
+        # entries left of the diagonal are stored in column `i` of the upper triangle
+        col_start, col_end = csc.indptr[i], csc.indptr[i + 1]
+        n_lower = np.searchsorted(csc.indices[col_start:col_end], i)
+        row_start, row_end = upper.indptr[i], upper.indptr[i + 1]
+        indices = np.concatenate(
+            [
+                csc.indices[col_start : col_start + n_lower],
+                upper.indices[row_start:row_end],
+            ]
+        )
+        data = np.concatenate(
+            [csc.data[col_start : col_start + n_lower], upper.data[row_start:row_end]]
+        )
+        return indices, data
+
+    def gather_rows(
+        self, rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized version of :meth:`row` for multiple rows.
+
+        Returns
+        -------
+        Arrays with the position in `rows`, the column index and the value
+        of each non-zero entry.
+        """
+        if self._csc is None:
+            self._csc = self.upper.tocsc()
+        owner_upper, pos_upper = _csr_gather(self.upper.indptr, rows)
+        owner_lower, pos_lower = _csr_gather(self._csc.indptr, rows)
+        # entries on and right of the diagonal are obtained from the upper triangle
+        lower_mask = self._csc.indices[pos_lower] < rows[owner_lower]
+        owner_lower, pos_lower = owner_lower[lower_mask], pos_lower[lower_mask]
+        return (
+            np.concatenate([owner_lower, owner_upper]),
+            np.concatenate(
+                [self._csc.indices[pos_lower], self.upper.indices[pos_upper]]
+            ),
+            np.concatenate([self._csc.data[pos_lower], self.upper.data[pos_upper]]),
+        )
+
+    def __getitem__(self, key):
+        """Supports retrieving a single row as sparse matrix (`D[i, :]`) and
+        elementwise lookups with two integer arrays (`D[rows, cols]`)."""
+        rows, cols = key
+        if np.isscalar(rows) and cols == slice(None):
+            indices, data = self.row(int(rows))
+            return sp.csr_matrix(
+                (data, indices, [0, len(indices)]), shape=(1, self.shape[1])
+            )
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        return self.upper[np.minimum(rows, cols), np.maximum(rows, cols)]
+
+    def tocsr(self) -> sp.csr_matrix:
+        """Expand to the full, symmetric matrix."""
+        return (self.upper + self.strict_lower).tocsr()
+
+    def toarray(self) -> np.ndarray:
+        return self.tocsr().toarray()
+
+
+class CellIndices(Mapping):
+    """Mapping from clonotypes, i.e. the rows of a clonotype distance matrix,
+    to cells in compressed sparse row format.
+
+    The cells of clonotype `i` are the entries
+    `indices[indptr[i]:indptr[i + 1]]` of `obs_names`, i.e. positions in
+    `adata.obs_names` of the AnnData object the clonotypes were defined on.
+    Compared to a dictionary with one array of obs names per clonotype, this
+    can be stored in `adata.uns` and written to h5ad efficiently.
+
+    For backwards compatibility, this behaves like the dictionary that was used
+    before, i.e. it maps `str(i)` to the obs names of the cells of clonotype `i`.
+    Use :meth:`from_uns` to read both formats from `adata.uns`.
+
+    Parameters
+    ----------
+    indptr
+        Array of length `n_clonotypes + 1`.
+    indices
+        Positions in `obs_names` of the cells of all clonotypes.
+    obs_names
+        The obs names at the time the clonotypes were defined.
+    """
+
+    def __init__(
+        self, indptr: np.ndarray, indices: np.ndarray, obs_names: Sequence[str]
+    ):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.obs_names = np.asarray(obs_names, dtype=object)
+        if len(self.indptr) == 0 or self.indptr[-1] != len(self.indices):
+            raise ValueError("`indptr` and `indices` are inconsistent.")
+
+    @staticmethod
+    def from_uns(cell_indices: Mapping) -> "CellIndices":
+        """Read the cell indices stored in `adata.uns[key]["cell_indices"]`
+        by :func:`scirpy.tl.define_clonotype_clusters`.
+
+        Both the compressed format (see :meth:`to_uns`) and a dictionary that maps
+        `str(i)` to the obs names of clonotype `i` are supported.
+        """
+        if isinstance(cell_indices, CellIndices):
+            return cell_indices
+        if "indptr" in cell_indices:
+            return CellIndices(
+                cell_indices["indptr"],
+                cell_indices["indices"],
+                cell_indices["obs_names"],
+            )
+        cells = [np.asarray(cell_indices[str(i)]) for i in range(len(cell_indices))]
+        indptr = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in cells], out=indptr[1:])
+        obs_names = np.concatenate(cells) if len(cells) else np.array([], dtype=object)
+        return CellIndices(indptr, np.arange(len(obs_names)), obs_names)
+
+    def to_uns(self) -> Dict[str, np.ndarray]:
+        """Dictionary of arrays that can be stored in `adata.uns`"""
+        return {
+            "indptr": self.indptr,
+            "indices": self.indices,
+            "obs_names": self.obs_names,
+        }
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        """Dictionary that maps `str(i)` to the obs names of clonotype `i`"""
+        return dict(self.items())
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """The number of cells of each clonotype"""
+        return np.diff(self.indptr)
+
+    def cell_clonotypes(self, obs_names: Sequence[str]) -> np.ndarray:
+        """The clonotype of each cell in `obs_names`, `-1` for cells
+        without clonotype. `obs_names` can differ from the obs names the
+        clonotypes were defined on, e.g. if the AnnData object was subset."""
+        obs_names = pd.Index(obs_names)
+        if obs_names.equals(pd.Index(self.obs_names)):
+            positions = self.indices
+        else:
+            positions = obs_names.get_indexer(self.obs_names)[self.indices]
+        clonotypes = np.repeat(np.arange(len(self)), self.sizes)
+        keep = positions >= 0
+        res = np.full(len(obs_names), -1, dtype=np.int64)
+        res[positions[keep]] = clonotypes[keep]
+        return res
+
+    def __getitem__(self, key: Union[str, int]) -> np.ndarray:
+        try:
+            i = int(key)
+        except (TypeError, ValueError):
+            raise KeyError(key)
+        if not 0 <= i < len(self):
+            raise KeyError(key)
+        return self.obs_names[self.indices[self.indptr[i] : self.indptr[i + 1]]]
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(i) for i in range(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+
+class ClonotypeCellOperator(LinearOperator):
+    """Cell x cell clonotype distance matrix as implicit linear operator.
+
+    The entry of two cells is the entry of their clonotypes in a clonotype x
+    clonotype matrix, i.e. the operator is `P @ D @ P.T` where `D` is the
+    clonotype matrix and `P` the cell x clonotype incidence matrix. The
+    cell x cell matrix, in which each clonotype forms a dense block, is never
+    built. Cells without clonotype have empty rows and columns.
+
+    Besides matrix-vector and matrix-matrix products (e.g. `op @ x`), this
+    supports retrieving rows (`op[i, :]`, :meth:`row`, :meth:`gather_rows`)
+    and neighborhoods (:meth:`neighbors`).
+
+    Parameters
+    ----------
+    distances
+        Sparse clonotype x clonotype matrix, e.g. the `distances` computed by
+        :func:`scirpy.tl.define_clonotype_clusters`.
+    cell_indices
+        The cells of each clonotype, as :class:`CellIndices` or in one of the
+        formats supported by :meth:`CellIndices.from_uns`.
+    obs_names
+        The cells that form the rows and columns of the operator. Defaults to
+        the obs names the clonotypes were defined on. Cells that are not part of
+        `cell_indices` have no clonotype.
+    """
+
+    def __init__(
+        self,
+        distances: sp.spmatrix,
+        cell_indices: Union[CellIndices, Mapping],
+        obs_names: Optional[Sequence[str]] = None,
+    ):
+        cell_indices = CellIndices.from_uns(cell_indices)
+        self.distances = sp.csr_matrix(distances)
+        if self.distances.shape != (len(cell_indices), len(cell_indices)):
+            raise ValueError("`distances` and `cell_indices` are inconsistent.")
+        if obs_names is None:
+            obs_names = cell_indices.obs_names
+        self.obs_names = pd.Index(obs_names)
+        self.cell_clonotypes = cell_indices.cell_clonotypes(self.obs_names)
+        # the cells of each clonotype in CSR format, i.e. positions in `obs_names`
+        has_clonotype = self.cell_clonotypes >= 0
+        self._clonotype_cells = np.flatnonzero(has_clonotype)[
+            np.argsort(self.cell_clonotypes[has_clonotype], kind="stable")
+        ]
+        self._clonotype_indptr = np.zeros(len(cell_indices) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(
+                self.cell_clonotypes[has_clonotype], minlength=len(cell_indices)
+            ),
+            out=self._clonotype_indptr[1:],
+        )
+        self._incidence = _indicator_matrix(self.cell_clonotypes, len(cell_indices))
+        n_cells = len(self.obs_names)
+        super().__init__(dtype=self.distances.dtype, shape=(n_cells, n_cells))
+
+    @staticmethod
+    def from_adata(
+        adata,
+        key: str,
+        *,
+        matrix_type: Literal["distance", "connectivity"] = "distance",
+    ) -> "ClonotypeCellOperator":
+        """Get the operator for the clonotypes stored in `adata.uns[key]` by
+        :func:`scirpy.tl.define_clonotype_clusters`.
+
+        Parameters
+        ----------
+        adata
+            Annotated data matrix. The rows and columns of the operator are
+            `adata.obs_names`, which may be a subset of the cells the clonotypes
+            were defined on.
+        key
+            The `key_added` of :func:`scirpy.tl.define_clonotype_clusters`.
+        matrix_type
+            If `"distance"`, the entries are distances offset by one as stored
+            in `adata.uns[key]["distances"]`. If `"connectivity"`, distances are
+            converted into connectivities in `(0, 1]`, see
+            :func:`scirpy.util.graph.igraph_from_sparse_matrix`.
+        """
+        distances = sp.csr_matrix(adata.uns[key]["distances"])
+        if matrix_type == "connectivity":
+            distances = _distance_to_connectivity(
+                distances, max_value=max(np.max(distances.data, initial=0), 1)
+            )
+        return ClonotypeCellOperator(
+            distances, adata.uns[key]["cell_indices"], adata.obs_names
+        )
+
+    @property
+    def nnz(self) -> int:
+        """Number of non-zero entries of the cell x cell matrix"""
+        distances = self.distances.tocoo()
+        sizes = np.diff(self._clonotype_indptr)
+        return int(np.sum(sizes[distances.row] * sizes[distances.col]))
+
+    @staticmethod
+    def _upcast(X: np.ndarray) -> np.ndarray:
+        """Avoid overflows when summing small integer types over clonotypes"""
+        X = np.asarray(X)
+        return X.astype(np.int64) if X.dtype.kind in "biu" else X
+
+    def _matmat(self, X: np.ndarray) -> np.ndarray:
+        X = self._upcast(X)
+        return self._incidence @ (self.distances @ (self._incidence.T @ X))
+
+    def _matvec(self, x: np.ndarray) -> np.ndarray:
+        return self._matmat(x)
+
+    def _rmatmat(self, X: np.ndarray) -> np.ndarray:
+        X = self._upcast(X)
+        return self._incidence @ (self.distances.T @ (self._incidence.T @ X))
+
+    def _rmatvec(self, x: np.ndarray) -> np.ndarray:
+        return self._rmatmat(x)
+
+    def gather_rows(
+        self, rows: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get all non-zero entries of multiple rows.
+
+        Returns
+        -------
+        Arrays with the position in `rows`, the column index and the value
+        of each non-zero entry.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        clonotypes = self.cell_clonotypes[rows]
+        has_clonotype = np.flatnonzero(clonotypes >= 0)
+        ct_owner, ct_pos = _csr_gather(self.distances.indptr, clonotypes[has_clonotype])
+        owner, pos = _csr_gather(self._clonotype_indptr, self.distances.indices[ct_pos])
+        return (
+            has_clonotype[ct_owner[owner]],
+            self._clonotype_cells[pos],
+            self.distances.data[ct_pos[owner]],
+        )
+
+    def row(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the column indices and values of all non-zero entries in row `i`,
+        ordered by column."""
+        _, indices, data = self.gather_rows(np.array([i]))
+        order = np.argsort(indices, kind="stable")
+        return indices[order], data[order]
+
+    def neighbors(self, cells: np.ndarray) -> np.ndarray:
+        """Get the sorted indices of all cells connected to any of `cells`, i.e.
+        the columns with a non-zero entry in any of the rows `cells`."""
+        _, indices, _ = self.gather_rows(cells)
+        return np.unique(indices)
+
+    def __getitem__(self, key) -> sp.csr_matrix:
+        """Supports retrieving a single row as sparse matrix (`op[i, :]`)."""
+        rows, cols = key
+        if not (np.isscalar(rows) and cols == slice(None)):
+            raise IndexError("Only single rows (`op[i, :]`) are supported.")
+        indices, data = self.row(int(rows))
+        return sp.csr_matrix(
+            (data, indices, [0, len(indices)]), shape=(1, self.shape[1])
+        )
+
+    def tocsr(self) -> sp.csr_matrix:
+        """Build the cell x cell matrix. The number of non-zero entries
+        grows with the square of the clonotype sizes, see :attr:`nnz`."""
+        return (self._incidence @ self.distances @ self._incidence.T).tocsr()
+
+
+def get_distance_matrix(
+    distance_dict: Mapping, chain_type: str
+) -> Union[sp.csr_matrix, SymmetricDistanceMatrix]:
+    """Get a sequence distance matrix from the result of `ir_dist`.
+
+    If the matrix was stored as upper triangle (`half_storage=True`), it is
+    wrapped into a :class:`SymmetricDistanceMatrix`.
+    """
+    distance_matrix = distance_dict[chain_type]["distances"]
+    if distance_dict.get("params", dict()).get("half_storage", False):
+        return SymmetricDistanceMatrix(distance_matrix)
+    return distance_matrix
+
+
+def _sandwich(
+    left: sp.csr_matrix,
+    distance_matrix: Union[sp.csr_matrix, SymmetricDistanceMatrix],
+    right: sp.csr_matrix,
+) -> sp.csr_matrix:
+    """Compute `left @ distance_matrix @ right.T`.
+
+    `left` and `right` are indicator matrices with at most one non-zero entry
+    per row, i.e. each entry of the result is a single value of the distance matrix.
+    """
+    if isinstance(distance_matrix, SymmetricDistanceMatrix):
+        return (
+            left @ distance_matrix.upper @ right.T
+            + left @ distance_matrix.strict_lower @ right.T
+        ).tocsr()
+    return (left @ distance_matrix @ right.T).tocsr()
+
+
+def _indicator_matrix(idx: np.ndarray, n_cols: int) -> sp.csr_matrix:
+    """Sparse object x feature matrix with a `1` at the index of each object's
+    feature. Objects with a negative index (=missing feature) get an empty row."""
+    has_feature = idx >= 0
+    return sp.csr_matrix(
+        (
+            np.ones(np.sum(has_feature), dtype=np.uint8),
+            (np.flatnonzero(has_feature), idx[has_feature]),
+        ),
+        shape=(len(idx), n_cols),
+    )
+
+
+def paired_chain_distances(
+    chain_idx: Tuple[np.ndarray, np.ndarray],
+    distance_matrices: Tuple[
+        Union[sp.csr_matrix, SymmetricDistanceMatrix],
+        Union[sp.csr_matrix, SymmetricDistanceMatrix],
+    ],
+    *,
+    cutoff: int,
+    combine: Literal["max", "sum"] = "max",
+    v_gene_idx: Union[Tuple[np.ndarray, np.ndarray], None] = None,
+) -> sp.csr_matrix:
+    """Compute distances between objects with two chains (e.g. VJ and VDJ).
+
+    Candidate pairs are retrieved from the distance matrix of the first chain.
+    Pairs exceeding `cutoff` are discarded before the second chain is looked
+    up. Two objects are only comparable if they have the same chains, i.e.
+    an object with only a VJ chain can only be a neighbor of objects
+    with only a VJ chain.
+
+    Parameters
+    ----------
+    chain_idx
+        For each chain, an integer array mapping each object to the row/column
+        of the respective distance matrix. Negative values indicate a missing
+        chain.
+    distance_matrices
+        For each chain, a sparse, symmetric sequence distance matrix, either in CSR
+        format or as :class:`SymmetricDistanceMatrix`. Distances are offset by one
+        (`0` = distance > cutoff).
+    cutoff
+        Distances > cutoff are eliminated from the result.
+    combine
+        How to combine the distances of the two chains. `max` is consistent with
+        `receptor_arms="all"`, `sum` resembles TCRdist.
+    v_gene_idx
+        Optional integer arrays with a code for the V gene of each chain. If given,
+        only objects with identical V genes for all chains are neighbors. Negative
+        values indicate a missing V gene which never matches.
+
+    Returns
+    -------
+    object x object sparse distance matrix (offset by one).
+    """
+    if combine not in ["max", "sum"]:
+        raise ValueError("Invalid value for `combine`.")
+    idx1, idx2 = (np.asarray(x, dtype=int) for x in chain_idx)
+    dist1, dist2 = distance_matrices
+    n_obj = len(idx1)
+
+    rows, cols, data = [], [], []
+    # (1) objects with a first chain: candidates from the first chain, then lookup
+    # the distance of the second chain. (2) objects without a first chain: candidates
+    # from the second chain only.
+    for has_first in [True, False]:
+        subset = idx1 >= 0 if has_first else (idx1 < 0) & (idx2 >= 0)
+        tmp_idx, tmp_dist = (idx1, dist1) if has_first else (idx2, dist2)
+        f = _indicator_matrix(np.where(subset, tmp_idx, -1), tmp_dist.shape[0])
+        candidates = _sandwich(f, tmp_dist, f).tocoo()
+        tmp_rows, tmp_cols = candidates.row, candidates.col
+        tmp_data = candidates.data.astype(np.int32)
+
+        # early exit for pairs that already exceed the cutoff
+        keep = (tmp_data > 0) & (tmp_data <= cutoff + 1)
+        tmp_rows, tmp_cols, tmp_data = tmp_rows[keep], tmp_cols[keep], tmp_data[keep]
+
+        if has_first:
+            # both or none of the objects need to have a second chain
+            has_second_row, has_second_col = idx2[tmp_rows] >= 0, idx2[tmp_cols] >= 0
+            keep = has_second_row == has_second_col
+            tmp_rows, tmp_cols, tmp_data = (
+                x[keep] for x in (tmp_rows, tmp_cols, tmp_data)
+            )
+            has_second = has_second_row[keep]
+
+            second = np.zeros(len(tmp_rows), dtype=np.int32)
+            if np.any(has_second):
+                second[has_second] = np.asarray(
+                    dist2[idx2[tmp_rows[has_second]], idx2[tmp_cols[has_second]]]
+                ).ravel()
+            if combine == "max":
+                tmp_data = np.where(
+                    has_second, np.maximum(tmp_data, second) * (second > 0), tmp_data
+                )
+            else:
+                tmp_data = np.where(
+                    has_second, (tmp_data + second - 1) * (second > 0), tmp_data
+                )
+
+        if v_gene_idx is not None:
+            for tmp_chain_idx, tmp_v in zip((idx1, idx2), v_gene_idx):
+                tmp_v = np.asarray(tmp_v)
+                has_chain = tmp_chain_idx[tmp_rows] >= 0
+                same_v = (tmp_v[tmp_rows] == tmp_v[tmp_cols]) & (tmp_v[tmp_rows] >= 0)
+                tmp_data = tmp_data * (~has_chain | same_v)
+
+        keep = (tmp_data > 0) & (tmp_data <= cutoff + 1)
+        rows.append(tmp_rows[keep])
+        cols.append(tmp_cols[keep])
+        data.append(tmp_data[keep])
+
+    return sp.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_obj, n_obj),
+        dtype=np.uint8,
+    )
+
+
 class ReverseLookupTable:
     def __init__(self, dist_type: Literal["boolean", "numeric"], size: int):
         """Reverse lookup table holds a mask that indicates which objects
@@ -91,6 +741,11 @@ class ReverseLookupTable:
         per value (e.g. there are likely only few neighbors for a specific CDR3
         sequence).
 
+        Internally, the object indices of all keys are stored in a single CSR
+        structure (`indptr`, `indices`). Keys that are associated with a large
+        fraction of all objects are stored as compressed bitmap instead. Masks
+        are only created on access.
+
         Parameters
         ----------
         dist_type
@@ -102,13 +757,22 @@ class ReverseLookupTable:
             raise ValueError("invalid dist_type")
         self.dist_type = dist_type
         self.size = size
-        self.lookup: Dict[Hashable, sp.coo_matrix] = dict()
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=self._index_dtype)
+        # key -> output of `np.packbits`
+        self.bitmaps: Dict[int, np.ndarray] = dict()
+
+    @property
+    def _index_dtype(self):
+        return np.int32 if self.size < np.iinfo(np.int32).max else np.int64
 
     @staticmethod
     def from_dict_of_indices(
         dict_of_indices: Mapping,
         dist_type: Literal["boolean", "numeric"],
         size: int,
+        *,
+        use_bitmaps: bool = True,
     ):
         """Convert a dict of indices to a ReverseLookupTable of row masks.
 
@@ -120,29 +784,130 @@ class ReverseLookupTable:
             Either `boolean` or `numeric`
         size
             The size of the masks
+        use_bitmaps
+            Store frequent keys as compressed bitmaps
         """
+        keys = np.array(
+            [k for k, v in dict_of_indices.items() for _ in range(len(v))], dtype=int
+        )
+        indices = np.array([i for v in dict_of_indices.values() for i in v], dtype=int)
+        return ReverseLookupTable._from_pairs(
+            keys, indices, dist_type, size, use_bitmaps=use_bitmaps
+        )
+
+    @staticmethod
+    def from_forward_lookup_table(
+        forward: np.ndarray,
+        dist_type: Literal["boolean", "numeric"],
+        n_keys: int,
+        *,
+        use_bitmaps: bool = True,
+    ):
+        """Build a ReverseLookupTable that maps each key to all positions
+        in the `forward` array with that key. `nan`s are ignored.
+
+        Parameters
+        ----------
+        forward
+            Array with the key of each object
+        dist_type
+            Either `boolean` or `numeric`
+        n_keys
+            The number of possible keys, i.e. keys are in `range(n_keys)`.
+        use_bitmaps
+            Store frequent keys as compressed bitmaps
+        """
+        has_key = np.flatnonzero(~np.isnan(forward))
+        return ReverseLookupTable._from_pairs(
+            forward[has_key].astype(int),
+            has_key,
+            dist_type,
+            len(forward),
+            n_keys=n_keys,
+            use_bitmaps=use_bitmaps,
+        )
+
+    @staticmethod
+    def _from_pairs(
+        keys: np.ndarray,
+        indices: np.ndarray,
+        dist_type: Literal["boolean", "numeric"],
+        size: int,
+        *,
+        n_keys: Union[int, None] = None,
+        use_bitmaps: bool = True,
+    ):
+        """Build the CSR structure from a list of (key, index) pairs."""
         rlt = ReverseLookupTable(dist_type, size)
+        if n_keys is None:
+            n_keys = np.max(keys, initial=-1) + 1
+        counts = np.bincount(keys, minlength=n_keys)
+        order = np.lexsort((indices, keys))
+        keys, indices = keys[order], indices[order].astype(rlt._index_dtype)
 
-        # convert into coo matrices (numeric distances) or numpy boolean arrays.
-        for k, v in dict_of_indices.items():
-            if rlt.is_boolean:
-                tmp_array = np.zeros(shape=(1, size), dtype=bool)
-                tmp_array[0, v] = True
-                rlt.lookup[k] = tmp_array
-            else:
-                rlt.lookup[k] = sp.coo_matrix(
-                    (
-                        np.ones(len(v), dtype=np.uint8),
-                        (np.zeros(len(v), dtype=int), v),
-                    ),
-                    shape=(1, size),
-                )
+        if use_bitmaps:
+            # a bitmap requires `size / 8` bytes, an index array
+            # `itemsize * count` bytes.
+            is_frequent = counts * rlt.indices.itemsize > size / 8
+            for k in np.flatnonzero(is_frequent):
+                mask = np.zeros(size, dtype=bool)
+                mask[indices[keys == k]] = True
+                rlt.bitmaps[int(k)] = np.packbits(mask)
+            keep = ~is_frequent[keys]
+            keys, indices = keys[keep], indices[keep]
+            counts[is_frequent] = 0
+
+        rlt.indptr = np.zeros(n_keys + 1, dtype=np.int64)
+        np.cumsum(counts, out=rlt.indptr[1:])
+        rlt.indices = indices
         return rlt
 
     @property
     def is_boolean(self):
         return self.dist_type == "boolean"
 
+    @property
+    def n_keys(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def lookup(self) -> Dict[int, Union[sp.coo_matrix, np.ndarray]]:
+        """Dictionary with the mask of each key that has at least one object.
+        All masks are materialized, only use this for small tables."""
+        keys = set(np.flatnonzero(np.diff(self.indptr))) | set(self.bitmaps)
+        return {int(k): self[k] for k in sorted(keys)}
+
+    def _indices(self, i: int) -> np.ndarray:
+        """Get the object indices associated with key `i`."""
+        if i in self.bitmaps:
+            return np.flatnonzero(
+                np.unpackbits(self.bitmaps[i], count=self.size)
+            ).astype(self._index_dtype)
+        if not 0 <= i < self.n_keys:
+            return self.indices[:0]
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def gather(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized lookup of multiple keys.
+
+        Returns
+        -------
+        owner
+            For each object, the position in `keys` it was retrieved for.
+        indices
+            The object indices.
+        """
+        keys = np.asarray(keys, dtype=int)
+        owner, pos = _csr_gather(self.indptr, keys)
+        owners, indices = [owner], [self.indices[pos]]
+        for k in self.bitmaps:
+            tmp_owner = np.flatnonzero(keys == k)
+            if len(tmp_owner):
+                tmp_indices = self._indices(k)
+                owners.append(np.repeat(tmp_owner, len(tmp_indices)))
+                indices.append(np.tile(tmp_indices, len(tmp_owner)))
+        return np.concatenate(owners), np.concatenate(indices)
+
     def empty(self):
         """Create an empty row with same dimensions as those stored
         in the lookup. Respects the distance type"""
@@ -153,7 +918,21 @@ class ReverseLookupTable:
 
     def __getitem__(self, i):
         """Get mask for index `i`"""
-        return self.lookup.get(i, self.empty())
+        tmp_indices = self._indices(int(i))
+        if not len(tmp_indices):
+            return self.empty()
+        if self.is_boolean:
+            tmp_array = np.zeros(shape=(1, self.size), dtype=bool)
+            tmp_array[0, tmp_indices] = True
+            return tmp_array
+        else:
+            return sp.coo_matrix(
+                (
+                    np.ones(len(tmp_indices), dtype=np.uint8),
+                    (np.zeros(len(tmp_indices), dtype=int), tmp_indices),
+                ),
+                shape=(1, self.size),
+            )
 
 
 class DoubleLookupNeighborFinder:
@@ -188,7 +967,9 @@ class DoubleLookupNeighborFinder:
         self.feature_table = feature_table
 
         # n_feature x n_feature sparse, symmetric distance matrices
-        self.distance_matrices: Dict[str, sp.csr_matrix] = dict()
+        self.distance_matrices: Dict[
+            str, Union[sp.csr_matrix, SymmetricDistanceMatrix]
+        ] = dict()
         # mapping feature_label -> feature_index with len = n_feature
         self.distance_matrix_labels: Dict[str, dict] = dict()
         # tuples (dist_mat, forward, reverse)
@@ -247,25 +1028,92 @@ class DoubleLookupNeighborFinder:
             return reverse.empty()
         else:
             # get distances from the distance matrix...
-            row = distance_matrix[idx_in_dist_mat, :]
+            if isinstance(distance_matrix, SymmetricDistanceMatrix):
+                row_indices, row_data = distance_matrix.row(int(idx_in_dist_mat))
+            else:
+                row = distance_matrix[int(idx_in_dist_mat), :]
+                row_indices, row_data = row.indices, row.data  # type: ignore
 
             if reverse.is_boolean:
                 assert (
-                    len(row.indices) == 1  # type: ignore
+                    len(row_indices) == 1
                 ), "Boolean reverse lookup only works for identity distance matrices."
-                return reverse[row.indices[0]]  # type: ignore
+                return reverse[row_indices[0]]
             else:
                 # ... and get column indices directly from sparse row
                 # sum concatenates coo matrices
                 return merge_coo_matrices(
                     (
                         reverse[i] * multiplier
-                        for i, multiplier in zip(row.indices, row.data)  # type: ignore
+                        for i, multiplier in zip(row_indices, row_data)
                     )
                 )  # type: ignore
 
+    def lookup_many(
+        self,
+        object_ids: Sequence[int],
+        forward_lookup_table: str,
+        reverse_lookup_table: Union[str, None] = None,
+    ) -> sp.csr_matrix:
+        """Get ids of neighboring objects for multiple objects at once.
+
+        Equivalent to stacking the results of :meth:`lookup` for all `object_ids`,
+        but the lookups are performed with vectorized gathers on the
+        CSR structures of the distance matrix and the reverse lookup table.
+
+        Parameters
+        ----------
+        object_ids
+            The row indices of the feature_table.
+        forward_lookup_table
+            The unique identifier of a lookup table previously added via
+            `add_lookup_table`.
+        reverse_lookup_table
+            The unique identifier of the lookup table used for the reverse lookup.
+            If not provided will use the same lookup table for forward and reverse
+            lookup.
+
+        Returns
+        -------
+        Sparse matrix with one row for each object id and one column for each
+        object in the feature table. For boolean lookup tables, the matrix is
+        of type `bool`.
+        """
+        distance_matrix_name, forward, reverse = self.lookups[forward_lookup_table]
+
+        if reverse_lookup_table is not None:
+            distance_matrix_name_reverse, _, reverse = self.lookups[
+                reverse_lookup_table
+            ]
+            if distance_matrix_name != distance_matrix_name_reverse:
+                raise ValueError(
+                    "Forward and reverse lookup tablese must be defined "
+                    "on the same distance matrices."
+                )
+
+        distance_matrix = self.distance_matrices[distance_matrix_name]
+        idx_in_dist_mat = forward[np.asarray(object_ids, dtype=int)]
+        has_feature = np.flatnonzero(~np.isnan(idx_in_dist_mat))
+
+        # get distances from the distance matrix...
+        owner, features, data = _gather_distance_rows(
+            distance_matrix, idx_in_dist_mat[has_feature].astype(int)
+        )
+        # ... and all objects associated with the neighboring features.
+        owner_reverse, neighbors = reverse.gather(features)
+        return sp.csr_matrix(
+            (
+                data[owner_reverse].astype(bool if reverse.is_boolean else data.dtype),
+                (has_feature[owner[owner_reverse]], neighbors),
+            ),
+            shape=(len(idx_in_dist_mat), self.n_rows),
+        )
+
     def add_distance_matrix(
-        self, name: str, distance_matrix: sp.csr_matrix, labels: Sequence
+        self,
+        name: str,
+        distance_matrix: Union[sp.csr_matrix, SymmetricDistanceMatrix],
+        labels: Sequence,
     ):
         """Add a distance matrix.
 
@@ -274,15 +1122,19 @@ class DoubleLookupNeighborFinder:
         name
             Unique identifier of the distance matrix
         distance_matrix
-            sparse distance matrix `D` in CSR format
+            sparse distance matrix `D` in CSR format or as
+            :class:`SymmetricDistanceMatrix`.
         labels
             array with row/column names of the distance matrix.
             `len(array) == D.shape[0] == D.shape[1]`
         """
         if not (len(labels) == distance_matrix.shape[0] == distance_matrix.shape[1]):
             raise ValueError("Dimension mismatch!")
-        if not isinstance(distance_matrix, csr_matrix):
-            raise TypeError("Distance matrix must be sparse and in CSR format. ")
+        if not isinstance(distance_matrix, (csr_matrix, SymmetricDistanceMatrix)):
+            raise TypeError(
+                "Distance matrix must be sparse and in CSR format "
+                "or a SymmetricDistanceMatrix. "
+            )
 
         # The class relies on zeros not being explicitly stored during reverse lookup.
         distance_matrix.eliminate_zeros()
@@ -291,6 +1143,23 @@ class DoubleLookupNeighborFinder:
         # The label "nan" does not have an index in the matrix
         self.distance_matrix_labels[name]["nan"] = np.nan
 
+    def share_distance_matrix(
+        self, name: str, other: "DoubleLookupNeighborFinder"
+    ) -> None:
+        """Add a distance matrix previously added to another
+        DoubleLookupNeighborFinder. The matrix and its labels are shared,
+        not copied.
+
+        Parameters
+        ----------
+        name
+            Unique identifier of the distance matrix in `other`
+        other
+            The DoubleLookupNeighborFinder that holds the distance matrix
+        """
+        self.distance_matrices[name] = other.distance_matrices[name]
+        self.distance_matrix_labels[name] = other.distance_matrix_labels[name]
+
     def add_lookup_table(
         self,
         name: str,
@@ -298,6 +1167,7 @@ class DoubleLookupNeighborFinder:
         distance_matrix: str,
         *,
         dist_type: Literal["boolean", "numeric"] = "numeric",
+        forward: Optional[np.ndarray] = None,
     ):
         """Build a pair of forward- and reverse-lookup tables.
 
@@ -308,10 +1178,17 @@ class DoubleLookupNeighborFinder:
         distance_matrix
             name of a distance matrix previously added via `add_distance_matrix`
         name
-            unique identifier of the lookup table"""
-        forward = self._build_forward_lookup_table(feature_col, distance_matrix)
+            unique identifier of the lookup table
+        forward
+            Precomputed forward lookup table, i.e. the index in the distance
+            matrix of the feature of each row (`nan` for missing features).
+            If not provided, it is built from `feature_col`."""
+        if forward is None:
+            forward = self._build_forward_lookup_table(feature_col, distance_matrix)
+        elif len(forward) != self.n_rows:
+            raise ValueError("Forward lookup table must have one entry per row.")
         reverse = self._build_reverse_lookup_table(
-            feature_col, distance_matrix, dist_type=dist_type
+            forward, distance_matrix, dist_type=dist_type
         )
         self.lookups[name] = (distance_matrix, forward, reverse)
 
@@ -330,29 +1207,16 @@ class DoubleLookupNeighborFinder:
 
     def _build_reverse_lookup_table(
         self,
-        feature_col: str,
+        forward: np.ndarray,
         distance_matrix: str,
         *,
-        dist_type: Literal["boolean", "numberic"],
+        dist_type: Literal["boolean", "numeric"],
     ) -> ReverseLookupTable:
-        """Create a reverse-lookup dict that maps each (numeric) index
+        """Create a reverse-lookup table that maps each (numeric) index
         of a feature distance matrix to a numeric or boolean mask.
         If the dist_type is numeric, will use a sparse numeric matrix.
         If the dist_type is boolean, use a dense boolean.
         """
-        tmp_reverse_lookup = dict()
-        tmp_index_lookup = self.distance_matrix_labels[distance_matrix]
-
-        # Build reverse lookup
-        for i, k in enumerate(self.feature_table[feature_col]):
-            tmp_key = tmp_index_lookup[k]
-            if np.isnan(tmp_key):
-                continue
-            try:
-                tmp_reverse_lookup[tmp_key].append(i)
-            except KeyError:
-                tmp_reverse_lookup[tmp_key] = [i]
-
-        return ReverseLookupTable.from_dict_of_indices(
-            tmp_reverse_lookup, dist_type, self.n_rows
+        return ReverseLookupTable.from_forward_lookup_table(
+            forward, dist_type, self.distance_matrices[distance_matrix].shape[0]
         )
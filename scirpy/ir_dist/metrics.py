@@ -3,15 +3,27 @@ import parasail
 from scipy.sparse.csr import csr_matrix
 from tqdm.contrib.concurrent import process_map
 import itertools
-from typing import Union, Sequence, Tuple, Optional
+from typing import Mapping, Union, Sequence, Tuple, Optional
 import numpy as np
+import pandas as pd
 import abc
 from Levenshtein import distance as levenshtein_dist
 from Levenshtein import hamming as hamming_dist
 import scipy.spatial
 import scipy.sparse
 from scipy.sparse import coo_matrix
-from ..util import _doc_params, tqdm
+from sklearn.neighbors import BallTree
+from scanpy import logging
+from .._compat import Literal
+from ..util import _doc_params, _is_na, tqdm
+from ._util import paired_chain_distances
+from ._engines import (
+    EngineType,
+    _CandidateFilterMixin,
+    candidate_pairs,
+    estimate_cost,
+    select_engine,
+)
 
 
 _doc_params_parallel_distance_calculator = """\
@@ -23,6 +35,21 @@ block_size
     process. The block contains `block_size ** 2` elements.
 """
 
+_doc_engine = """\
+engine
+    Strategy to avoid computing the distances of all pairs of sequences:
+      * `brute_force` -- compute the distances of all pairs.
+      * `length_bucketed` -- only compare sequences with a length difference that
+        is compatible with the cutoff.
+      * `deletion_index` -- only compare sequences that share a string obtained by
+        deleting up to `cutoff` characters. Efficient for small cutoffs.
+      * `qgram` -- only compare sequences that share enough q-grams.
+      * `auto` -- choose the fastest engine based on
+        :func:`~scirpy.ir_dist.estimate_cost`.
+
+    All engines yield identical results.
+"""
+
 
 _doc_dist_mat = """\
 Calculates the full pairwise distance matrix.
@@ -120,16 +147,46 @@ class ParallelDistanceCalculator(DistanceCalculator):
     {params}
     """
 
+    #: Engines supported by this DistanceCalculator. Subclasses supporting candidate
+    #: filters inherit from `_CandidateFilterMixin`.
+    ENGINES = ("brute_force",)
+
+    #: Number of pairs below which `engine="auto"` uses `brute_force` without
+    #: estimating the cost of the other engines.
+    _AUTO_MIN_PAIRS = 1_000_000
+
     def __init__(
         self,
         cutoff: int,
         *,
         n_jobs: Optional[int] = None,
         block_size: Optional[int] = 50,
+        engine: Union[EngineType, Literal["auto"]] = "auto",
     ):
         super().__init__(cutoff)
         self.n_jobs = n_jobs
         self.block_size = block_size
+        if engine != "auto" and engine not in self.ENGINES:
+            raise ValueError(
+                f"Engine `{engine}` is not supported by {type(self).__name__}. "
+                f"Choose one of {', '.join(self.ENGINES)}. "
+            )
+        self.engine = engine
+
+    def _select_engine(
+        self, seqs: Sequence[str], seqs2: Optional[Sequence[str]] = None
+    ) -> str:
+        if self.engine != "auto":
+            return self.engine
+        n_pairs = len(seqs) * (len(seqs) if seqs2 is None else len(seqs2))
+        if (
+            not isinstance(self, _CandidateFilterMixin)
+            or n_pairs < self._AUTO_MIN_PAIRS
+        ):
+            return "brute_force"
+        engine = select_engine(estimate_cost(self, seqs, seqs2))
+        logging.info(f"Using the `{engine}` engine to compute distances. ")  # type: ignore
+        return engine
 
     @abc.abstractmethod
     def _compute_block(
@@ -209,15 +266,44 @@ class ParallelDistanceCalculator(DistanceCalculator):
         """Calculate the distance matrix.
 
         See :meth:`DistanceCalculator.calc_dist_mat`."""
-        # precompute blocks as list to have total number of blocks for progressbar
-        blocks = list(self._block_iter(seqs, seqs2, self.block_size))
-
-        block_results = process_map(
-            self._compute_block,
-            *zip(*blocks),
-            max_workers=self.n_jobs if self.n_jobs is not None else cpu_count(),
-            chunksize=50,
-            tqdm_class=tqdm,
+        engine = self._select_engine(seqs, seqs2)
+        if engine == "brute_force":
+            # precompute blocks as list to have total number of blocks for progressbar
+            blocks = list(self._block_iter(seqs, seqs2, self.block_size))
+            fun = self._compute_block
+        else:
+            rows, cols = candidate_pairs(
+                engine,
+                seqs,
+                seqs2,
+                max_dist=self.cutoff,
+                max_len_diff=self._max_len_diff,
+            )
+            tmp_seqs2 = seqs if seqs2 is None else seqs2
+            # chunks with the same number of elements as a block
+            chunk_size = self.block_size ** 2
+            blocks = [
+                (
+                    [seqs[i] for i in rows[start : start + chunk_size]],
+                    [tmp_seqs2[i] for i in cols[start : start + chunk_size]],
+                    rows[start : start + chunk_size].tolist(),
+                    cols[start : start + chunk_size].tolist(),
+                )
+                for start in range(0, len(rows), chunk_size)
+            ]
+            fun = self._compute_pairs
+
+        # `process_map` fails on empty input, e.g. if there are no candidates.
+        block_results = (
+            process_map(
+                fun,
+                *zip(*blocks),
+                max_workers=self.n_jobs if self.n_jobs is not None else cpu_count(),
+                chunksize=50,
+                tqdm_class=tqdm,
+            )
+            if len(blocks)
+            else []
         )
 
         try:
@@ -271,27 +357,24 @@ class IdentityDistanceCalculator(DistanceCalculator):
             # In this case, the offsetted distance matrix is the identity matrix
             return scipy.sparse.identity(len(seqs), dtype=self.DTYPE, format="csr")
         else:
-            # actually compare the values
-            def coord_generator():
-                for (i1, s1), (i2, s2) in itertools.product(
-                    enumerate(seqs), enumerate(seqs2)
-                ):
-                    if s1 == s2:
-                        yield 1, i1, i2
-
-            try:
-                d, row, col = zip(*coord_generator())
-            except ValueError:
-                # happens when there is no match at all
-                d, row, col = (), (), ()
-
+            # actually compare the values by joining on the sequence.
+            matches = pd.merge(
+                pd.DataFrame({"seq": seqs, "row": np.arange(len(seqs))}),
+                pd.DataFrame({"seq": seqs2, "col": np.arange(len(seqs2))}),
+                on="seq",
+            )
             return coo_matrix(
-                (d, (row, col)), dtype=self.DTYPE, shape=(len(seqs), len(seqs2))
+                (
+                    np.ones(len(matches), dtype=self.DTYPE),
+                    (matches["row"].values, matches["col"].values),
+                ),
+                dtype=self.DTYPE,
+                shape=(len(seqs), len(seqs2)),
             ).tocsr()
 
 
-@_doc_params(params=_doc_params_parallel_distance_calculator)
-class LevenshteinDistanceCalculator(ParallelDistanceCalculator):
+@_doc_params(params=_doc_params_parallel_distance_calculator, engine=_doc_engine)
+class LevenshteinDistanceCalculator(_CandidateFilterMixin, ParallelDistanceCalculator):
     """\
     Calculates the Levenshtein edit-distance between sequences.
 
@@ -312,6 +395,7 @@ class LevenshteinDistanceCalculator(ParallelDistanceCalculator):
         Will eleminate distances > cutoff to make efficient
         use of sparse matrices. The default cutoff is `2`.
     {params}
+    {engine}
     """
 
     def __init__(self, cutoff: Union[None, int] = None, **kwargs):
@@ -319,6 +403,10 @@ class LevenshteinDistanceCalculator(ParallelDistanceCalculator):
             cutoff = 2
         super().__init__(cutoff, **kwargs)
 
+    @property
+    def _max_len_diff(self) -> int:
+        return self.cutoff
+
     def _compute_block(self, seqs1, seqs2, origin):
         origin_row, origin_col = origin
         if seqs2 is not None:
@@ -338,9 +426,18 @@ class LevenshteinDistanceCalculator(ParallelDistanceCalculator):
 
         return result
 
+    def _compute_pairs(self, seqs1, seqs2, rows, cols):
+        result = []
+        for s1, s2, row, col in zip(seqs1, seqs2, rows, cols):
+            d = levenshtein_dist(s1, s2)
+            if d <= self.cutoff:
+                result.append((d + 1, row, col))
 
-@_doc_params(params=_doc_params_parallel_distance_calculator)
-class HammingDistanceCalculator(ParallelDistanceCalculator):
+        return result
+
+
+@_doc_params(params=_doc_params_parallel_distance_calculator, engine=_doc_engine)
+class HammingDistanceCalculator(_CandidateFilterMixin, ParallelDistanceCalculator):
     """\
     Calculates the Hamming distance between sequences of identical length.
 
@@ -363,6 +460,7 @@ class HammingDistanceCalculator(ParallelDistanceCalculator):
         Will eleminate distances > cutoff to make efficient
         use of sparse matrices. The default cutoff is `2`.
     {params}
+    {engine}
     """
 
     def __init__(self, cutoff: Union[None, int] = None, **kwargs):
@@ -370,6 +468,10 @@ class HammingDistanceCalculator(ParallelDistanceCalculator):
             cutoff = 2
         super().__init__(cutoff, **kwargs)
 
+    @property
+    def _max_len_diff(self) -> int:
+        return 0
+
     def _compute_block(self, seqs1, seqs2, origin):
         origin_row, origin_col = origin
         if seqs2 is not None:
@@ -393,6 +495,198 @@ class HammingDistanceCalculator(ParallelDistanceCalculator):
 
         return result
 
+    def _compute_pairs(self, seqs1, seqs2, rows, cols):
+        result = []
+        for s1, s2, row, col in zip(seqs1, seqs2, rows, cols):
+            # candidates are guaranteed to have identical lengths
+            d = hamming_dist(s1, s2)
+            if d <= self.cutoff:
+                result.append((d + 1, row, col))
+
+        return result
+
+
+@_doc_params(params=_doc_params_parallel_distance_calculator)
+class WeightedLevenshteinDistanceCalculator(ParallelDistanceCalculator):
+    """\
+    Calculates a weighted Levenshtein edit-distance between sequences.
+
+    As opposed to the :class:`LevenshteinDistanceCalculator`, insertions/deletions
+    (indels) and substitutions can have different costs. Optionally, the cost of
+    a substitution can depend on the pair of residues involved.
+
+    Distances are computed with a dynamic programming kernel implemented in numpy
+    that processes all pairs of a block at once. The matrix is filled along
+    anti-diagonals, and pairs are dropped as soon as their distance is
+    guaranteed to exceed the cutoff.
+
+    Choosing a cutoff:
+        Biologically, indels in a CDR3 sequence are rarer than substitutions.
+        With, e.g. `indel_cost=2` and `substitution_cost=1`, a cutoff of `2`
+        allows for up to two substitutions, but only for a single indel.
+
+    Parameters
+    ----------
+    cutoff
+        Will eleminate distances > cutoff to make efficient
+        use of sparse matrices. The default cutoff is `2`.
+    indel_cost
+        Cost of an insertion or deletion.
+    substitution_cost
+        Cost of a substitution. Used for all pairs of residues not
+        specified in `subst_costs`.
+    subst_costs
+        Substitution costs for individual pairs of residues, e.g. a
+        :class:`pandas.DataFrame` with residues in rows and columns.
+        Must be symmetric. Pairs of residues not contained in the table
+        fall back to `substitution_cost`.
+    {params}
+    """
+
+    def __init__(
+        self,
+        cutoff: Union[None, int] = None,
+        *,
+        indel_cost: int = 1,
+        substitution_cost: int = 1,
+        subst_costs: Union[pd.DataFrame, Mapping, None] = None,
+        n_jobs: Union[int, None] = None,
+        block_size: int = 100,
+    ):
+        if cutoff is None:
+            cutoff = 2
+        super().__init__(cutoff, n_jobs=n_jobs, block_size=block_size)
+        if indel_cost < 1 or substitution_cost < 0:
+            raise ValueError(
+                "`indel_cost` must be positive and `substitution_cost` non-negative."
+            )
+        self.indel_cost = indel_cost
+        self.substitution_cost = substitution_cost
+
+        # lookup table for all pairs of ASCII characters
+        self._cost_table = np.full((256, 256), substitution_cost, dtype=np.int32)
+        if subst_costs is not None:
+            for (a, b), cost in pd.DataFrame(subst_costs).stack().items():
+                if cost < 0:
+                    raise ValueError("Substitution costs must be non-negative.")
+                self._cost_table[ord(a), ord(b)] = cost
+            if not np.all(self._cost_table == self._cost_table.T):
+                raise ValueError("`subst_costs` must be symmetric.")
+        np.fill_diagonal(self._cost_table, 0)
+
+    @staticmethod
+    def _encode(seqs: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert sequences into a zero-padded array of ASCII codes and
+        an array of sequence lengths."""
+        lengths = np.fromiter((len(s) for s in seqs), dtype=int, count=len(seqs))
+        codes = np.zeros((len(seqs), np.max(lengths, initial=0)), dtype=np.uint8)
+        for i, s in enumerate(seqs):
+            codes[i, : lengths[i]] = np.frombuffer(s.encode("ascii"), dtype=np.uint8)
+        return codes, lengths
+
+    def _compute_dists(
+        self,
+        codes1: np.ndarray,
+        lengths1: np.ndarray,
+        codes2: np.ndarray,
+        lengths2: np.ndarray,
+    ) -> np.ndarray:
+        """Compute the weighted edit distance for many pairs of sequences at once.
+
+        Parameters
+        ----------
+        codes1, codes2
+            zero-padded arrays of ASCII codes with one row per pair
+        lengths1, lengths2
+            the sequence lengths of each pair
+
+        Returns
+        -------
+        Array with the distance of each pair. Distances > cutoff are reported
+        as `cutoff + 1`.
+        """
+        indel = self.indel_cost
+        res = np.full(len(lengths1), self.cutoff + 1, dtype=np.int32)
+
+        # The length difference needs to be compensated by indels.
+        idx = np.flatnonzero(np.abs(lengths1 - lengths2) * indel <= self.cutoff)
+        if not len(idx):
+            return res
+        len1, len2 = lengths1[idx], lengths2[idx]
+        n1, n2 = np.max(len1), np.max(len2)
+        subst = self._cost_table[codes1[idx, :n1, None], codes2[idx, None, :n2]]
+
+        dp = np.zeros((len(idx), n1 + 1, n2 + 1), dtype=np.int32)
+        dp[:, :, 0] = np.arange(n1 + 1) * indel
+        dp[:, 0, :] = np.arange(n2 + 1) * indel
+
+        # Each path through the DP matrix touches either anti-diagonal k or k - 1.
+        # A lower bound of the final distance is the min. over these cells plus
+        # the indels required to compensate the remaining length difference.
+        k_lower = None
+        for k in range(2, n1 + n2 + 1):
+            i = np.arange(max(1, k - n2), min(n1, k - 1) + 1)
+            j = k - i
+            dp[:, i, j] = np.minimum(
+                dp[:, i - 1, j - 1] + subst[:, i - 1, j - 1],
+                np.minimum(dp[:, i - 1, j], dp[:, i, j - 1]) + indel,
+            )
+
+            i_prev = np.arange(max(0, k - 1 - n2), min(n1, k - 1) + 1)
+            i_diag = np.concatenate([i_prev, i])
+            j_diag = np.concatenate([k - 1 - i_prev, j])
+            valid = (i_diag[np.newaxis, :] <= len1[:, np.newaxis]) & (
+                j_diag[np.newaxis, :] <= len2[:, np.newaxis]
+            )
+            remaining = np.abs(
+                (len1[:, np.newaxis] - i_diag[np.newaxis, :])
+                - (len2[:, np.newaxis] - j_diag[np.newaxis, :])
+            )
+            k_lower = np.min(
+                np.where(valid, dp[:, i_diag, j_diag] + remaining * indel, np.inf),
+                axis=1,
+            )
+            finished = len1 + len2 <= k
+            exceeded = ~finished & (k_lower > self.cutoff)
+            # Only shrink the arrays if it is worth copying them.
+            if np.sum(finished | exceeded) > 0.25 * len(idx) or k == n1 + n2:
+                tmp_finished = np.flatnonzero(finished)
+                res[idx[tmp_finished]] = dp[
+                    tmp_finished, len1[tmp_finished], len2[tmp_finished]
+                ]
+                keep = ~(finished | exceeded)
+                idx, len1, len2 = idx[keep], len1[keep], len2[keep]
+                dp, subst = dp[keep], subst[keep]
+                if not len(idx):
+                    break
+
+        res[res > self.cutoff] = self.cutoff + 1
+        return res
+
+    def _compute_block(self, seqs1, seqs2, origin):
+        origin_row, origin_col = origin
+        codes1, lengths1 = self._encode(seqs1)
+        if seqs2 is not None:
+            # compute the full matrix
+            codes2, lengths2 = self._encode(seqs2)
+            rows, cols = np.divmod(np.arange(len(seqs1) * len(seqs2)), len(seqs2))
+        else:
+            # compute only upper triangle in this case
+            codes2, lengths2 = codes1, lengths1
+            rows, cols = np.triu_indices(len(seqs1))
+
+        dists = self._compute_dists(
+            codes1[rows], lengths1[rows], codes2[cols], lengths2[cols]
+        )
+        mask = dists <= self.cutoff
+        return list(
+            zip(
+                (dists[mask] + 1).tolist(),
+                (rows[mask] + origin_row).tolist(),
+                (cols[mask] + origin_col).tolist(),
+            )
+        )
+
 
 @_doc_params(params=_doc_params_parallel_distance_calculator)
 class AlignmentDistanceCalculator(ParallelDistanceCalculator):
@@ -501,3 +795,417 @@ class AlignmentDistanceCalculator(ParallelDistanceCalculator):
             dtype=int,
             count=len(seqs),
         )
+
+
+def _subst_mat_embedding(subst_mat: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Embed the residues of a substitution matrix into an euclidean space.
+
+    The (symmetric) substitution matrix `S` is decomposed into `U Λ Uᵀ`. Negative
+    eigenvalues are clipped, such that the residue vectors `e = U sqrt(Λ)` satisfy
+    :math:`e_a \\cdot e_b \\approx S_{a,b}`. Consequently,
+    :math:`\\lVert e_a - e_b \\rVert^2 \\approx S_{a,a} + S_{b,b} - 2 S_{a,b}`.
+
+    Returns
+    -------
+    embedding
+        Array of shape `(n_residues + 1, n_dims)`. The last row is the zero
+        vector and represents a gap.
+    mapper
+        Array of length 256 mapping ASCII codes to rows of `embedding`.
+    """
+    mat = parasail.Matrix(subst_mat)
+    scores = mat.matrix[: mat.size, : mat.size].astype(float)
+    eigval, eigvec = np.linalg.eigh((scores + scores.T) / 2)
+    keep = eigval > 0
+    embedding = eigvec[:, keep] * np.sqrt(eigval[keep])
+    embedding = np.vstack([embedding, np.zeros((1, embedding.shape[1]))])
+    mapper = np.array(mat.mapper[:256], dtype=int)
+    return embedding, mapper
+
+
+@_doc_params(params=_doc_params_parallel_distance_calculator)
+class ApproximateAlignmentDistanceCalculator(AlignmentDistanceCalculator):
+    """\
+    Approximate version of the :class:`AlignmentDistanceCalculator`.
+
+    Instead of aligning all pairs of sequences, candidate pairs are retrieved
+    from a :class:`sklearn.neighbors.BallTree`. Only candidates are aligned
+    with `parasail` and their exact distance is compared against the cutoff.
+    This scales much better than the brute-force approach, at the cost of
+    potentially missing some pairs of sequences with a distance `<= cutoff`.
+    Use :meth:`estimate_recall` to check how many pairs are missed for a given
+    set of parameters.
+
+    For building the tree, each sequence is converted into a fixed-length vector
+    by concatenating residue vectors derived from the substitution matrix. The
+    squared euclidean distance between two residue vectors approximates
+    :math:`S_{{a,a}} + S_{{b,b}} - 2 S_{{a,b}}`, which is at least twice the
+    alignment distance of two aligned residues.
+
+    Parameters
+    ----------
+    cutoff
+        Will eleminate distances > cutoff to make efficient
+        use of sparse matrices. The default cutoff is `10`.
+    {params}
+    subst_mat
+        Name of parasail substitution matrix
+    gap_open
+        Gap open penalty
+    gap_extend
+        Gap extend penatly
+    encoding
+        How to convert sequences of different lengths into fixed-length vectors:
+          * `gap_padded` -- Sequences are padded with gaps in the center
+            to the length of the longest sequence. Gaps are represented as zero
+            vectors.
+          * `length_specific` -- Only sequences of identical length are considered as
+            candidates. With the default gap penalties, this does not lose any
+            pairs for cutoffs `< gap_open`.
+    radius
+        Retrieve all candidates within this euclidean distance in the embedding
+        space. Defaults to `sqrt(3 * cutoff)`.
+    n_neighbors
+        If specified, retrieve the `n_neighbors` nearest candidates of each
+        sequence instead of using a `radius`.
+    leaf_size
+        `leaf_size` parameter of the `BallTree`.
+    """
+
+    def __init__(
+        self,
+        cutoff: Union[None, int] = None,
+        *,
+        n_jobs: Union[int, None] = None,
+        block_size: int = 50,
+        subst_mat: str = "blosum62",
+        gap_open: int = 11,
+        gap_extend: int = 11,
+        encoding: Literal["gap_padded", "length_specific"] = "gap_padded",
+        radius: Optional[float] = None,
+        n_neighbors: Optional[int] = None,
+        leaf_size: int = 40,
+    ):
+        super().__init__(
+            cutoff,
+            n_jobs=n_jobs,
+            block_size=block_size,
+            subst_mat=subst_mat,
+            gap_open=gap_open,
+            gap_extend=gap_extend,
+        )
+        if encoding not in ["gap_padded", "length_specific"]:
+            raise ValueError("Invalid value for `encoding`.")
+        self.encoding = encoding
+        self.radius = np.sqrt(3 * self.cutoff) if radius is None else radius
+        self.n_neighbors = n_neighbors
+        self.leaf_size = leaf_size
+
+    def _embed(self, seqs: Sequence[str], length: int) -> np.ndarray:
+        """Convert sequences into vectors of `length` concatenated residue vectors.
+        Shorter sequences are padded with gaps in the center."""
+        embedding, mapper = _subst_mat_embedding(self.subst_mat)
+        gap = embedding.shape[0] - 1
+        codes = np.full((len(seqs), length), gap, dtype=int)
+        for i, s in enumerate(seqs):
+            tmp_codes = mapper[np.frombuffer(s.encode("ascii"), dtype=np.uint8)]
+            n_left = (len(s) + 1) // 2
+            codes[i, :n_left] = tmp_codes[:n_left]
+            codes[i, length - (len(s) - n_left) :] = tmp_codes[n_left:]
+        return embedding[codes].reshape(len(seqs), -1)
+
+    def _query_tree(
+        self, seqs1: Sequence[str], seqs2: Sequence[str], length: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Retrieve candidate pairs (rows, cols) from a BallTree built on `seqs2`."""
+        tree = BallTree(self._embed(seqs2, length), leaf_size=self.leaf_size)
+        x1 = self._embed(seqs1, length)
+        if self.n_neighbors is not None:
+            cols = tree.query(
+                x1, k=min(self.n_neighbors, len(seqs2)), return_distance=False
+            )
+        else:
+            cols = tree.query_radius(x1, r=self.radius)
+        rows = np.repeat(np.arange(len(seqs1)), [len(c) for c in cols])
+        cols = np.concatenate(list(cols)) if len(cols) else np.array([], dtype=int)
+        return rows, cols.astype(int)
+
+    def _candidates(
+        self, seqs1: Sequence[str], seqs2: Sequence[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Compute all candidate pairs (rows, cols) of `seqs1` and `seqs2`."""
+        lengths1 = np.fromiter((len(s) for s in seqs1), dtype=int, count=len(seqs1))
+        lengths2 = np.fromiter((len(s) for s in seqs2), dtype=int, count=len(seqs2))
+        if self.encoding == "gap_padded":
+            return self._query_tree(
+                seqs1, seqs2, max(np.max(lengths1), np.max(lengths2))
+            )
+
+        rows, cols = [], []
+        for length in np.intersect1d(lengths1, lengths2):
+            idx1 = np.flatnonzero(lengths1 == length)
+            idx2 = np.flatnonzero(lengths2 == length)
+            tmp_rows, tmp_cols = self._query_tree(
+                [seqs1[i] for i in idx1], [seqs2[i] for i in idx2], length
+            )
+            rows.append(idx1[tmp_rows])
+            cols.append(idx2[tmp_cols])
+        if not len(rows):
+            return np.array([], dtype=int), np.array([], dtype=int)
+        return np.concatenate(rows), np.concatenate(cols)
+
+    def _compute_candidates(
+        self, seqs1: Sequence[str], seqs2: Sequence[str], max_scores: np.ndarray
+    ) -> np.ndarray:
+        """Compute the exact alignment distances between pairs of sequences.
+        Needs to be picklable to be run in a worker process."""
+        subst_mat = parasail.Matrix(self.subst_mat)
+        scores = np.fromiter(
+            (
+                parasail.nw_scan_profile_16(
+                    parasail.profile_create_16(s1, subst_mat),
+                    s2,
+                    self.gap_open,
+                    self.gap_extend,
+                ).score
+                for s1, s2 in zip(seqs1, seqs2)
+            ),
+            dtype=int,
+            count=len(seqs1),
+        )
+        return max_scores - scores
+
+    def calc_dist_mat(
+        self, seqs: Sequence[str], seqs2: Optional[Sequence[str]] = None
+    ) -> csr_matrix:
+        """Calculate the distance matrix.
+
+        See :meth:`DistanceCalculator.calc_dist_mat`."""
+        square_mat = seqs2 is None
+        seqs = list(seqs)
+        seqs2 = seqs if square_mat else list(seqs2)
+        shape = (len(seqs), len(seqs2))
+        if not len(seqs) or not len(seqs2):
+            return csr_matrix(shape, dtype=self.DTYPE)
+
+        rows, cols = self._candidates(seqs, seqs2)
+        if square_mat:
+            # the distance is symmetric -> only align the upper triangle
+            upper = rows <= cols
+            rows, cols = rows[upper], cols[upper]
+
+        self_scores1 = self._self_alignment_scores(seqs)
+        self_scores2 = (
+            self_scores1 if square_mat else self._self_alignment_scores(seqs2)
+        )
+        max_scores = np.minimum(self_scores1[rows], self_scores2[cols])
+
+        # verify the candidates in chunks of the same size as a block of the
+        # brute-force approach
+        chunk_size = self.block_size ** 2
+        chunks = [
+            (
+                [seqs[i] for i in rows[start : start + chunk_size]],
+                [seqs2[j] for j in cols[start : start + chunk_size]],
+                max_scores[start : start + chunk_size],
+            )
+            for start in range(0, len(rows), chunk_size)
+        ]
+        chunk_results = process_map(
+            self._compute_candidates,
+            *zip(*chunks),
+            max_workers=self.n_jobs if self.n_jobs is not None else cpu_count(),
+            chunksize=1,
+            tqdm_class=tqdm,
+        )
+        dists = (
+            np.concatenate(chunk_results) if len(chunk_results) else np.array([])
+        ).astype(int)
+
+        mask = dists <= self.cutoff
+        score_mat = scipy.sparse.coo_matrix(
+            (dists[mask] + 1, (rows[mask], cols[mask])), dtype=self.DTYPE, shape=shape
+        ).tocsr()
+
+        if square_mat:
+            score_mat = self.squarify(score_mat)
+
+        return score_mat
+
+    def estimate_recall(
+        self,
+        seqs: Sequence[str],
+        *,
+        n_sample: int = 1000,
+        random_state: int = 0,
+    ) -> float:
+        """\
+        Estimate the fraction of pairs with a distance `<= cutoff` that are found
+        by the approximate calculator.
+
+        Computes the distance matrix of a random sample of `seqs` with both
+        the approximate and the brute-force :class:`AlignmentDistanceCalculator`
+        and compares the off-diagonal entries.
+
+        Parameters
+        ----------
+        seqs
+            array containing (unique) CDR3 sequences
+        n_sample
+            Number of sequences to sample. The brute-force calculation scales
+            quadratically with this value.
+        random_state
+            Random seed for sampling sequences.
+
+        Returns
+        -------
+        The recall, i.e. the fraction of true pairs that were recovered. If the
+        sample does not contain any pair within the cutoff, `1.0` is returned.
+        """
+        rng = np.random.default_rng(random_state)
+        seqs = np.asarray(seqs)
+        sample = seqs[
+            np.sort(rng.choice(len(seqs), min(n_sample, len(seqs)), replace=False))
+        ]
+        exact = AlignmentDistanceCalculator(
+            self.cutoff,
+            n_jobs=self.n_jobs,
+            block_size=self.block_size,
+            subst_mat=self.subst_mat,
+            gap_open=self.gap_open,
+            gap_extend=self.gap_extend,
+        ).calc_dist_mat(sample)
+        approx = self.calc_dist_mat(sample)
+
+        exact = scipy.sparse.triu(exact, k=1).tocsr()
+        n_exact = exact.nnz
+        if n_exact == 0:
+            return 1.0
+        n_found = exact.multiply(scipy.sparse.triu(approx, k=1) > 0).nnz
+        recall = n_found / n_exact
+        logging.info(
+            f"Recovered {n_found} of {n_exact} pairs of sequences "
+            f"(recall={recall:.3f})."
+        )  # type: ignore
+        return recall
+
+
+class PairedChainDistanceCalculator:
+    """\
+    Calculates distances between paired receptor configurations.
+
+    Instead of computing separate distance matrices for :term:`VJ <Chain locus>`
+    and :term:`VDJ <Chain locus>` sequences and merging them
+    afterwards, this calculator treats the combination of VJ and VDJ
+    :term:`CDR3` sequences (and, optionally, :term:`V-genes<V(D)J>`) as a unit.
+    The combined distance is computed in a single vectorized step. Candidate pairs
+    are retrieved from the VJ distances and only those that don't exceed the
+    cutoff yet are looked up in the VDJ distances.
+
+    Two receptor configurations are only compared if they have the same chains,
+    i.e. a configuration with only a VJ chain can only be a neighbor of
+    configurations with only a VJ chain.
+
+    Parameters
+    ----------
+    dist_calc
+        :class:`DistanceCalculator` used to compute the distances of the individual
+        chains. Defaults to :class:`IdentityDistanceCalculator`.
+    combine
+        How to combine the distances of the two chains:
+          * `max` -- the larger of both distances. This is consistent
+            with `receptor_arms="all"` in :func:`scirpy.tl.define_clonotype_clusters`.
+          * `sum` -- the sum of both distances, as in :cite:`TCRdist`.
+    cutoff
+        Will eleminate combined distances > cutoff. Defaults to the cutoff of
+        `dist_calc`. Note that distances of the individual chains
+        greater than the cutoff of `dist_calc` are never considered.
+    """
+
+    #: The sparse matrix dtype. Defaults to uint8, constraining the max distance to 255.
+    DTYPE = "uint8"
+
+    def __init__(
+        self,
+        dist_calc: Optional[DistanceCalculator] = None,
+        *,
+        combine: Literal["max", "sum"] = "max",
+        cutoff: Optional[int] = None,
+    ):
+        if combine not in ["max", "sum"]:
+            raise ValueError("Invalid value for `combine`.")
+        self.dist_calc = (
+            IdentityDistanceCalculator() if dist_calc is None else dist_calc
+        )
+        self.combine = combine
+        self.cutoff = self.dist_calc.cutoff if cutoff is None else cutoff
+        if self.cutoff > 255:
+            raise ValueError(
+                "Using a cutoff > 255 is not possible due to the `uint8` dtype used"
+            )
+
+    @staticmethod
+    def _factorize(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Map values to integer codes. NA values receive the code `-1`."""
+        values = np.asarray(values, dtype=object)
+        is_na = _is_na(values) if len(values) else np.zeros(0, dtype=bool)
+        uniques, codes = np.unique(
+            [str(x).upper() for x in values[~is_na]], return_inverse=True
+        )
+        res = np.full(len(values), -1, dtype=int)
+        res[~is_na] = codes
+        return res, uniques
+
+    @_doc_params(dist_mat=_doc_dist_mat)
+    def calc_dist_mat(
+        self,
+        vj_seqs: Sequence[str],
+        vdj_seqs: Sequence[str],
+        vj_v_genes: Optional[Sequence[str]] = None,
+        vdj_v_genes: Optional[Sequence[str]] = None,
+    ) -> csr_matrix:
+        """\
+        Calculate the pairwise distance matrix of receptor configurations.
+
+        {dist_mat}
+
+        Parameters
+        ----------
+        vj_seqs
+            VJ CDR3 sequence of each receptor configuration. NA values indicate
+            a missing chain.
+        vdj_seqs
+            VDJ CDR3 sequence of each receptor configuration.
+        vj_v_genes
+            V gene of the VJ chain of each receptor configuration. If specified
+            together with `vdj_v_genes`, only configurations with identical V genes
+            are neighbors.
+        vdj_v_genes
+            V gene of the VDJ chain of each receptor configuration.
+
+        Returns
+        -------
+        Sparse pairwise distance matrix with one row/column per receptor
+        configuration.
+        """
+        if len(vj_seqs) != len(vdj_seqs):
+            raise ValueError("`vj_seqs` and `vdj_seqs` must have the same length.")
+
+        chain_idx, distance_matrices = [], []
+        for seqs in [vj_seqs, vdj_seqs]:
+            tmp_idx, tmp_unique = self._factorize(seqs)
+            chain_idx.append(tmp_idx)
+            distance_matrices.append(self.dist_calc.calc_dist_mat(tmp_unique).tocsr())
+
+        v_gene_idx = None
+        if vj_v_genes is not None and vdj_v_genes is not None:
+            v_codes, _ = self._factorize(np.concatenate([vj_v_genes, vdj_v_genes]))
+            v_gene_idx = (v_codes[: len(vj_v_genes)], v_codes[len(vj_v_genes) :])
+
+        return paired_chain_distances(
+            chain_idx,
+            distance_matrices,
+            cutoff=self.cutoff,
+            combine=self.combine,
+            v_gene_idx=v_gene_idx,
+        )
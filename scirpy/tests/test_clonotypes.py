@@ -14,7 +14,9 @@ from .fixtures import (
     adata_clonotype,
     adata_conn,
 )  # NOQA
+import itertools
 import random
+from unittest import mock
 import pytest
 
 
@@ -217,6 +219,215 @@ def test_clonotype_clusters_end_to_end(
     npt.assert_almost_equal(clonotype_size.values, expected_size)
 
 
+def test_define_clonotype_clusters_leiden(adata_define_clonotype_clusters):
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    kwargs = dict(metric="levenshtein", receptor_arms="any", dual_ir="any")
+    resolutions = [1e-6, 1, 100]
+    clonotypes, clonotype_size, _ = ir.tl.define_clonotype_clusters(
+        adata, partitions="leiden", resolution=resolutions, inplace=False, **kwargs
+    )  # type: ignore
+    assert list(clonotypes.columns) == [
+        "cc_aa_levenshtein_r1e-06",
+        "cc_aa_levenshtein_r1",
+        "cc_aa_levenshtein_r100",
+    ]
+    assert list(clonotype_size.columns) == [f"{c}_size" for c in clonotypes.columns]
+    for resolution, col in zip(resolutions, clonotypes.columns):
+        tmp_clonotypes, tmp_clonotype_size, _ = ir.tl.define_clonotype_clusters(
+            adata, partitions="leiden", resolution=resolution, inplace=False, **kwargs
+        )  # type: ignore
+        pdt.assert_series_equal(clonotypes[col], tmp_clonotypes, check_names=False)
+        pdt.assert_series_equal(
+            clonotype_size[f"{col}_size"], tmp_clonotype_size, check_names=False
+        )
+
+    # with a very low resolution, each connected component is a single cluster
+    connected, _, _ = ir.tl.define_clonotype_clusters(
+        adata, inplace=False, **kwargs
+    )  # type: ignore
+    pdt.assert_series_equal(clonotypes.iloc[:, 0], connected, check_names=False)
+
+    ir.tl.define_clonotype_clusters(
+        adata, partitions="leiden", resolution=resolutions, **kwargs
+    )
+    pdt.assert_frame_equal(adata.obs.loc[:, clonotypes.columns], clonotypes)
+
+
+def test_clonotype_cell_operator(adata_define_clonotype_clusters):
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    ir.tl.define_clonotype_clusters(
+        adata, metric="levenshtein", receptor_arms="any", dual_ir="any", key_added="cc"
+    )
+    op = ir.ir_dist.ClonotypeCellOperator.from_adata(
+        adata, "cc", matrix_type="connectivity"
+    )
+    cell_matrix = op.tocsr()
+    assert np.all((cell_matrix.data > 0) & (cell_matrix.data <= 1))
+    # the connected components of the cell graph are the clonotype clusters
+    has_cluster = ~pd.isnull(adata.obs["cc"]).values
+    component = ir.util.graph.connected_components(cell_matrix)[has_cluster]
+    clusters = adata.obs["cc"].values[has_cluster]
+    assert len(set(zip(component, clusters))) == len(set(clusters))
+    assert len(set(component)) == len(set(clusters))
+    assert op.nnz == cell_matrix.nnz
+
+    # operator on a subset of the cells
+    subset = adata.obs_names[[3, 0, 7]]
+    op_subset = ir.ir_dist.ClonotypeCellOperator.from_adata(
+        AnnData(obs=adata.obs.loc[subset, :], uns=adata.uns), "cc"
+    )
+    idx = adata.obs_names.get_indexer(subset)
+    npt.assert_equal(
+        op_subset.tocsr().toarray(),
+        ir.ir_dist.ClonotypeCellOperator.from_adata(adata, "cc")
+        .tocsr()
+        .toarray()[np.ix_(idx, idx)],
+    )
+
+
+@pytest.mark.parametrize("receptor_arms", ["VJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["primary_only", "any"])
+@pytest.mark.parametrize("within_group", [None, "receptor_type"])
+def test_assign_clonotypes(
+    adata_define_clonotype_clusters, receptor_arms, dual_ir, within_group
+):
+    """Assigning new cells to a reference is the same as defining clonotype
+    clusters on all cells"""
+    adata = adata_define_clonotype_clusters
+    kwargs = dict(
+        metric="levenshtein",
+        receptor_arms=receptor_arms,
+        dual_ir=dual_ir,
+        within_group=within_group,
+        key_added="cc",
+    )
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=1, sequence="aa")
+    expected, expected_size, _ = ir.tl.define_clonotype_clusters(
+        adata, inplace=False, **kwargs
+    )  # type: ignore
+
+    adata_ref = AnnData(obs=adata.obs.iloc[[0, 2, 4, 5, 7, 9], :].copy())
+    adata_new = AnnData(obs=adata.obs.iloc[[1, 3, 6, 8, 10], :].copy())
+    ir.pp.ir_dist(adata_ref, metric="levenshtein", cutoff=1, sequence="aa")
+    ir.tl.define_clonotype_clusters(adata_ref, **kwargs)
+
+    clonotypes, clonotype_size = ir.tl.assign_clonotypes(
+        adata_new, adata_ref, key="cc", inplace=False
+    )  # type: ignore
+    npt.assert_almost_equal(
+        clonotype_size.values, expected_size[adata_new.obs_names].values
+    )
+    ir.tl.assign_clonotypes(adata_new, adata_ref, key="cc")
+    pdt.assert_series_equal(adata_new.obs["cc"], clonotypes, check_names=False)
+
+    # same partition of all cells, and same cluster sizes
+    result = pd.concat([adata_ref.obs["cc"], adata_new.obs["cc"]])[adata.obs_names]
+    result_size = pd.concat([adata_ref.obs["cc_size"], adata_new.obs["cc_size"]])
+    npt.assert_almost_equal(result_size[adata.obs_names].values, expected_size.values)
+    assert pd.isnull(result).equals(pd.isnull(expected))
+    pairs = set(zip(result.dropna(), expected.dropna()))
+    assert len(pairs) == result.nunique() == expected.nunique()
+
+
+def test_assign_clonotypes_leiden(adata_define_clonotype_clusters):
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=1, sequence="aa")
+    ir.tl.define_clonotype_clusters(
+        adata, metric="levenshtein", partitions="leiden", key_added="cc"
+    )
+    with pytest.raises(ValueError):
+        ir.tl.assign_clonotypes(AnnData(obs=adata.obs), adata, key="cc")
+
+
+@pytest.mark.parametrize("receptor_arms", ["VJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["primary_only", "any"])
+def test_clonotype_cluster_hierarchy(
+    adata_define_clonotype_clusters, receptor_arms, dual_ir
+):
+    """The clusters at each cutoff are the same as defining clonotype clusters
+    with sequence distances computed at that cutoff"""
+    adata = adata_define_clonotype_clusters
+    kwargs = dict(receptor_arms=receptor_arms, dual_ir=dual_ir, sequence="aa")
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    ir.tl.clonotype_cluster_hierarchy(adata, **kwargs)
+    hierarchy = ir.tl.clonotype_cluster_hierarchy(
+        adata, cutoffs=[2, 0], inplace=False, **kwargs
+    )
+    assert list(hierarchy.columns) == ["cc_aa_levenshtein_d0", "cc_aa_levenshtein_d2"]
+    for cutoff in [0, 1, 2]:
+        ir.pp.ir_dist(adata, metric="levenshtein", cutoff=cutoff, sequence="aa")
+        clonotypes, _, _ = ir.tl.define_clonotype_clusters(
+            adata, metric="levenshtein", inplace=False, **kwargs
+        )  # type: ignore
+        col = f"cc_aa_levenshtein_d{cutoff}"
+        pdt.assert_series_equal(adata.obs[col], clonotypes, check_names=False)
+        if cutoff in [0, 2]:
+            pdt.assert_series_equal(hierarchy[col], clonotypes, check_names=False)
+
+    with pytest.raises(ValueError):
+        ir.tl.clonotype_cluster_hierarchy(adata, cutoffs=[3], **kwargs)
+
+
+def test_define_clonotype_clusters_context(
+    adata_define_clonotype_clusters, monkeypatch
+):
+    """A parameter sweep with a shared context builds the clonotype table from
+    `adata.obs` only once and gives the same results as separate calls"""
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    params = list(
+        itertools.product(
+            ["VJ", "VDJ", "all", "any"], ["primary_only", "all", "any"], [False, True]
+        )
+    )
+    expected = [
+        ir.tl.define_clonotype_clusters(
+            adata,
+            metric="levenshtein",
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            same_v_gene=same_v_gene,
+            inplace=False,
+        )[0]
+        for receptor_arms, dual_ir, same_v_gene in params
+    ]
+
+    context = ir.ir_dist.ClonotypeNeighborContext.from_adata(
+        adata, metric="levenshtein"
+    )
+    # neither `adata.obs` is hashed nor a new clonotype table is built
+    monkeypatch.setattr(
+        pd.util, "hash_pandas_object", mock.Mock(side_effect=AssertionError)
+    )
+    make_clonotype_table = mock.Mock(side_effect=AssertionError)
+    monkeypatch.setattr(
+        ir.ir_dist.ClonotypeNeighborContext,
+        "_make_clonotype_table",
+        make_clonotype_table,
+    )
+    for (receptor_arms, dual_ir, same_v_gene), tmp_expected in zip(params, expected):
+        clonotypes, _, _ = ir.tl.define_clonotype_clusters(
+            adata,
+            metric="levenshtein",
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            same_v_gene=same_v_gene,
+            inplace=False,
+            context=context,
+        )  # type: ignore
+        pdt.assert_series_equal(clonotypes, tmp_expected)
+    ir.tl.clonotype_cluster_hierarchy(adata, context=context)
+    make_clonotype_table.assert_not_called()
+
+    # the context needs to contain the `within_group` columns
+    with pytest.raises(ValueError):
+        ir.tl.define_clonotype_clusters(
+            adata, metric="levenshtein", within_group="IR_VJ_1_locus", context=context
+        )
+
+
 @pytest.mark.parametrize(
     "min_cells,min_nodes,layout,size_aware,expected",
     (
@@ -277,6 +488,46 @@ def test_clonotype_network(
     npt.assert_almost_equal(coords.values, np.array(expected), decimal=5)
 
 
+@pytest.mark.parametrize("min_cells,min_nodes", [(1, 1), (2, 1), (3, 2)])
+def test_clonotype_network_components(
+    adata_define_clonotype_clusters, min_cells, min_nodes
+):
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    ir.tl.define_clonotype_clusters(
+        adata, metric="levenshtein", receptor_arms="any", dual_ir="any", key_added="cc"
+    )
+    components = adata.uns["cc"]["components"]
+    cell_indices = ir.ir_dist.CellIndices.from_uns(adata.uns["cc"]["cell_indices"])
+    npt.assert_equal(
+        components["membership"],
+        ir.util.graph.connected_components(adata.uns["cc"]["distances"]),
+    )
+    assert np.sum(components["n_nodes"]) == len(cell_indices)
+    assert np.sum(components["n_cells"]) == np.sum(~pd.isnull(adata.obs["cc"]))
+
+    coords = ir.tl.clonotype_network(
+        adata,
+        clonotype_key="cc",
+        min_cells=min_cells,
+        min_nodes=min_nodes,
+        inplace=False,
+    )
+    has_coords = ~np.isnan(coords["x"].values)
+    cluster_sizes = adata.obs["cc_size"].values
+    assert np.all(cluster_sizes[has_coords] >= min_cells)
+    # same result if the components are not stored, as in older versions
+    del adata.uns["cc"]["components"]
+    coords_legacy = ir.tl.clonotype_network(
+        adata,
+        clonotype_key="cc",
+        min_cells=min_cells,
+        min_nodes=min_nodes,
+        inplace=False,
+    )
+    pdt.assert_frame_equal(coords, coords_legacy)
+
+
 def test_clonotype_network_igraph(adata_clonotype_network):
     g, lo = ir.tl.clonotype_network_igraph(adata_clonotype_network)
     print(lo.coords)
@@ -1,15 +1,22 @@
 import pytest
 from scirpy.ir_dist.metrics import DistanceCalculator
-from scirpy.ir_dist._clonotype_neighbors import ClonotypeNeighbors
+from scirpy.ir_dist._clonotype_neighbors import (
+    ClonotypeNeighbors,
+    ClonotypeNeighborContext,
+    _factorize,
+    _unique_rows,
+)
 import numpy as np
 import numpy.testing as npt
 import scirpy as ir
 import scipy.sparse
-from .fixtures import adata_cdr3, adata_cdr3_2  # NOQA
+from .fixtures import adata_cdr3, adata_cdr3_2, adata_define_clonotype_clusters  # NOQA
 from .util import _squarify
 from scirpy.util import _is_symmetric
+from scirpy.util.graph import connected_components
 import pandas.testing as pdt
 import pandas as pd
+from anndata import AnnData
 
 
 def _assert_frame_equal(left, right):
@@ -157,6 +164,80 @@ def test_ir_dist(
     npt.assert_array_equal(res["VDJ"]["distances"].toarray(), expected_dist_vdj)
 
 
+@pytest.mark.parametrize(
+    "receptor_arms,dual_ir", [("all", "primary_only"), ("any", "any"), ("VDJ", "all")]
+)
+def test_ir_dist_half_storage(adata_cdr3, receptor_arms, dual_ir):
+    ir.pp.ir_dist(adata_cdr3, metric="levenshtein", cutoff=2, sequence="aa")
+    ir.pp.ir_dist(
+        adata_cdr3,
+        metric="levenshtein",
+        cutoff=2,
+        sequence="aa",
+        half_storage=True,
+        key_added="ir_dist_half",
+    )
+    full, half = (
+        adata_cdr3.uns["ir_dist_aa_levenshtein"],
+        adata_cdr3.uns["ir_dist_half"],
+    )
+    assert half["params"]["half_storage"]
+    for chain_type in ["VJ", "VDJ"]:
+        assert scipy.sparse.tril(half[chain_type]["distances"], k=-1).nnz == 0
+        npt.assert_equal(
+            ir.ir_dist.SymmetricDistanceMatrix(half[chain_type]["distances"]).toarray(),
+            full[chain_type]["distances"].toarray(),
+        )
+
+    dists = [
+        ClonotypeNeighbors(
+            adata_cdr3,
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            distance_key=distance_key,
+            sequence_key="junction_aa",
+        ).compute_distances()
+        for distance_key in ["ir_dist_aa_levenshtein", "ir_dist_half"]
+    ]
+    npt.assert_equal(dists[0].toarray(), dists[1].toarray())
+
+
+@pytest.mark.parametrize("metric", ["identity", "levenshtein", "alignment"])
+def test_estimate_cost(adata_cdr3, metric):
+    cost = ir.ir_dist.estimate_cost(adata_cdr3, metric=metric, sequence="aa")
+    assert list(cost.columns) == [
+        "chain_type",
+        "engine",
+        "n_seqs",
+        "n_pairs",
+        "n_candidates",
+        "density",
+        "nnz",
+        "memory",
+        "time",
+        "selected",
+    ]
+    assert cost.groupby("chain_type")["selected"].sum().tolist() == [1, 1]
+    if metric == "levenshtein":
+        assert cost.shape[0] == 8
+    else:
+        assert cost.shape[0] == 2
+    # with all sequences in the sample, the estimated nnz is exact
+    ir.pp.ir_dist(adata_cdr3, metric=metric, sequence="aa", key_added="tmp")
+    for chain_type in ["VJ", "VDJ"]:
+        tmp_cost = cost.loc[cost["chain_type"] == chain_type]
+        assert np.all(
+            tmp_cost["nnz"] == adata_cdr3.uns["tmp"][chain_type]["distances"].nnz
+        )
+
+
+def test_ir_dist_max_memory(adata_cdr3):
+    with pytest.raises(MemoryError):
+        ir.pp.ir_dist(adata_cdr3, metric="levenshtein", sequence="aa", max_memory=1)
+    ir.pp.ir_dist(adata_cdr3, metric="levenshtein", sequence="aa", max_memory=10 ** 9)
+    assert "ir_dist_aa_levenshtein" in adata_cdr3.uns
+
+
 @pytest.mark.parametrize("n_jobs", [1, 2])
 def test_compute_distances1(adata_cdr3, n_jobs):
     # test single chain with identity distance
@@ -615,6 +696,293 @@ def test_compute_distances11(adata_cdr3, adata_cdr3_mock_distance_calculator, n_
     )
 
 
+@pytest.mark.parametrize("receptor_arms", ["VJ", "VDJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["primary_only", "all", "any"])
+def test_compute_distances_engines(
+    adata_cdr3, adata_cdr3_mock_distance_calculator, receptor_arms, dual_ir
+):
+    """The sparse engine yields the same results as the rowwise engine,
+    also when computing distances in multiple blocks."""
+    ir.pp.ir_dist(adata_cdr3, metric=adata_cdr3_mock_distance_calculator, sequence="aa")
+    dists = [
+        ClonotypeNeighbors(
+            adata_cdr3,
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            distance_key="ir_dist_aa_custom",
+            sequence_key="junction_aa",
+            chunksize=2,
+            n_jobs=1,
+            engine=engine,
+        ).compute_distances()
+        for engine in ["rowwise", "sparse"]
+    ]
+    assert isinstance(dists[1], scipy.sparse.csr_matrix)
+    npt.assert_equal(dists[0].toarray(), dists[1].toarray())
+
+
+@pytest.mark.parametrize("engine", ["rowwise", "sparse"])
+@pytest.mark.parametrize("receptor_arms", ["VJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["all", "any"])
+def test_compute_distances_decompose(
+    adata_cdr3, adata_cdr3_mock_distance_calculator, receptor_arms, dual_ir, engine
+):
+    """Splitting the clonotypes into subproblems yields the same result"""
+    ir.pp.ir_dist(adata_cdr3, metric=adata_cdr3_mock_distance_calculator, sequence="aa")
+    cns = [
+        ClonotypeNeighbors(
+            adata_cdr3,
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            distance_key="ir_dist_aa_custom",
+            sequence_key="junction_aa",
+            chunksize=1,
+            n_jobs=1,
+            engine=engine,
+            decompose=decompose,
+        )
+        for decompose in [False, True]
+    ]
+    groups = cns[1]._component_groups()
+    assert len(groups) > 1
+    npt.assert_equal(np.sort(np.concatenate(groups)), np.arange(len(cns[1].clonotypes)))
+    dists = [cn.compute_distances() for cn in cns]
+    npt.assert_equal(dists[0].toarray(), dists[1].toarray())
+    # there are no neighbors between groups
+    group = np.zeros(dists[0].shape[0], dtype=int)
+    for i, ct_idx in enumerate(groups):
+        group[ct_idx] = i
+    dist = dists[0].tocoo()
+    assert np.all(group[dist.row] == group[dist.col])
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+@pytest.mark.parametrize("decompose", [False, True])
+def test_compute_distances_worker_pool(
+    adata_cdr3,
+    adata_cdr3_mock_distance_calculator,
+    monkeypatch,
+    start_method,
+    decompose,
+):
+    """Workers either inherit the ClonotypeNeighbors instance or receive
+    it once via the pool initializer."""
+    import scirpy.ir_dist._clonotype_neighbors as cn_module
+
+    monkeypatch.setattr(cn_module.mp, "get_start_method", lambda: start_method)
+    ir.pp.ir_dist(adata_cdr3, metric=adata_cdr3_mock_distance_calculator, sequence="aa")
+    dists = [
+        ClonotypeNeighbors(
+            adata_cdr3,
+            receptor_arms="any",
+            dual_ir="any",
+            distance_key="ir_dist_aa_custom",
+            sequence_key="junction_aa",
+            chunksize=1,
+            n_jobs=n_jobs,
+            decompose=decompose,
+        ).compute_distances()
+        for n_jobs in [1, 2]
+    ]
+    npt.assert_equal(dists[0].toarray(), dists[1].toarray())
+    assert cn_module._worker_neighbors is None
+
+
+@pytest.mark.parametrize(
+    "receptor_arms,dual_ir", [("all", "primary_only"), ("VJ", "all"), ("any", "any")]
+)
+def test_compute_distances_within_group(
+    adata_define_clonotype_clusters, receptor_arms, dual_ir
+):
+    """Clonotypes are partitioned by `within_group` before computing distances"""
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    cns = [
+        ClonotypeNeighbors(
+            adata,
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            within_group=["receptor_type"],
+            distance_key="ir_dist_aa_levenshtein",
+            sequence_key="junction_aa",
+            n_jobs=1,
+            decompose=decompose,
+        )
+        for decompose in [False, True]
+    ]
+    groups = cns[1]._component_groups()
+    within_group = cns[1]._forward_int["within_group"]
+    assert len(groups) > 1
+    assert all(len(np.unique(within_group[ct_idx])) == 1 for ct_idx in groups)
+    dists = [cn.compute_distances() for cn in cns]
+    assert dists[1].nnz > 0
+    npt.assert_equal(dists[0].toarray(), dists[1].toarray())
+
+
+@pytest.mark.parametrize("receptor_arms", ["VJ", "VDJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["primary_only", "all", "any"])
+@pytest.mark.parametrize("same_v_gene", [False, True])
+@pytest.mark.parametrize("within_group", [None, ["receptor_type"]])
+def test_compute_distances_hash(
+    adata_define_clonotype_clusters, receptor_arms, dual_ir, same_v_gene, within_group
+):
+    """With identity distances, the hash engine yields the same results as the
+    sparse engine"""
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="identity", sequence="aa")
+    cns = [
+        ClonotypeNeighbors(
+            adata,
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            same_v_gene=same_v_gene,
+            within_group=within_group,
+            distance_key="ir_dist_aa_identity",
+            sequence_key="junction_aa",
+            n_jobs=1,
+            engine=engine,
+        )
+        for engine in ["sparse", "auto"]
+    ]
+    assert cns[1].engine == "hash"
+    dists = [cn.compute_distances() for cn in cns]
+    npt.assert_equal(dists[0].toarray(), dists[1].toarray())
+    npt.assert_equal(
+        cns[1].compute_connected_components(), connected_components(dists[0])
+    )
+
+
+def test_hash_engine_requires_identity(adata_cdr3):
+    ir.pp.ir_dist(adata_cdr3, metric="levenshtein", sequence="aa")
+    kwargs = dict(
+        receptor_arms="all",
+        dual_ir="primary_only",
+        distance_key="ir_dist_aa_levenshtein",
+        sequence_key="junction_aa",
+    )
+    assert ClonotypeNeighbors(adata_cdr3, **kwargs).engine == "sparse"
+    with pytest.raises(ValueError):
+        ClonotypeNeighbors(adata_cdr3, engine="hash", **kwargs)
+
+
+@pytest.mark.parametrize("receptor_arms", ["VJ", "VDJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["primary_only", "all", "any"])
+@pytest.mark.parametrize("same_v_gene", [False, True])
+@pytest.mark.parametrize("within_group", [None, ["receptor_type"]])
+def test_clonotype_neighbor_context(
+    adata_define_clonotype_clusters, receptor_arms, dual_ir, same_v_gene, within_group
+):
+    """Deriving the clonotypes from a shared context gives the same results
+    as building them from scratch"""
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    kwargs = dict(distance_key="ir_dist_aa_levenshtein", sequence_key="junction_aa")
+    context = ClonotypeNeighborContext(
+        adata, within_group=["receptor_type", "IR_VJ_1_locus"], **kwargs
+    )
+    cns = [
+        ClonotypeNeighbors(
+            adata,
+            receptor_arms=receptor_arms,
+            dual_ir=dual_ir,
+            same_v_gene=same_v_gene,
+            within_group=within_group,
+            n_jobs=1,
+            context=tmp_context,
+            **kwargs,
+        )
+        for tmp_context in [None, context]
+    ]
+    _assert_frame_equal(cns[0].clonotypes, cns[1].clonotypes)
+    assert list(cns[0].cell_indices) == list(cns[1].cell_indices)
+    for ci0, ci1 in zip(cns[0].cell_indices.values(), cns[1].cell_indices.values()):
+        npt.assert_equal(ci0, ci1)
+    npt.assert_equal(
+        cns[0].compute_distances().toarray(), cns[1].compute_distances().toarray()
+    )
+
+
+def test_clonotype_neighbor_context_from_adata(adata_define_clonotype_clusters):
+    adata = adata_define_clonotype_clusters
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=2, sequence="aa")
+    kwargs = dict(distance_key="ir_dist_aa_levenshtein", sequence_key="junction_aa")
+    context = ClonotypeNeighborContext.from_adata(
+        adata, metric="levenshtein", within_group=None
+    )
+    assert (context.distance_key, context.sequence_key) == (
+        "ir_dist_aa_levenshtein",
+        "junction_aa",
+    )
+    assert context.within_group == []
+    assert "IR_VDJ_2_v_call" in context.columns
+
+    # the context must contain all required columns
+    with pytest.raises(ValueError):
+        ClonotypeNeighbors(
+            adata,
+            receptor_arms="all",
+            dual_ir="any",
+            within_group=["receptor_type"],
+            context=context,
+            **kwargs,
+        )
+
+    # the context is outdated after recomputing the sequence distances
+    ir.pp.ir_dist(adata, metric="levenshtein", cutoff=1, sequence="aa")
+    with pytest.raises(ValueError):
+        ClonotypeNeighbors(
+            adata, receptor_arms="all", dual_ir="any", context=context, **kwargs
+        )
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_factorize(categorical):
+    values = pd.Series(["A", np.nan, "B", "None", "A", None, "", 1, "1"])
+    if categorical:
+        values = values.astype(str).astype("category")
+    codes, uniques = _factorize(values)
+    npt.assert_equal(
+        uniques[codes], ["A", "nan", "B", "nan", "A", "nan", "nan", "1", "1"]
+    )
+    assert len(uniques) == 4
+
+
+@pytest.mark.parametrize("n_codes", [3, 2 ** 40])
+def test_unique_rows(n_codes):
+    codes = np.array([[2, 0, 1], [0, 0, 0], [2, 0, 1], [0, 1, 0], [0, 0, 0], [1, 1, 1]])
+    # large codes exceed the int64 range when combined
+    codes[:, 1] *= n_codes - 1
+    codes[0, 2] = codes[2, 2] = n_codes - 1
+    inverse, first = _unique_rows(codes)
+    npt.assert_equal(inverse, [0, 1, 0, 2, 1, 3])
+    npt.assert_equal(first, [0, 1, 3, 5])
+
+
+@pytest.mark.parametrize("engine", ["rowwise", "sparse"])
+@pytest.mark.parametrize("receptor_arms", ["VJ", "all", "any"])
+@pytest.mark.parametrize("dual_ir", ["primary_only", "any"])
+def test_compute_connected_components(
+    adata_cdr3, adata_cdr3_mock_distance_calculator, receptor_arms, dual_ir, engine
+):
+    """Streaming connected components are the same as the components
+    of the full distance matrix"""
+    ir.pp.ir_dist(adata_cdr3, metric=adata_cdr3_mock_distance_calculator, sequence="aa")
+    cn = ClonotypeNeighbors(
+        adata_cdr3,
+        receptor_arms=receptor_arms,
+        dual_ir=dual_ir,
+        distance_key="ir_dist_aa_custom",
+        sequence_key="junction_aa",
+        chunksize=2,
+        n_jobs=1,
+        engine=engine,
+    )
+    npt.assert_equal(
+        cn.compute_connected_components(),
+        connected_components(cn.compute_distances()),
+    )
+
+
 def test_compute_distances12(adata_cdr3, adata_cdr3_mock_distance_calculator):
     """Test for #174. Gracefully handle the case when there are no distances."""
     adata_cdr3.obs["IR_VJ_1_junction_aa"] = np.nan
@@ -1,16 +1,21 @@
 import pytest
 from scirpy.ir_dist.metrics import (
     AlignmentDistanceCalculator,
+    ApproximateAlignmentDistanceCalculator,
     DistanceCalculator,
     IdentityDistanceCalculator,
     LevenshteinDistanceCalculator,
     HammingDistanceCalculator,
+    PairedChainDistanceCalculator,
     ParallelDistanceCalculator,
+    WeightedLevenshteinDistanceCalculator,
 )
+import pandas as pd
 import numpy as np
 import numpy.testing as npt
 import scirpy as ir
 import scipy.sparse
+from scirpy.ir_dist._engines import _CandidateFilterMixin
 from .util import _squarify
 
 
@@ -218,6 +223,105 @@ def test_hamming_dist():
     )
 
 
+@pytest.mark.parametrize(
+    "engine", ["brute_force", "length_bucketed", "deletion_index", "qgram", "auto"]
+)
+@pytest.mark.parametrize(
+    "dist_calc_class", [LevenshteinDistanceCalculator, HammingDistanceCalculator]
+)
+@pytest.mark.parametrize("cutoff", [1, 2, 5])
+def test_engines(dist_calc_class, engine, cutoff):
+    """All engines yield the same result as computing all pairs"""
+    seqs = np.array(
+        ["", "A", "AA", "AAA", "AAR", "RAAR", "ARRA", "CARRAC", "CARRAK", "ZZZZZZ"]
+    )
+    seqs2 = np.array(["RRR", "AR", "CARAC", "CAKRAC", "ARA"])
+    dist_calc = dist_calc_class(cutoff, n_jobs=1, block_size=2, engine=engine)
+    brute_force = dist_calc_class(cutoff, n_jobs=1, engine="brute_force")
+    npt.assert_equal(
+        dist_calc.calc_dist_mat(seqs).toarray(),
+        brute_force.calc_dist_mat(seqs).toarray(),
+    )
+    npt.assert_equal(
+        dist_calc.calc_dist_mat(seqs, seqs2).toarray(),
+        brute_force.calc_dist_mat(seqs, seqs2).toarray(),
+    )
+
+
+def test_engine_not_supported():
+    with pytest.raises(ValueError):
+        LevenshteinDistanceCalculator(2, engine="foo")
+    # only distance calculators with candidate filters support other engines
+    assert not isinstance(AlignmentDistanceCalculator(), _CandidateFilterMixin)
+    assert isinstance(HammingDistanceCalculator(), _CandidateFilterMixin)
+    assert not hasattr(ParallelDistanceCalculator, "_compute_pairs")
+
+
+@pytest.mark.parametrize("cutoff", [0, 1, 2, 5])
+@pytest.mark.parametrize("block_size", [2, 100])
+def test_weighted_levenshtein_unit_costs(cutoff, block_size):
+    """With unit costs, the results are identical to the levenshtein distance"""
+    seqs = np.array(["", "A", "AA", "AAA", "AAR", "RAAR", "ARRA", "CARRAC", "ZZZZZZ"])
+    seqs2 = np.array(["RRR", "AR", "CARAC"])
+    weighted = WeightedLevenshteinDistanceCalculator(
+        cutoff, n_jobs=1, block_size=block_size
+    )
+    levenshtein = LevenshteinDistanceCalculator(cutoff, n_jobs=1)
+
+    res = weighted.calc_dist_mat(seqs)
+    assert isinstance(res, scipy.sparse.csr_matrix)
+    npt.assert_equal(res.toarray(), levenshtein.calc_dist_mat(seqs).toarray())
+    npt.assert_equal(
+        weighted.calc_dist_mat(seqs, seqs2).toarray(),
+        levenshtein.calc_dist_mat(seqs, seqs2).toarray(),
+    )
+
+
+def test_weighted_levenshtein_dist():
+    subst_costs = pd.DataFrame([[0, 3], [3, 0]], index=["A", "C"], columns=["A", "C"])
+    weighted = WeightedLevenshteinDistanceCalculator(
+        3, n_jobs=1, indel_cost=2, substitution_cost=1, subst_costs=subst_costs
+    )
+    res = weighted.calc_dist_mat(np.array(["AAA", "AAC", "AAR", "AA", "CAAR"]))
+    npt.assert_equal(
+        res.toarray(),
+        _squarify(
+            [
+                # A->C costs 3, A->R costs 1, indels cost 2
+                [1, 4, 2, 3, 4],
+                [0, 1, 2, 3, 4],
+                [0, 0, 1, 3, 3],
+                # two indels exceed the cutoff
+                [0, 0, 0, 1, 0],
+                [0, 0, 0, 0, 1],
+            ]
+        ),
+    )
+
+    with pytest.raises(ValueError):
+        WeightedLevenshteinDistanceCalculator(indel_cost=0)
+    # asymmetric substitution costs
+    with pytest.raises(ValueError):
+        WeightedLevenshteinDistanceCalculator(subst_costs={"A": {"C": 0}})
+    with pytest.raises(ValueError):
+        WeightedLevenshteinDistanceCalculator(
+            subst_costs=pd.DataFrame(
+                [[0, 1], [2, 0]], index=["A", "C"], columns=["A", "C"]
+            )
+        )
+
+
+def test_weighted_levenshtein_compute_dists():
+    weighted = WeightedLevenshteinDistanceCalculator(2, indel_cost=2)
+    codes1, lengths1 = weighted._encode(["AAAAAA", "AAAAAA", "AAAAAA", "A", "AA"])
+    codes2, lengths2 = weighted._encode(["AAAAAA", "AAAAAR", "RRRRRR", "AAAA", "AR"])
+    npt.assert_equal(
+        weighted._compute_dists(codes1, lengths1, codes2, lengths2),
+        # distances > cutoff are reported as cutoff + 1
+        [0, 1, 3, 3, 1],
+    )
+
+
 def test_alignment_compute_block():
     aligner = AlignmentDistanceCalculator(cutoff=255)
     aligner10 = AlignmentDistanceCalculator(cutoff=10)
@@ -265,6 +369,106 @@ def test_alignment_dist_with_two_seq_arrays():
     )
 
 
+@pytest.mark.parametrize("encoding", ["gap_padded", "length_specific"])
+def test_approximate_alignment_dist(encoding):
+    seqs = np.array(["AAAA", "AAHA", "HHHH", "AAAAA", "WWWW", "AAWA"])
+    seqs2 = np.array(["WWWW", "AAAA", "ATAA"])
+    exact = AlignmentDistanceCalculator(cutoff=15, n_jobs=1)
+    # with a huge radius, all pairs are candidates -> identical to exact result
+    approx = ApproximateAlignmentDistanceCalculator(
+        cutoff=15, n_jobs=1, radius=1000, encoding=encoding
+    )
+    res = approx.calc_dist_mat(seqs)
+    assert isinstance(res, scipy.sparse.csr_matrix)
+    expected = exact.calc_dist_mat(seqs).toarray()
+    if encoding == "length_specific":
+        lengths = np.array([len(x) for x in seqs])
+        expected[lengths[:, np.newaxis] != lengths[np.newaxis, :]] = 0
+    npt.assert_equal(res.toarray(), expected)
+
+    res = approx.calc_dist_mat(seqs, seqs2)
+    assert res.shape == (6, 3)
+    expected = exact.calc_dist_mat(seqs, seqs2).toarray()
+    if encoding == "length_specific":
+        expected[3, :] = 0
+    npt.assert_equal(res.toarray(), expected)
+
+
+def test_approximate_alignment_dist_candidates():
+    seqs = np.array(["AAAA", "AAHA", "HHHH", "AAAH", "WWWW"])
+    exact = AlignmentDistanceCalculator(cutoff=255, n_jobs=1).calc_dist_mat(seqs)
+
+    # only the nearest neighbor (= the sequence itself) is a candidate
+    approx = ApproximateAlignmentDistanceCalculator(cutoff=255, n_jobs=1, n_neighbors=1)
+    npt.assert_equal(approx.calc_dist_mat(seqs).toarray(), np.identity(5))
+
+    # A smaller radius can only remove entries
+    approx = ApproximateAlignmentDistanceCalculator(cutoff=255, n_jobs=1, radius=5)
+    res = approx.calc_dist_mat(seqs)
+    assert 5 < res.nnz < exact.nnz
+    npt.assert_equal(res.multiply(exact > 0).toarray(), res.toarray())
+    npt.assert_equal(res[res > 0].A1, exact[res > 0].A1)
+
+
+def test_approximate_alignment_estimate_recall():
+    seqs = np.array(["AAAA", "AAHA", "HHHH", "AAAH", "WWWW", "WWHW", "KKKK"])
+    approx = ApproximateAlignmentDistanceCalculator(cutoff=10, n_jobs=1, radius=1000)
+    assert approx.estimate_recall(seqs) == 1.0
+    approx = ApproximateAlignmentDistanceCalculator(cutoff=10, n_jobs=1, n_neighbors=1)
+    assert approx.estimate_recall(seqs) == 0.0
+    assert approx.estimate_recall(["AAAA", "KKKK"]) == 1.0
+
+
+def test_paired_chain_dist():
+    vj_seqs = ["AAA", "AAR", "aaa", "AAA", np.nan, None, "nan"]
+    vdj_seqs = ["KKK", "KKK", "KKK", "KKR", "KKK", "KKR", np.nan]
+    vj_v_genes = ["V1", "V1", "V2", "V1", np.nan, np.nan, np.nan]
+    vdj_v_genes = ["V3"] * 7
+
+    res = PairedChainDistanceCalculator().calc_dist_mat(vj_seqs, vdj_seqs)
+    assert isinstance(res, scipy.sparse.csr_matrix)
+    npt.assert_equal(
+        res.toarray(),
+        np.array(
+            [
+                [1, 0, 1, 0, 0, 0, 0],
+                [0, 1, 0, 0, 0, 0, 0],
+                [1, 0, 1, 0, 0, 0, 0],
+                [0, 0, 0, 1, 0, 0, 0],
+                [0, 0, 0, 0, 1, 0, 0],
+                [0, 0, 0, 0, 0, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0],
+            ]
+        ),
+    )
+
+    res = PairedChainDistanceCalculator(
+        LevenshteinDistanceCalculator(1, n_jobs=1)
+    ).calc_dist_mat(vj_seqs, vdj_seqs, vj_v_genes, vdj_v_genes)
+    npt.assert_equal(
+        res.toarray(),
+        np.array(
+            [
+                [1, 2, 0, 2, 0, 0, 0],
+                [2, 1, 0, 2, 0, 0, 0],
+                [0, 0, 1, 0, 0, 0, 0],
+                [2, 2, 0, 1, 0, 0, 0],
+                [0, 0, 0, 0, 1, 2, 0],
+                [0, 0, 0, 0, 2, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0],
+            ]
+        ),
+    )
+
+    res = PairedChainDistanceCalculator(
+        LevenshteinDistanceCalculator(1, n_jobs=1), combine="sum", cutoff=1
+    ).calc_dist_mat(vj_seqs[:4], vdj_seqs[:4])
+    npt.assert_equal(
+        res.toarray(),
+        np.array([[1, 2, 1, 2], [2, 1, 2, 0], [1, 2, 1, 2], [2, 0, 2, 1]]),
+    )
+
+
 @pytest.mark.parametrize("metric", ["alignment", "identity", "hamming", "levenshtein"])
 def test_sequence_dist_all_metrics(metric):
     """Smoke test, no assertions!"""
@@ -4,9 +4,18 @@ from scirpy.ir_dist._util import (
     DoubleLookupNeighborFinder,
     reduce_and,
     reduce_or,
+    reduce_and_int,
+    reduce_or_int,
     merge_coo_matrices,
+    paired_chain_distances,
+    SymmetricDistanceMatrix,
+    ReverseLookupTable,
+    distance_submatrix,
+    CellIndices,
+    ClonotypeCellOperator,
 )
 import pytest
+import itertools
 import numpy as np
 import scipy.sparse as sp
 import pandas as pd
@@ -37,6 +46,19 @@ def dlnf():
     return dlnf
 
 
+@pytest.fixture
+def dist_mat_symmetric():
+    return sp.csr_matrix(
+        [
+            [1, 0, 0, 2, 0],
+            [0, 0, 3, 0, 0],
+            [0, 3, 4, 5, 0],
+            [2, 0, 5, 0, 0],
+            [0, 0, 0, 0, 6],
+        ]
+    )
+
+
 @pytest.fixture
 def dlnf_with_lookup(dlnf):
     dlnf.add_lookup_table(feature_col="VJ", distance_matrix="test", name="VJ_test")
@@ -111,6 +133,30 @@ def test_reduce_and(args, chain_count, expected):
     npt.assert_equal(reduce_and(*args, chain_count=chain_count), expected)
 
 
+def _to_int(array, missing=255):
+    return np.where(np.isnan(array), missing, array).astype(np.uint8)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_reduce_int(seed):
+    """The integer kernels are equivalent to the float versions"""
+    rng = np.random.default_rng(seed)
+    args = [rng.choice([np.nan, 0, 1, 2, 3, 254], size=(3, 50)) for _ in range(4)]
+    chain_count = rng.integers(0, 5, size=(3, 50))
+    npt.assert_equal(
+        reduce_or_int(*map(_to_int, args), missing=255),
+        _to_int(reduce_or(*(a.ravel() for a in args)).reshape(3, 50)),
+    )
+    npt.assert_equal(
+        reduce_and_int(*map(_to_int, args), chain_count=chain_count, missing=255),
+        _to_int(
+            reduce_and(
+                *(a.ravel() for a in args), chain_count=chain_count.ravel()
+            ).reshape(3, 50)
+        ),
+    )
+
+
 @pytest.mark.parametrize(
     "feature_col,name,forward_expected,reverse_expected",
     [
@@ -233,3 +279,273 @@ def test_dlnf_lookup_with_different_forward_and_reverse_tables(dlnf_with_lookup)
         == list(dlnf_with_lookup.lookup(6, "VDJ_test", "VJ_test").todense().A1)
         == [0] * 8
     )
+
+
+@pytest.mark.parametrize(
+    "combine,v_gene_idx,expected",
+    [
+        (
+            "max",
+            None,
+            [
+                [1, 3, 0, 0, 0, 0],
+                [3, 1, 0, 0, 0, 0],
+                [0, 0, 1, 0, 0, 0],
+                [0, 0, 0, 1, 2, 0],
+                [0, 0, 0, 2, 1, 0],
+                [0, 0, 0, 0, 0, 0],
+            ],
+        ),
+        (
+            "sum",
+            None,
+            [
+                [1, 4, 0, 0, 0, 0],
+                [4, 1, 0, 0, 0, 0],
+                [0, 0, 1, 0, 0, 0],
+                [0, 0, 0, 1, 2, 0],
+                [0, 0, 0, 2, 1, 0],
+                [0, 0, 0, 0, 0, 0],
+            ],
+        ),
+        (
+            "max",
+            ([0, 1, 0, -1, -1, -1], [0, 0, 0, 1, 1, -1]),
+            [
+                [1, 0, 0, 0, 0, 0],
+                [0, 1, 0, 0, 0, 0],
+                [0, 0, 1, 0, 0, 0],
+                [0, 0, 0, 1, 2, 0],
+                [0, 0, 0, 2, 1, 0],
+                [0, 0, 0, 0, 0, 0],
+            ],
+        ),
+    ],
+)
+def test_paired_chain_distances(combine, v_gene_idx, expected):
+    dist_vj = sp.csr_matrix([[1, 2, 0], [2, 1, 4], [0, 4, 1]])
+    dist_vdj = sp.csr_matrix([[1, 3, 0, 0], [3, 1, 0, 0], [0, 0, 1, 2], [0, 0, 2, 1]])
+    # objects 0-2 have both chains, objects 3-4 only VDJ, object 5 no chains.
+    # object 2 has a VJ distance of 3 to object 1, but no VDJ distance.
+    res = paired_chain_distances(
+        (np.array([0, 1, 2, -1, -1, -1]), np.array([0, 1, 2, 2, 3, -1])),
+        (dist_vj, dist_vdj),
+        cutoff=3,
+        combine=combine,
+        v_gene_idx=v_gene_idx,
+    )
+    assert isinstance(res, sp.csr_matrix)
+    npt.assert_equal(res.toarray(), np.array(expected))
+
+
+def test_symmetric_distance_matrix(dist_mat_symmetric):
+    sym = SymmetricDistanceMatrix(dist_mat_symmetric)
+    assert sym.shape == (5, 5)
+    assert sym.nnz == 6
+    npt.assert_equal(sp.tril(sym.upper, k=-1).nnz, 0)
+    npt.assert_equal(sym.tocsr().toarray(), dist_mat_symmetric.toarray())
+    npt.assert_equal(
+        sym.strict_lower.toarray(), sp.tril(dist_mat_symmetric, k=-1).toarray()
+    )
+    # the strictly lower triangle is built once
+    assert sym.strict_lower is sym.strict_lower
+    # a triangular input matrix results in the same object
+    npt.assert_equal(
+        SymmetricDistanceMatrix(sym.upper).toarray(), dist_mat_symmetric.toarray()
+    )
+    for i in range(5):
+        indices, data = sym.row(i)
+        npt.assert_equal(indices, dist_mat_symmetric[i, :].indices)
+        npt.assert_equal(data, dist_mat_symmetric[i, :].data)
+        npt.assert_equal(
+            sym[i, :].toarray(), dist_mat_symmetric[i, :].toarray()  # type: ignore
+        )
+    rows, cols = np.array([0, 3, 2, 4, 1]), np.array([3, 0, 1, 0, 1])
+    npt.assert_equal(
+        np.asarray(sym[rows, cols]), np.asarray(dist_mat_symmetric[rows, cols])
+    )
+
+
+def test_dlnf_lookup_symmetric(dlnf_with_lookup):
+    clonotypes = dlnf_with_lookup.feature_table
+    dlnf_sym = DoubleLookupNeighborFinder(feature_table=clonotypes)
+    dlnf_sym.add_distance_matrix(
+        name="test",
+        distance_matrix=SymmetricDistanceMatrix(
+            dlnf_with_lookup.distance_matrices["test"]
+        ),
+        labels=np.array(["A", "B", "C", "D", "G", "F"]),
+    )
+    dlnf_sym.add_lookup_table(feature_col="VJ", distance_matrix="test", name="VJ_test")
+    dlnf_sym.add_lookup_table(
+        feature_col="VDJ", distance_matrix="test", name="VDJ_test"
+    )
+    for clonotype_id in range(clonotypes.shape[0]):
+        for forward, reverse in itertools.product(["VJ_test", "VDJ_test"], repeat=2):
+            npt.assert_equal(
+                dlnf_sym.lookup(clonotype_id, forward, reverse).toarray(),
+                dlnf_with_lookup.lookup(clonotype_id, forward, reverse).toarray(),
+            )
+
+
+@pytest.mark.parametrize("symmetric", [False, True])
+def test_dlnf_lookup_many(dlnf, symmetric):
+    if symmetric:
+        dlnf.distance_matrices["test"] = SymmetricDistanceMatrix(
+            dlnf.distance_matrices["test"]
+        )
+    dlnf.add_lookup_table(feature_col="VJ", distance_matrix="test", name="VJ_test")
+    dlnf.add_lookup_table(feature_col="VDJ", distance_matrix="test", name="VDJ_test")
+    dlnf.add_distance_matrix(
+        name="bool",
+        distance_matrix=sp.identity(6, dtype=bool, format="csr"),
+        labels=np.array(["A", "B", "C", "D", "G", "F"]),
+    )
+    dlnf.add_lookup_table(
+        feature_col="VDJ", distance_matrix="bool", name="VDJ_bool", dist_type="boolean"
+    )
+    object_ids = [7, 0, 4, 3, 3, 6]
+    for forward, reverse in itertools.product(["VJ_test", "VDJ_test"], repeat=2):
+        res = dlnf.lookup_many(object_ids, forward, reverse)
+        assert isinstance(res, sp.csr_matrix)
+        npt.assert_equal(
+            res.toarray(),
+            np.vstack([dlnf.lookup(i, forward, reverse).toarray() for i in object_ids]),
+        )
+    res = dlnf.lookup_many(object_ids, "VDJ_bool")
+    assert res.dtype == bool
+    npt.assert_equal(
+        res.toarray(), np.vstack([dlnf.lookup(i, "VDJ_bool") for i in object_ids])
+    )
+    assert dlnf.lookup_many([], "VJ_test").shape == (0, 8)
+
+
+def test_paired_chain_distances_symmetric():
+    dist_vj = sp.csr_matrix([[1, 2, 0], [2, 1, 4], [0, 4, 1]])
+    dist_vdj = sp.csr_matrix([[1, 3, 0, 0], [3, 1, 0, 0], [0, 0, 1, 2], [0, 0, 2, 1]])
+    chain_idx = (np.array([0, 1, 2, -1, -1, -1]), np.array([0, 1, 2, 2, 3, -1]))
+    expected = paired_chain_distances(chain_idx, (dist_vj, dist_vdj), cutoff=3)
+    res = paired_chain_distances(
+        chain_idx,
+        (SymmetricDistanceMatrix(dist_vj), SymmetricDistanceMatrix(dist_vdj)),
+        cutoff=3,
+    )
+    npt.assert_equal(res.toarray(), expected.toarray())
+
+
+@pytest.mark.parametrize("dist_type", ["numeric", "boolean"])
+@pytest.mark.parametrize("use_bitmaps", [True, False])
+def test_reverse_lookup_table(dist_type, use_bitmaps):
+    # key 0 is frequent and will be stored as bitmap
+    forward = np.array([0, 1, np.nan, 0, 3, 0] + [0] * 60 + [3])
+    size = len(forward)
+    rlt = ReverseLookupTable.from_forward_lookup_table(
+        forward, dist_type, 5, use_bitmaps=use_bitmaps
+    )
+    assert (0 in rlt.bitmaps) == use_bitmaps
+    assert 3 not in rlt.bitmaps
+
+    def _dense(mask):
+        return mask if isinstance(mask, np.ndarray) else mask.toarray()
+
+    for k in range(-1, 7):
+        expected = (forward == k)[np.newaxis, :]
+        npt.assert_equal(_dense(rlt[k]).astype(bool), expected)
+    assert rlt[4].shape == rlt.empty().shape == (1, size)
+    assert list(rlt.lookup) == [0, 1, 3]
+
+    owner, indices = rlt.gather(np.array([3, 2, 0, 1, 3]))
+    res = sorted(zip(owner, indices))
+    expected = sorted(
+        (i, j)
+        for i, k in enumerate([3, 2, 0, 1, 3])
+        for j in np.flatnonzero(forward == k)
+    )
+    assert res == expected
+
+    rlt2 = ReverseLookupTable.from_dict_of_indices(
+        {k: np.flatnonzero(forward == k) for k in [0, 1, 3]},
+        dist_type,
+        size,
+        use_bitmaps=use_bitmaps,
+    )
+    for k in range(5):
+        npt.assert_equal(_dense(rlt2[k]), _dense(rlt[k]))
+
+
+@pytest.mark.parametrize("symmetric", [False, True])
+def test_distance_submatrix(dist_mat_symmetric, symmetric):
+    dist_mat = dist_mat_symmetric
+    idx = np.array([0, 2, 3])
+    res = distance_submatrix(
+        SymmetricDistanceMatrix(dist_mat) if symmetric else dist_mat, idx
+    )
+    assert isinstance(res, sp.csr_matrix)
+    npt.assert_equal(res.toarray(), dist_mat.toarray()[np.ix_(idx, idx)])
+    assert distance_submatrix(dist_mat, np.array([], dtype=int)).shape == (0, 0)
+
+
+def test_cell_indices():
+    obs_names = np.array(["c0", "c1", "c2", "c3", "c4"], dtype=object)
+    cell_indices = CellIndices([0, 2, 3, 3], [4, 1, 0], obs_names)
+    assert len(cell_indices) == 3
+    npt.assert_equal(cell_indices.sizes, [2, 1, 0])
+    npt.assert_equal(cell_indices["0"], ["c4", "c1"])
+    npt.assert_equal(cell_indices[1], ["c0"])
+    with pytest.raises(KeyError):
+        cell_indices["3"]
+
+    # round trip through adata.uns and the legacy dictionary format
+    for uns in [cell_indices.to_uns(), cell_indices.to_dict()]:
+        tmp_cell_indices = CellIndices.from_uns(uns)
+        assert list(tmp_cell_indices) == ["0", "1", "2"]
+        for k, v in cell_indices.items():
+            npt.assert_equal(tmp_cell_indices[k], v)
+
+    npt.assert_equal(cell_indices.cell_clonotypes(obs_names), [1, 0, -1, -1, 0])
+    # subset and reordered obs names
+    npt.assert_equal(
+        cell_indices.cell_clonotypes(["c4", "c3", "c0", "x"]), [0, -1, 1, -1]
+    )
+
+
+def test_clonotype_cell_operator():
+    obs_names = np.array(["c0", "c1", "c2", "c3", "c4", "c5"], dtype=object)
+    # clonotype 0: c4, c1; clonotype 1: c0, c5; clonotype 2: c3; c2 has no clonotype
+    cell_indices = CellIndices([0, 2, 4, 5], [4, 1, 0, 5, 3], obs_names)
+    distances = sp.csr_matrix(
+        np.array([[1, 3, 0], [3, 1, 2], [0, 2, 1]], dtype=np.uint8)
+    )
+    expected = np.array(
+        [
+            [1, 3, 0, 2, 3, 1],
+            [3, 1, 0, 0, 1, 3],
+            [0, 0, 0, 0, 0, 0],
+            [2, 0, 0, 1, 0, 2],
+            [3, 1, 0, 0, 1, 3],
+            [1, 3, 0, 2, 3, 1],
+        ]
+    )
+    op = ClonotypeCellOperator(distances, cell_indices.to_uns())
+    assert op.shape == (6, 6)
+    assert op.nnz == np.sum(expected > 0)
+    npt.assert_equal(op.tocsr().toarray(), expected)
+    x = np.arange(6, dtype=float)
+    npt.assert_almost_equal(op @ x, expected @ x)
+    npt.assert_almost_equal(op.rmatvec(x), expected.T @ x)
+    X = np.random.default_rng(0).random((6, 3))
+    npt.assert_almost_equal(op @ X, expected @ X)
+    # no overflow when summing small integer types
+    npt.assert_equal(op @ np.full(6, 200, dtype=np.uint8), expected @ np.full(6, 200))
+
+    indices, data = op.row(0)
+    npt.assert_equal(indices, [0, 1, 3, 4, 5])
+    npt.assert_equal(data, [1, 3, 2, 3, 1])
+    npt.assert_equal(op[3, :].toarray(), expected[[3], :])
+    npt.assert_equal(op[2, :].toarray(), expected[[2], :])
+    npt.assert_equal(op.neighbors([2, 3]), [0, 3, 5])
+    npt.assert_equal(op.neighbors([]), [])
+
+    # subset and reordered obs names
+    op = ClonotypeCellOperator(distances, cell_indices, ["c5", "c3", "x", "c1"])
+    npt.assert_equal(op.tocsr().toarray(), expected[np.ix_([5, 3, 2, 1], [5, 3, 2, 1])])
@@ -11,7 +11,12 @@ from scirpy.util.graph import (
     layout_components,
     _distance_to_connectivity,
     _get_sparse_from_igraph,
+    connected_components,
+    leiden_components,
+    layout_fr_size_aware,
+    UnionFind,
 )
+from scirpy.util.graph._fr_size_aware_layout import _QuadTree
 from itertools import combinations
 import igraph as ig
 import numpy as np
@@ -21,6 +26,7 @@ import pytest
 import scipy.sparse
 from .fixtures import adata_tra
 
+import random
 import warnings
 
 
@@ -201,6 +207,19 @@ def test_layout_components(arrange_boxes, component_layout):
         )
 
 
+@pytest.mark.parametrize("component_layout", ("fr_size_aware", "fr"))
+def test_layout_components_parallel(component_layout):
+    random.seed(0)
+    g = ig.Graph.Erdos_Renyi(n=200, m=150)
+    g.vs["size"] = np.random.default_rng(0).integers(1, 5, g.vcount())
+    kwargs = dict(component_layout=component_layout, random_state=42)
+    coords = layout_components(g, n_jobs=1, **kwargs)
+    assert coords.shape == (200, 2)
+    # same result independent of the number of jobs and the global random state
+    np.random.seed(1)
+    npt.assert_equal(layout_components(g, n_jobs=2, **kwargs), coords)
+
+
 def test_translate_dna_to_protein(adata_tra):
     for nt, aa in zip(
         adata_tra.obs["IR_VJ_1_junction"], adata_tra.obs["IR_VJ_1_junction_aa"]
@@ -288,3 +307,126 @@ def test_igraph_from_adjacency(matrix, is_symmetric, simplify):
             npt.assert_equal(matrix.toarray(), matrix_roundtrip.toarray())
     else:
         npt.assert_equal(matrix.toarray(), matrix_roundtrip.toarray())
+
+
+def test_igraph_from_adjacency_edges():
+    matrix = scipy.sparse.csr_matrix(
+        [[1.0, 0.5, 0.2], [0.5, 0.0, 0.0], [0.2, 0.0, 1.0]]
+    )
+    # explicit zeros are no edges
+    matrix[1, 2] = matrix[2, 1] = 0
+    assert matrix.nnz == 8
+    g = igraph_from_sparse_matrix(matrix, matrix_type="connectivity")
+    assert not g.is_directed()
+    assert g.get_edgelist() == [(0, 1), (0, 2)]
+    assert g.es["weight"] == [0.5, 0.2]
+    g = igraph_from_sparse_matrix(matrix, matrix_type="connectivity", simplify=False)
+    assert g.is_directed()
+    assert g.get_edgelist() == [(0, 0), (0, 1), (0, 2), (1, 0), (2, 0), (2, 2)]
+    g = igraph_from_sparse_matrix(
+        scipy.sparse.csr_matrix((4, 4)), matrix_type="connectivity"
+    )
+    assert g.vcount() == 4 and g.ecount() == 0
+
+
+def test_layout_fr_size_aware_barnes_hut():
+    random.seed(0)
+    graph = ig.Graph.Erdos_Renyi(n=100, m=300).clusters().giant()
+    graph.vs["size"] = np.random.default_rng(0).integers(1, 20, graph.vcount())
+
+    def _layout(**kwargs):
+        np.random.seed(0)
+        return layout_fr_size_aware(graph, **kwargs)
+
+    # without approximation, the forces are the same as the exact ones. The layout
+    # is chaotic, i.e. differences in rounding add up over many iterations.
+    npt.assert_allclose(
+        _layout(total_iterations=5),
+        _layout(total_iterations=5, barnes_hut_threshold=0, theta=0),
+    )
+    coords = _layout(barnes_hut_threshold=0)
+    assert coords.shape == (graph.vcount(), 2)
+    assert np.all((coords >= 0) & (coords <= 1))
+
+    # approximated repulsion
+    rng = np.random.default_rng(0)
+    positions, radii = rng.random((500, 2)), rng.random(500) * 1e-3
+    tree = _QuadTree(positions, radii)
+    exact = tree.repulsion(0.1, 0)
+    approx = tree.repulsion(0.1, 0.5, chunksize=100)
+    rel_error = np.linalg.norm(approx - exact, axis=1) / np.linalg.norm(exact, axis=1)
+    assert np.median(rel_error) < 0.01
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 100])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_connected_components(block_size, seed):
+    n = 60
+    matrix = scipy.sparse.random(
+        n, n, density=0.02, format="csr", random_state=seed, dtype=np.uint8
+    )
+    matrix.data[:] = 1
+    # symmetric, as distance matrices are
+    matrix = matrix + matrix.T
+    expected = (
+        igraph_from_sparse_matrix(matrix, matrix_type="distance")
+        .clusters(mode="weak")
+        .membership
+    )
+    npt.assert_equal(connected_components(matrix), expected)
+
+    uf = UnionFind.from_row_blocks(
+        ((i, matrix[i : i + block_size, :]) for i in range(0, n, block_size)), n
+    )
+    npt.assert_equal(uf.membership, expected)
+    assert np.all(uf.find(np.arange(n)) <= np.arange(n))
+
+
+def test_union_find():
+    uf = UnionFind(6)
+    npt.assert_equal(uf.membership, np.arange(6))
+    uf.union(np.array([5, 3]), np.array([3, 1]))
+    npt.assert_equal(uf.membership, [0, 1, 2, 1, 3, 1])
+    uf.union(np.array([4]), np.array([5]))
+    npt.assert_equal(uf.find(np.arange(6)), [0, 1, 2, 1, 1, 1])
+    # no-op
+    uf.union(np.array([1, 2]), np.array([4, 2]))
+    npt.assert_equal(uf.membership, [0, 1, 2, 1, 1, 1])
+
+
+def test_leiden_components():
+    # two 4-cliques connected by an edge, a single node, a pair and a triangle
+    edges = (
+        list(combinations(range(4), 2))
+        + list(combinations(range(4, 8), 2))
+        + [(3, 4), (9, 10), (11, 12), (12, 13), (11, 13)]
+    )
+    rows, cols = zip(*edges)
+    matrix = scipy.sparse.coo_matrix(
+        (np.ones(len(edges)), (rows, cols)), shape=(14, 14)
+    ).tocsr()
+    matrix = matrix + matrix.T + scipy.sparse.identity(14)
+    # 2 * number of edges = 34, i.e. the edge of the pair does not increase
+    # modularity with resolution 34.
+    resolutions = [0.1, 1, 34]
+    memberships = leiden_components(matrix, resolution=resolutions, n_jobs=1)
+    npt.assert_equal(
+        memberships,
+        [
+            [0, 0, 0, 0, 0, 0, 0, 0, 1, 2, 2, 3, 3, 3],
+            [0, 0, 0, 0, 1, 1, 1, 1, 2, 3, 3, 4, 4, 4],
+            np.arange(14),
+        ],
+    )
+    # same result as the Leiden algorithm on the entire graph
+    g = igraph_from_sparse_matrix(matrix, matrix_type="connectivity")
+    for resolution, membership in zip(resolutions, memberships):
+        random.seed(0)
+        expected = g.community_leiden(
+            objective_function="modularity", resolution_parameter=resolution
+        ).membership
+        npt.assert_equal(pd.factorize(np.array(expected))[0], membership)
+    # the result does not depend on the number of jobs
+    npt.assert_equal(
+        leiden_components(matrix, resolution=resolutions, n_jobs=2), memberships
+    )
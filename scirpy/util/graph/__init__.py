@@ -1,4 +1,3 @@
-from scanpy import logging
 import igraph as ig
 import numpy as np
 from scipy import sparse
@@ -7,6 +6,8 @@ from scipy.sparse import spmatrix, csr_matrix
 import itertools
 from ._component_layout import layout_components
 from ._fr_size_aware_layout import layout_fr_size_aware
+from ._connected_components import connected_components, UnionFind
+from ._leiden import leiden_components
 
 
 def igraph_from_sparse_matrix(
@@ -84,39 +85,33 @@ def _distance_to_connectivity(
     return connectivities
 
 
-def _get_igraph_from_adjacency(adj: csr_matrix, simplify=True):
+def _get_igraph_from_adjacency(adj: spmatrix, simplify=True):
     """Get an undirected igraph graph from adjacency matrix.
     Better than Graph.Adjacency for sparse matrices.
 
+    Edges and weights are taken directly from the sparse arrays and passed
+    to igraph as contiguous integer array.
+
     Parameters
     ----------
     adj
         sparse, weighted, symmetrical adjacency matrix.
+    simplify
+        If `True`, build an undirected graph from the upper triangle without the
+        diagonal. Otherwise, build a directed graph with an edge for each
+        non-zero entry.
     """
-    sources, targets = adj.nonzero()
-    weights = adj[sources, targets]
-    if isinstance(weights, np.matrix):
-        weights = weights.A1
-    if isinstance(weights, csr_matrix):
-        # this is the case when len(sources) == len(targets) == 0, see #236
-        weights = weights.toarray()
-
-    g = ig.Graph(directed=not simplify)
-    g.add_vertices(adj.shape[0])  # this adds adjacency.shape[0] vertices
-    g.add_edges(list(zip(sources, targets)))
-
-    g.es["weight"] = weights
-
-    if g.vcount() != adj.shape[0]:
-        logging.warning(
-            f"The constructed graph has only {g.vcount()} nodes. "
-            "Your adjacency matrix contained redundant nodes."
-        )  # type: ignore
-
     if simplify:
         # since we start from a symmetrical matrix, and the graph is undirected,
-        # it is fine to take either of the two edges when simplifying.
-        g.simplify(combine_edges="first")
+        # the upper triangle contains every edge exactly once.
+        adj = sparse.triu(adj, k=1, format="coo")
+    else:
+        adj = adj.tocoo()
+    nonzero = adj.data != 0
+    edges = np.column_stack([adj.row[nonzero], adj.col[nonzero]]).astype(np.int64)
+
+    g = ig.Graph(n=adj.shape[0], edges=edges, directed=not simplify)
+    g.es["weight"] = adj.data[nonzero]
 
     return g
 
@@ -1,7 +1,13 @@
-from typing import Optional
+from functools import partial
+import itertools
+from multiprocessing import cpu_count
+import random
+from typing import List, Optional, Sequence
 import igraph as ig
 import numpy as np
+from tqdm.contrib.concurrent import process_map
 from ..._compat import Literal
+from .. import tqdm
 from ._fr_size_aware_layout import layout_fr_size_aware
 
 
@@ -12,6 +18,8 @@ def layout_components(
     pad_x: float = 1.0,
     pad_y: float = 1.0,
     layout_kwargs: Optional[dict] = None,
+    n_jobs: Optional[int] = 1,
+    random_state: Optional[int] = None,
 ) -> np.ndarray:
     """
     Compute a graph layout by layouting all connected components individually.
@@ -39,6 +47,15 @@ def layout_components(
         Padding between subgraphs in the y dimension.
     layout_kwargs
         Additional arguments passed to the layouting algorithm used for each component.
+    n_jobs
+        Number of CPUs used for layouting the components in parallel. Small
+        components are processed in batches. If `None`, use all cores.
+    random_state
+        Each component is layouted with a random seed derived from this value
+        and its first vertex, such that the result does not depend on `n_jobs`.
+        If `None` and `n_jobs` is `1`, the global random state is used for all
+        components, one after another. If `None` and `n_jobs` is not `1`,
+        the seed is drawn from the global random state.
 
     Returns
     -------
@@ -69,12 +86,38 @@ def layout_components(
     ]
     bboxes = bbox_fun(component_sizes, pad_x, pad_y)
 
-    component_layouts = [
-        _layout_component(component, bbox, component_layout, layout_kwargs)
-        for component, bbox in zip(components, bboxes)
-    ]
+    if random_state is None and n_jobs != 1:
+        random_state = np.random.randint(np.iinfo(np.int32).max)
+    # the first vertex of a component has the smallest original id
+    seeds = (
+        [None] * len(components)
+        if random_state is None
+        else [random_state + component.vs[0]["id"] for component in components]
+    )
+    layout_fun = partial(
+        _layout_component_batch,
+        component_layout_func=component_layout,
+        layout_kwargs=layout_kwargs,
+    )
+    tasks = list(zip(components, bboxes, seeds))
+    if n_jobs == 1:
+        component_layouts = layout_fun(tasks)
+    else:
+        n_jobs = n_jobs if n_jobs is not None else cpu_count()
+        batches = _batch_components(
+            [len(component.vs) for component in components],
+            max_nodes=int(np.ceil(len(graph.vs) / (10 * n_jobs))),
+        )
+        component_layouts = itertools.chain.from_iterable(
+            process_map(
+                layout_fun,
+                [[tasks[i] for i in batch] for batch in batches],
+                max_workers=n_jobs,
+                tqdm_class=tqdm,
+            )
+        )
     # get vertexes back into their original order
-    coords = np.vstack(component_layouts)[vertex_sorter, :]
+    coords = np.vstack(list(component_layouts))[vertex_sorter, :]
     return coords
 
 
@@ -177,8 +220,40 @@ def _get_bbox_dimensions(n, power=0.5):
     return (n ** power, n ** power)
 
 
-def _layout_component(component, bbox, component_layout_func, layout_kwargs):
-    """Compute layout for an individual component"""
+def _batch_components(n_nodes: Sequence[int], max_nodes: int) -> List[List[int]]:
+    """Group consecutive components into batches of at most `max_nodes` nodes.
+    Components with more nodes form a batch on their own."""
+    batches, batch, batch_nodes = [], [], 0
+    for i, n in enumerate(n_nodes):
+        if len(batch) and batch_nodes + n > max_nodes:
+            batches.append(batch)
+            batch, batch_nodes = [], 0
+        batch.append(i)
+        batch_nodes += n
+    if len(batch):
+        batches.append(batch)
+    return batches
+
+
+def _layout_component_batch(tasks, component_layout_func, layout_kwargs):
+    """Compute the layouts for a list of `(component, bbox, seed)` tuples"""
+    return [
+        _layout_component(
+            component, bbox, component_layout_func, layout_kwargs, seed=seed
+        )
+        for component, bbox, seed in tasks
+    ]
+
+
+def _layout_component(component, bbox, component_layout_func, layout_kwargs, seed=None):
+    """Compute layout for an individual component.
+
+    If `seed` is not `None`, the random number generators of numpy (used by
+    `fr_size_aware`) and of the `random` module (used by igraph) are seeded.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
     if component_layout_func == "fr_size_aware":
         coords = layout_fr_size_aware(component, **layout_kwargs)
     else:
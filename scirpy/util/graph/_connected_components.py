@@ -0,0 +1,126 @@
+from typing import Iterable, Tuple, Union
+import numpy as np
+from scipy.sparse import spmatrix, csr_matrix
+from scipy.sparse import csgraph
+
+
+def connected_components(matrix: spmatrix) -> np.ndarray:
+    """
+    Find the (weakly) connected components of the graph defined by a sparse
+    adjacency or distance matrix.
+
+    This is equivalent to `graph.clusters(mode="weak").membership` on an igraph
+    object built with :func:`~scirpy.util.graph.igraph_from_sparse_matrix`, but
+    does not need to build the graph.
+
+    Parameters
+    ----------
+    matrix
+        Square sparse matrix. Non-zero entries define edges.
+
+    Returns
+    -------
+    The component of each node. Components are numbered in the order of their
+    first node.
+    """
+    _, membership = csgraph.connected_components(
+        csr_matrix(matrix), directed=True, connection="weak"
+    )
+    return membership
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        """
+        Disjoint-set data structure over `n` nodes that supports adding edges
+        in batches.
+
+        This allows to find connected components of a graph from a stream of
+        rows of its adjacency matrix without materializing the full matrix.
+
+        Each batch of edges is merged with a vectorized connected-components
+        step on the representatives of the involved nodes. The parent array is
+        kept flat, i.e. every node points directly to the representative
+        (the smallest node) of its set.
+
+        Parameters
+        ----------
+        n
+            Number of nodes
+        """
+        self.parent = np.arange(n)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.parent)
+
+    def union(self, a: np.ndarray, b: np.ndarray) -> None:
+        """Merge the sets of nodes `a[i]` and `b[i]` for all `i`."""
+        roots_a, roots_b = self.parent[a], self.parent[b]
+        different = roots_a != roots_b
+        if not np.any(different):
+            return
+        nodes, inverse = np.unique(
+            np.concatenate([roots_a[different], roots_b[different]]),
+            return_inverse=True,
+        )
+        n_different = np.sum(different)
+        _, labels = csgraph.connected_components(
+            csr_matrix(
+                (
+                    np.ones(n_different, dtype=bool),
+                    (inverse[:n_different], inverse[n_different:]),
+                ),
+                shape=(len(nodes), len(nodes)),
+            ),
+            directed=True,
+            connection="weak",
+        )
+        # `nodes` is sorted, i.e. the first node of each label is its minimum.
+        new_roots = np.full(np.max(labels) + 1, self.n_nodes)
+        np.minimum.at(new_roots, labels, nodes)
+        remap = np.arange(self.n_nodes)
+        remap[nodes] = new_roots[labels]
+        self.parent = remap[self.parent]
+
+    def union_rows(self, rows: spmatrix, offset: Union[int, np.ndarray] = 0) -> None:
+        """Add all edges defined by a block of rows of an adjacency matrix.
+
+        Parameters
+        ----------
+        rows
+            Sparse matrix with `n` columns. Non-zero entries define edges.
+        offset
+            Index of the node corresponding to the first row, or an array
+            with the node index of each row.
+        """
+        rows = rows.tocoo()
+        nonzero = rows.data != 0
+        row_nodes = (
+            np.asarray(offset)[rows.row[nonzero]]
+            if np.ndim(offset)
+            else rows.row[nonzero] + offset
+        )
+        self.union(row_nodes, rows.col[nonzero])
+
+    def find(self, nodes: np.ndarray) -> np.ndarray:
+        """Get the representative of each node"""
+        return self.parent[nodes]
+
+    @property
+    def membership(self) -> np.ndarray:
+        """The component of each node. Components are numbered in the order of
+        their first node, consistent with :func:`connected_components`."""
+        _, membership = np.unique(self.parent, return_inverse=True)
+        return membership
+
+    @staticmethod
+    def from_row_blocks(
+        blocks: Iterable[Tuple[Union[int, np.ndarray], spmatrix]], n: int
+    ) -> "UnionFind":
+        """Build a UnionFind from an iterable of `(offset, rows)` tuples.
+        See :meth:`union_rows`."""
+        uf = UnionFind(n)
+        for offset, rows in blocks:
+            uf.union_rows(rows, offset)
+        return uf
@@ -4,8 +4,10 @@ is aware of node sizes.
 Adapted from https://stackoverflow.com/questions/57423743/networkx-is-there-a-way-to-scale-a-position-of-nodes-in-a-graph-according-to-n/57432240#57432240
 """
 
+from functools import partial
 from typing import Mapping, Optional, Sequence, Tuple, Union
 import numpy as np
+import scipy.sparse as sp
 import warnings
 import igraph as ig
 
@@ -21,7 +23,9 @@ def layout_fr_size_aware(
     node_positions: Optional[Mapping[int, Tuple[float, float]]] = None,
     fixed_nodes: Optional[Sequence] = None,
     base_node_size: float = 1e-2,
-    size_power: float = 0.5
+    size_power: float = 0.5,
+    theta: float = 0.5,
+    barnes_hut_threshold: Optional[int] = 1000,
 ) -> np.ndarray:
     """
     Compute the Fruchterman-Reingold layout respecting node sizes.
@@ -63,6 +67,15 @@ def layout_fr_size_aware(
         and `scale`.
     fixed_nodes
         Nodes to keep fixed at their initial positions.
+    theta
+        Accuracy of the Barnes-Hut approximation of the repulsive forces.
+        A group of nodes in a cell of the quadtree acts as a single node in its
+        center of mass, if the cell width divided by the distance is less than
+        `theta`. With `theta=0`, the forces are exact, but require O(n^2) time.
+    barnes_hut_threshold
+        Use the Barnes-Hut approximation for graphs with at least this number of
+        nodes. The exact computation requires O(n^2) time and memory per iteration,
+        the approximation O(n log(n)). If `None`, the forces are always exact.
 
     Returns
     -------
@@ -179,7 +192,16 @@ def layout_fr_size_aware(
             dtype=np.bool,
         )
 
-    adjacency = _edge_list_to_adjacency_matrix(edge_list)
+    barnes_hut = barnes_hut_threshold is not None and (
+        total_nodes >= barnes_hut_threshold
+    )
+    if barnes_hut:
+        # the dense adjacency matrix would require O(n^2) memory
+        adjacency = _edge_list_to_sparse_adjacency_matrix(edge_list, unique_nodes)
+        fruchterman_reingold = partial(_fruchterman_reingold_barnes_hut, theta=theta)
+    else:
+        adjacency = _edge_list_to_adjacency_matrix(edge_list)
+        fruchterman_reingold = _fruchterman_reingold
 
     # Forces in FR are symmetric.
     # Hence we need to ensure that the adjacency matrix is also symmetric.
@@ -196,7 +218,7 @@ def layout_fr_size_aware(
     # main loop
 
     for ii, temperature in enumerate(temperatures):
-        node_positions_as_array[is_mobile] = _fruchterman_reingold(
+        node_positions_as_array[is_mobile] = fruchterman_reingold(
             adjacency,
             node_positions_as_array,
             origin=origin,
@@ -252,7 +274,7 @@ def _fruchterman_reingold(
         )
         rand_delta = np.random.rand(*delta.shape) * 1e-9
         is_zero = distance <= 0
-        delta[is_zero] = rand_delta[is_zeros]
+        delta[is_zero] = rand_delta[is_zero]
         distance = np.linalg.norm(delta, axis=-1)
 
     # subtract node radii from distances to prevent nodes from overlapping
@@ -271,17 +293,226 @@ def _fruchterman_reingold(
     attraction = _get_fr_attraction(distance, direction, adjacency, k)
     displacement = attraction + repulsion
 
-    # limit maximum displacement using temperature
+    return node_positions + _limit_displacement(displacement, temperature)
+
+
+def _limit_displacement(displacement, temperature):
+    """Limit the maximum displacement using the temperature"""
     displacement_length = np.linalg.norm(displacement, axis=-1)
-    displacement = (
+    return (
         displacement
         / displacement_length[:, None]
         * np.clip(displacement_length, None, temperature)[:, None]
     )
 
-    node_positions = node_positions + displacement
 
-    return node_positions
+def _fruchterman_reingold_barnes_hut(
+    adjacency, node_positions, origin, scale, temperature, k, node_radii, theta
+):
+    """
+    Inner loop of Fruchterman-Reingold layout algorithm with the repulsive
+    forces approximated by the Barnes-Hut algorithm.
+
+    Computes the same forces as :func:`_fruchterman_reingold`, but
+    `adjacency` is a sparse matrix and the memory requirement is linear in the
+    number of nodes and edges.
+    """
+    radii = np.broadcast_to(node_radii, (len(node_positions),))
+    repulsion = _QuadTree(node_positions, radii).repulsion(k, theta)
+
+    # attraction along edges, see `_get_fr_attraction`
+    adjacency = adjacency.tocoo()
+    delta = node_positions[adjacency.col] - node_positions[adjacency.row]
+    distance = np.linalg.norm(delta, axis=-1)
+    distance -= radii[adjacency.row] + radii[adjacency.col]
+    distance[distance <= 1e-6] = 1e-6
+    vectors = -delta * (distance / k * adjacency.data)[:, None]
+    attraction = np.column_stack(
+        [
+            np.bincount(adjacency.col, vectors[:, d], minlength=len(node_positions))
+            for d in range(node_positions.shape[1])
+        ]
+    )
+
+    displacement = attraction + repulsion
+    return node_positions + _limit_displacement(displacement, temperature)
+
+
+class _QuadTree:
+    """Quadtree over node positions for computing the repulsive forces of
+    the Fruchterman-Reingold layout with the Barnes-Hut approximation.
+
+    The tree is built from the Morton codes of the positions. The nodes of a
+    cell at level `l` are a contiguous range of the nodes sorted by their code,
+    i.e. each level of the tree is defined by the unique prefixes of the codes.
+    The tree is traversed level by level for many nodes at once.
+
+    Parameters
+    ----------
+    node_positions
+        Array with the 2D position of each node
+    node_radii
+        Array with the radius of each node
+    max_depth
+        Maximum depth of the tree. Nodes in the same cell at this depth interact
+        exactly.
+    leaf_size
+        Cells with at most this number of nodes are not split further.
+    """
+
+    def __init__(
+        self,
+        node_positions: np.ndarray,
+        node_radii: np.ndarray,
+        *,
+        max_depth: int = 16,
+        leaf_size: int = 8,
+    ):
+        if node_positions.shape[1] != 2:
+            raise ValueError("The Barnes-Hut approximation requires 2D positions.")
+        self.max_depth, self.leaf_size = max_depth, leaf_size
+        minima = np.min(node_positions, axis=0)
+        self.width = max(np.max(np.max(node_positions, axis=0) - minima), 1e-12)
+        grid = (
+            ((node_positions - minima) / self.width * (2 ** max_depth - 1))
+            .round()
+            .astype(np.uint64)
+        )
+        codes = _interleave_bits(grid[:, 0]) | (_interleave_bits(grid[:, 1]) << 1)
+        self.order = np.argsort(codes, kind="stable")
+        self.codes = codes[self.order]
+        self.positions = node_positions[self.order]
+        self.radii = node_radii[self.order]
+        # for each level: the first node, number of nodes, key, center of mass and
+        # mean radius of each cell.
+        self.levels = []
+        for level in range(max_depth + 1):
+            keys = self.codes >> np.uint64(2 * (max_depth - level))
+            start = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            count = np.diff(np.r_[start, len(keys)])
+            self.levels.append(
+                {
+                    "start": start,
+                    "count": count,
+                    "key": keys[start],
+                    "center": np.add.reduceat(self.positions, start, axis=0)
+                    / count[:, None],
+                    "radius": np.add.reduceat(self.radii, start) / count,
+                }
+            )
+        # the children of each cell are a contiguous range of cells on the next level
+        for parent, child in zip(self.levels[:-1], self.levels[1:]):
+            child_parent = child["key"] >> np.uint64(2)
+            parent["children"] = (
+                np.searchsorted(child_parent, parent["key"], side="left"),
+                np.searchsorted(child_parent, parent["key"], side="right"),
+            )
+
+    def repulsion(self, k: float, theta: float, *, chunksize: int = 2000) -> np.ndarray:
+        """Compute the repulsive force on each node, see `_get_fr_repulsion`.
+
+        Nodes are processed in chunks to limit the memory requirement."""
+        n = len(self.positions)
+        force = np.zeros((n, 2))
+        for chunk_start in range(0, n, chunksize):
+            nodes = np.arange(chunk_start, min(chunk_start + chunksize, n))
+            force += self._traverse(nodes, k, theta)
+        res = np.empty_like(force)
+        res[self.order] = force
+        return res
+
+    def _force(self, nodes, delta, radii, count, k):
+        """Repulsion from `count` nodes at distance `delta` with mean radius `radii`
+        on `nodes`, summed for each node."""
+        distance = np.linalg.norm(delta, axis=-1)
+        distance -= self.radii[nodes] + radii
+        distance[distance <= 1e-6] = 1e-6
+        vectors = delta * (count * k ** 2 / distance ** 2)[:, None]
+        n = len(self.positions)
+        return np.column_stack(
+            [np.bincount(nodes, vectors[:, d], minlength=n) for d in range(2)]
+        )
+
+    def _traverse(self, nodes, k, theta):
+        n = len(self.positions)
+        force = np.zeros((n, 2))
+        # pairs of a node and a cell on the current level
+        cells = np.zeros(len(nodes), dtype=np.int64)
+        for depth, level in enumerate(self.levels):
+            if not len(nodes):
+                break
+            cell_width = self.width / 2 ** depth
+            delta = self.positions[nodes] - level["center"][cells]
+            distance = np.linalg.norm(delta, axis=-1)
+            is_own = (
+                self.codes[nodes] >> np.uint64(2 * (self.max_depth - depth))
+            ) == level["key"][cells]
+            is_far = ~is_own & (cell_width < theta * distance)
+            force += self._force(
+                nodes[is_far],
+                delta[is_far],
+                level["radius"][cells[is_far]],
+                level["count"][cells[is_far]],
+                k,
+            )
+
+            # cells with few nodes interact exactly with each of their nodes
+            is_leaf = ~is_far & (
+                (level["count"][cells] <= self.leaf_size) | (depth == self.max_depth)
+            )
+            owner, others = _expand_ranges(
+                level["start"][cells[is_leaf]], level["count"][cells[is_leaf]]
+            )
+            leaf_nodes = nodes[is_leaf][owner]
+            not_self = leaf_nodes != others
+            leaf_nodes, others = leaf_nodes[not_self], others[not_self]
+            force += self._force(
+                leaf_nodes,
+                self.positions[leaf_nodes] - self.positions[others],
+                self.radii[others],
+                1,
+                k,
+            )
+
+            # all other cells are split
+            is_split = ~is_far & ~is_leaf
+            if depth < self.max_depth:
+                child_start, child_end = level["children"]
+                split_cells = cells[is_split]
+                owner, cells = _expand_ranges(
+                    child_start[split_cells],
+                    child_end[split_cells] - child_start[split_cells],
+                )
+                nodes = nodes[is_split][owner]
+        return force
+
+
+def _expand_ranges(starts, counts):
+    """Expand the ranges `starts[i]:starts[i] + counts[i]`.
+
+    Returns
+    -------
+    owner
+        For each element, the index of its range.
+    values
+        The elements of all ranges.
+    """
+    owner = np.repeat(np.arange(len(starts)), counts)
+    values = np.arange(np.sum(counts)) + np.repeat(
+        starts - np.cumsum(counts) + counts, counts
+    )
+    return owner, values
+
+
+def _interleave_bits(x):
+    """Spread the lower 16 bits of `x`, such that there is a zero bit
+    between two bits."""
+    x = x & np.uint64(0xFFFF)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x33333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x55555555)
+    return x
 
 
 def _get_fr_repulsion(distance, direction, k):
@@ -335,6 +566,22 @@ def _get_unique_nodes(edge_list):
     return list(set(_flatten(edge_list)))
 
 
+def _edge_list_to_sparse_adjacency_matrix(edge_list, nodes):
+    """Sparse version of `_edge_list_to_adjacency_matrix` with the rows and
+    columns in the order of `nodes`."""
+    node_to_idx = {node: i for i, node in enumerate(nodes)}
+    edges = np.array(
+        [(node_to_idx[s], node_to_idx[t]) for s, t in edge_list], dtype=np.int64
+    ).reshape(-1, 2)
+    adjacency = sp.coo_matrix(
+        (np.ones(len(edges)), (edges[:, 0], edges[:, 1])),
+        shape=(len(nodes), len(nodes)),
+    ).tocsr()
+    # duplicate edges are not summed up, as in the dense version
+    adjacency.data[:] = 1
+    return adjacency
+
+
 def _edge_list_to_adjacency_matrix(edge_list, edge_weights=None):
 
     sources = [s for (s, _) in edge_list]
@@ -0,0 +1,171 @@
+from multiprocessing import cpu_count
+import random
+from typing import Optional, Sequence
+
+import igraph as ig
+import numpy as np
+from scipy.sparse import spmatrix, triu
+from tqdm.contrib.concurrent import process_map
+
+from ._connected_components import connected_components
+from .. import tqdm
+
+
+def _leiden_component(
+    edges: np.ndarray,
+    n_nodes: int,
+    resolutions: Sequence[float],
+    n_iterations: int,
+    seed: Optional[int],
+) -> np.ndarray:
+    """Run the Leiden algorithm with all `resolutions` on a single component.
+
+    `resolutions` are already normalized by the total degree of the entire graph.
+
+    Returns
+    -------
+    Array with the membership of each node, with one row per resolution.
+    """
+    g = ig.Graph(n=n_nodes, edges=edges.tolist())
+    degree = g.degree()
+    memberships = np.empty((len(resolutions), n_nodes), dtype=np.int64)
+    for i, resolution in enumerate(resolutions):
+        if seed is not None:
+            # igraph uses the random number generator of the `random` module
+            random.seed(seed)
+        # CPM with degrees as node weights is modularity with a fixed
+        # normalization of the resolution, i.e. the one of the entire graph.
+        memberships[i, :] = g.community_leiden(
+            objective_function="CPM",
+            node_weights=degree,
+            resolution_parameter=resolution,
+            n_iterations=n_iterations,
+        ).membership
+    return memberships
+
+
+def leiden_components(
+    adjacency: spmatrix,
+    *,
+    resolution: Sequence[float] = (1,),
+    n_iterations: int = 5,
+    random_state: Optional[int] = 0,
+    n_jobs: Optional[int] = None,
+    min_size: int = 3,
+) -> np.ndarray:
+    """
+    Find communities in the (unweighted) graph defined by a sparse adjacency or
+    distance matrix by optimizing modularity with the Leiden algorithm.
+
+    Communities never span multiple connected components. Each component is
+    therefore partitioned separately, and components in parallel. The resolution
+    is normalized by the number of edges in the entire graph, such that the
+    objective function is the same as for a run on the entire graph.
+    Components with less than `min_size` nodes are partitioned directly: a
+    pair of nodes is merged, unless the resolution is too high for a single
+    edge to increase modularity.
+
+    Parameters
+    ----------
+    adjacency
+        Square, symmetric sparse matrix. Non-zero entries define edges.
+        The diagonal is ignored.
+    resolution
+        One or multiple `resolution_parameter` values for the Leiden algorithm.
+        The graph is only decomposed once for all values.
+    n_iterations
+        `n_iterations` parameter for the Leiden algorithm.
+    random_state
+        Each component is partitioned with a random seed derived from this
+        value and its first node, such that the results don't depend on
+        `n_jobs`. If `None`, the random number generator is not seeded.
+    n_jobs
+        Number of CPUs to use. Default: use all cores.
+    min_size
+        Minimal number of nodes of components that are partitioned with the
+        Leiden algorithm.
+
+    Returns
+    -------
+    Array with the community of each node, with one row per resolution.
+    Communities are numbered in the order of their first node.
+    """
+    resolution = np.atleast_1d(np.asarray(resolution, dtype=float))
+    n_nodes = adjacency.shape[0]
+    edges = triu(adjacency, k=1, format="coo")
+    edges.eliminate_zeros()
+    # total degree of the entire graph, see `community_leiden` of igraph
+    total_degree = 2 * edges.nnz
+    if total_degree > 0:
+        resolution = resolution / total_degree
+
+    component = connected_components(edges)
+    component_size = np.bincount(component)
+    # nodes ordered by component, and the range of each component.
+    nodes = np.argsort(component, kind="stable")
+    comp_indptr = np.zeros(len(component_size) + 1, dtype=np.int64)
+    np.cumsum(component_size, out=comp_indptr[1:])
+    position = np.empty(n_nodes, dtype=np.int64)
+    position[nodes] = np.arange(n_nodes) - comp_indptr[component[nodes]]
+
+    # initially, every component is a community. The nodes of a pair are merged,
+    # if the edge increases modularity, i.e. 1 > resolution * degree ** 2.
+    memberships = np.zeros((len(resolution), n_nodes), dtype=np.int64)
+    memberships[:, :] = np.where(
+        (component_size[component] == 2)[np.newaxis, :] & (resolution >= 1)[:, None],
+        position,
+        0,
+    )
+
+    large = np.flatnonzero(component_size >= min_size)
+    edge_component = component[edges.row]
+    edge_order = np.argsort(edge_component, kind="stable")
+    edge_indptr = np.zeros(len(component_size) + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(edge_component, minlength=len(component_size)), out=edge_indptr[1:]
+    )
+    edge_positions = np.column_stack(
+        [position[edges.row[edge_order]], position[edges.col[edge_order]]]
+    )
+    seeds = (
+        [None] * len(large)
+        if random_state is None
+        else [random_state + int(nodes[comp_indptr[c]]) for c in large]
+    )
+    tasks = [
+        (
+            edge_positions[edge_indptr[c] : edge_indptr[c + 1]],
+            component_size[c],
+            resolution,
+            n_iterations,
+            seed,
+        )
+        for c, seed in zip(large, seeds)
+    ]
+    if n_jobs == 1 or len(tasks) <= 1:
+        results = [_leiden_component(*task) for task in tasks]
+    else:
+        results = process_map(
+            _leiden_component,
+            *zip(*tasks),
+            max_workers=n_jobs if n_jobs is not None else cpu_count(),
+            chunksize=max(1, len(tasks) // (50 * cpu_count())),
+            tqdm_class=tqdm,
+        )
+    for c, result in zip(large, results):
+        comp_nodes = nodes[comp_indptr[c] : comp_indptr[c + 1]]
+        memberships[:, comp_nodes] = result
+
+    # make community ids unique across components and number them in the order
+    # of their first node.
+    max_community = np.max(memberships, initial=0) + 1
+    for i in range(len(resolution)):
+        _, first, inverse = np.unique(
+            component * max_community + memberships[i, :],
+            return_index=True,
+            return_inverse=True,
+        )
+        rank = np.empty_like(first)
+        rank[np.argsort(first)] = np.arange(len(first))
+        memberships[i, :] = rank[inverse]
+    return memberships